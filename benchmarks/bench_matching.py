@@ -0,0 +1,110 @@
+"""Benchmark the vectorised batch matcher against the per-pair matching loop.
+
+Usage: python -m benchmarks.bench_matching [--offers N] [--preferences N] [--sample N]
+
+The loop is far too slow to run over the full cross product, so it is timed
+on a sample of preferences and extrapolated. The batch result for that sample
+is checked against the loop to make sure both agree.
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from core.offer_query import price_bounds
+from models.offer import Offer, Location as OfferLocation, Category as OfferCategory
+from models.preferences import Preference, Location, Category, Price
+from runners.matching import BatchMatcher
+from utils.helpers import as_utc
+
+STATES = [f"state-{i}" for i in range(16)]
+CITIES = [f"city-{i}" for i in range(400)]
+CATEGORIES = [f"cat-{i}" for i in range(30)]
+SUBCATEGORIES = [f"sub-{i}" for i in range(8)]
+TIME_WINDOWS = [86400, 172800, 259200, 604800, 1209600]
+
+def loop_matches(offer: Offer, preference: Preference, now: datetime) -> bool:
+    """One offer against one preference in plain Python, the way matching used to run."""
+    low, high = price_bounds(preference.price)
+    return (
+        (not preference.location.city_id or offer.location.city_id == preference.location.city_id)
+        and (not preference.location.state_id or offer.location.state_id == preference.location.state_id)
+        and (not preference.category.category_id or offer.category.category_id == preference.category.category_id)
+        and (not preference.category.subcategory_id
+             or offer.category.subcategory_id == preference.category.subcategory_id)
+        and low <= offer.price <= high
+        and as_utc(offer.created_at) >= now - timedelta(seconds=preference.time_window)
+    )
+
+def make_offers(count: int, now: datetime, rng: random.Random) -> list[Offer]:
+    offers = []
+    for i in range(count):
+        city = rng.randrange(len(CITIES))
+        category = rng.randrange(len(CATEGORIES))
+        offers.append(Offer(
+            _id=f"offer-{i}", title="", description="", address="", offer_date="",
+            location=OfferLocation(city_id=CITIES[city], state_id=STATES[city % len(STATES)]),
+            category=OfferCategory(category_id=CATEGORIES[category], subcategory_id=f"{CATEGORIES[category]}-{rng.choice(SUBCATEGORIES)}"),
+            price=rng.choice([0.0, float(rng.randrange(1, 500))]),
+            created_at=now - timedelta(seconds=rng.randrange(0, 1209600 * 2)),
+        ))
+    return offers
+
+def make_preferences(count: int, rng: random.Random) -> list[Preference]:
+    preferences = []
+    for _ in range(count):
+        city = rng.randrange(len(CITIES))
+        category = rng.randrange(len(CATEGORIES))
+        scope = rng.random()
+        price_to = rng.choice([0, 0, 50, 200])
+        preferences.append(Preference(
+            location=Location(
+                city_id=CITIES[city] if scope < 0.8 else None,
+                state_id=STATES[city % len(STATES)] if scope < 0.95 else None,
+            ),
+            category=Category(
+                category_id=CATEGORIES[category] if rng.random() < 0.9 else None,
+                subcategory_id=f"{CATEGORIES[category]}-{rng.choice(SUBCATEGORIES)}" if rng.random() < 0.5 else None,
+            ),
+            price=Price(price_from=rng.choice([0, 0, 10]), price_to=price_to),
+            time_window=rng.choice(TIME_WINDOWS),
+        ))
+    return preferences
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--offers", type=int, default=100_000)
+    parser.add_argument("--preferences", type=int, default=50_000)
+    parser.add_argument("--sample", type=int, default=50, help="preferences timed with the loop")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    offers = make_offers(args.offers, now, rng)
+    preferences = make_preferences(args.preferences, rng)
+
+    start = time.perf_counter()
+    matcher = BatchMatcher(preferences)
+    pref_indices, offer_indices = matcher.match(offers, now=now)
+    batch_seconds = time.perf_counter() - start
+    print(f"batch: {len(pref_indices)} matches in {batch_seconds:.2f}s")
+
+    sample = rng.sample(range(len(preferences)), min(args.sample, len(preferences)))
+    start = time.perf_counter()
+    expected = {
+        (p, o) for p in sample for o, offer in enumerate(offers)
+        if loop_matches(offer, preferences[p], now)
+    }
+    loop_seconds = (time.perf_counter() - start) * len(preferences) / len(sample)
+    print(f"loop:  ~{loop_seconds:.1f}s (extrapolated from {len(sample)} preferences)")
+
+    sampled = set(sample)
+    actual = {(p, o) for p, o in zip(pref_indices.tolist(), offer_indices.tolist()) if p in sampled}
+    if actual != expected:
+        raise SystemExit(f"batch and loop disagree on {len(actual ^ expected)} pairs")
+    print(f"speedup: {loop_seconds / batch_seconds:.0f}x")
+
+if __name__ == "__main__":
+    main()
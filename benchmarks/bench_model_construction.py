@@ -0,0 +1,77 @@
+"""Benchmark building models from Mongo documents.
+
+Usage: python -m benchmarks.bench_model_construction [--offers N] [--users N] [--repeat N]
+
+Compares the validated constructors used on every read with an unvalidated
+path built from ``model_construct`` (applied recursively, since it does not
+build nested models by itself). With pydantic-core doing validation in Rust,
+the Python-level ``model_construct`` path is the slower one, which is why
+reads keep going through the validated constructors.
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+from benchmarks.bench_matching import make_offers, make_preferences
+from models.offer import Offer, Location as OfferLocation, Category as OfferCategory
+from models.preferences import UserPreferences, Preference, Location, Category, Price
+
+def construct_offer(doc: dict) -> Offer:
+    data = dict(doc, _id=str(doc["_id"]))
+    data["location"] = OfferLocation.model_construct(**data["location"])
+    data["category"] = OfferCategory.model_construct(**data["category"])
+    return Offer.model_construct(**data)
+
+def construct_user_preferences(doc: dict) -> UserPreferences:
+    preferences = []
+    for preference in doc["preferences"]:
+        data = dict(preference)
+        data["location"] = Location.model_construct(**data["location"])
+        data["category"] = Category.model_construct(**data["category"])
+        data["price"] = Price.model_construct(**data["price"])
+        preferences.append(Preference.model_construct(**data))
+    return UserPreferences.model_construct(**dict(doc, preferences=preferences))
+
+def timed(label: str, build, docs: list[dict], repeat: int) -> float:
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for doc in docs:
+            build(doc)
+        seconds = min(seconds, time.perf_counter() - start)
+    print(f"{label:<32} {seconds:.3f}s ({len(docs) / seconds:,.0f} docs/s)")
+    return seconds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--offers", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    offer_docs = [offer.model_dump(by_alias=True) for offer in make_offers(args.offers, datetime.now(timezone.utc), rng)]
+    user_docs = []
+    for user_id in range(args.users):
+        preferences = make_preferences(rng.randint(1, 3), rng)
+        for preference in preferences:
+            preference.id = str(ObjectId())
+            preference.sent_offers = [doc["_id"] for doc in rng.sample(offer_docs, 20)]
+        user_docs.append(UserPreferences(user_id=user_id, preferences=preferences).model_dump(by_alias=True))
+
+    cases = (
+        ("Offer", lambda doc: Offer(**doc), construct_offer, offer_docs),
+        ("UserPreferences", lambda doc: UserPreferences(**doc), construct_user_preferences, user_docs),
+    )
+    for name, validated_build, constructed_build, docs in cases:
+        validated = timed(f"{name} validated", validated_build, docs, args.repeat)
+        constructed = timed(f"{name} model_construct", constructed_build, docs, args.repeat)
+        print(f"{name}: model_construct takes {constructed / validated:.2f}x the validated time\n")
+
+if __name__ == "__main__":
+    main()
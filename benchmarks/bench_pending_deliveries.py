@@ -0,0 +1,98 @@
+"""Benchmark the pending-deliveries aggregation against per-preference queries.
+
+Usage: python -m benchmarks.bench_pending_deliveries [--offers N] [--users N] [--uri URI] [--db NAME]
+
+Needs a running mongod. Synthetic offers and preferences are written to a
+throwaway database, which is dropped afterwards. Both paths must produce the
+same set of (user_id, preference_id, offer_id) deliveries.
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+from benchmarks.bench_matching import make_offers, make_preferences
+from core.config import config
+from core.mongo_client import MongoClientManager
+from core.offer_query import compile_offer_filter
+from models.preferences import UserPreferences
+from runners.matching import group_preferences
+
+def seed(mongo_client, offer_count: int, user_count: int, now: datetime, rng: random.Random):
+    offers = make_offers(offer_count, now, rng)
+    mongo_client.offers_collection.insert_many([offer.model_dump(by_alias=True) for offer in offers])
+
+    offer_ids = [offer.id for offer in offers]
+    users = []
+    for user_id in range(user_count):
+        preferences = make_preferences(rng.randint(1, 3), rng)
+        for preference in preferences:
+            preference.id = str(ObjectId())
+            preference.sent_offers = rng.sample(offer_ids, 5)
+        users.append(UserPreferences(user_id=user_id, preferences=preferences).model_dump(by_alias=True))
+    mongo_client.user_preferences_collection.insert_many(users)
+    mongo_client.ensure_offer_indexes()
+
+def query_path(mongo_client, now: datetime) -> set[tuple[int, str, str]]:
+    """The sender's default path: one query per distinct preference."""
+    user_preferences = mongo_client.get_all_user_preferences()
+    sent_by_user = {
+        user_prefs.user_id: set().union(*(p.sent_offers for p in user_prefs.preferences))
+        for user_prefs in user_preferences
+    }
+    deliveries = set()
+    for subscribers in group_preferences(user_preferences).values():
+        offers = mongo_client.get_matching_offers(compile_offer_filter(subscribers[0][1], now=now))
+        for user_prefs, preference in subscribers:
+            sent_offers = sent_by_user[user_prefs.user_id]
+            deliveries.update(
+                (user_prefs.user_id, preference.id, offer["_id"])
+                for offer in offers if offer["_id"] not in sent_offers
+            )
+    return deliveries
+
+def aggregate_path(mongo_client, now: datetime) -> set[tuple[int, str, str]]:
+    return {
+        (user_id, preference.id, offer["_id"])
+        for user_id, preference, offers in mongo_client.iter_pending_matches(now)
+        for offer in offers
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--offers", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="kk_bench")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config.MONGO_URI, config.MONGO_DB_NAME = args.uri, args.db
+    mongo_client = MongoClientManager()
+    mongo_client.client.drop_database(args.db)
+
+    now = datetime.now(timezone.utc)
+    try:
+        seed(mongo_client, args.offers, args.users, now, random.Random(args.seed))
+
+        start = time.perf_counter()
+        expected = query_path(mongo_client, now)
+        query_seconds = time.perf_counter() - start
+        print(f"query:     {len(expected)} deliveries in {query_seconds:.2f}s")
+
+        start = time.perf_counter()
+        actual = aggregate_path(mongo_client, now)
+        aggregate_seconds = time.perf_counter() - start
+        print(f"aggregate: {len(actual)} deliveries in {aggregate_seconds:.2f}s")
+
+        if actual != expected:
+            raise SystemExit(f"paths disagree on {len(actual ^ expected)} deliveries")
+        print(f"speedup: {query_seconds / aggregate_seconds:.1f}x")
+    finally:
+        mongo_client.client.drop_database(args.db)
+
+if __name__ == "__main__":
+    main()
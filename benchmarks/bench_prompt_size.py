@@ -0,0 +1,58 @@
+"""Compare the size of the compiled extraction prompt with the one built per call before.
+
+Usage: python -m benchmarks.bench_prompt_size [--count-tokens]
+
+The previous prompt embedded categories.json pretty-printed with
+``json.dumps(indent=2)`` plus a sample of cities, rebuilt on every call.
+Characters are always reported; ``--count-tokens`` also asks Gemini for
+exact token counts (needs GOOGLE_API_KEY and langchain-google-genai).
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+from core.constants import DATA_DIR, CATEGORIES_FILE, CITIES_FILE
+from prompts.prompts import PREFERENCE_EXTRACTION_PROMPT, build_preference_extraction_prompt
+
+def legacy_prompt(categories: dict, cities: dict) -> str:
+    """The system prompt as extract_preference_data assembled it for each call, with today's rules text."""
+    cities_sample = "\n".join(
+        f"{state}: {', '.join(list(state_data.get('cities', {}))[:5])}"
+        for state, state_data in list(cities.items())[:3]
+    )
+    rules = PREFERENCE_EXTRACTION_PROMPT.split("\n\nCategories (")[0].format()
+    return f"""{rules}
+
+Available categories:
+{json.dumps(categories, indent=2, ensure_ascii=False)}
+
+Sample cities (there are more available):
+{cities_sample}"""
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count-tokens", action="store_true")
+    args = parser.parse_args()
+
+    data_path = Path(DATA_DIR)
+    categories = json.loads((data_path / CATEGORIES_FILE).read_text(encoding="utf-8"))
+    cities = json.loads((data_path / CITIES_FILE).read_text(encoding="utf-8"))
+    prompts = {
+        "legacy": legacy_prompt(categories, cities),
+        "compiled": build_preference_extraction_prompt(categories),
+    }
+
+    llm = None
+    if args.count_tokens:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        from core.config import config
+        llm = ChatGoogleGenerativeAI(model=config.GEMINI_MODEL, google_api_key=config.GOOGLE_API_KEY)
+
+    for label, prompt in prompts.items():
+        tokens = f", {llm.get_num_tokens(prompt)} tokens" if llm else ""
+        print(f"{label + ':':10} {len(prompt)} characters{tokens}")
+    print(f"reduction: {len(prompts['legacy']) / len(prompts['compiled']):.1f}x")
+
+if __name__ == "__main__":
+    main()
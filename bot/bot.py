@@ -2,8 +2,9 @@ import logging
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ConversationHandler
 
 from core.config import config
-from core.constants import MAIN_MENU
-from bot.handlers import start, main_menu, cancel, handle_callback_query
+from core.constants import MAIN_MENU, WEBHOOK_PATH
+from bot.handlers import start, main_menu, cancel, handle_callback_query, extractions
+from bot.update_processor import UserOrderedUpdateProcessor
 
 # Configure logging
 logging.basicConfig(
@@ -23,7 +24,14 @@ def run_bot():
     for attempt in range(max_retries):
         try:
             logger.info(f"Starting bot (attempt {attempt + 1}/{max_retries})")
-            app = ApplicationBuilder().token(config.BOT_TOKEN).build()
+            app = (
+                ApplicationBuilder()
+                .token(config.BOT_TOKEN)
+                .concurrent_updates(UserOrderedUpdateProcessor(
+                    config.BOT_MAX_CONCURRENT_UPDATES, on_queued=extractions.cancel
+                ))
+                .build()
+            )
 
             # Create conversation handler
             conv_handler = ConversationHandler(
@@ -38,8 +46,19 @@ def run_bot():
             app.add_handler(conv_handler)
             app.add_handler(CallbackQueryHandler(handle_callback_query))
 
-            logger.info("Bot started successfully. Polling for updates...")
-            app.run_polling()
+            if config.BOT_WEBHOOK_URL:
+                webhook_url = f"{config.BOT_WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}"
+                logger.info(f"Bot started successfully. Receiving updates on {webhook_url}...")
+                app.run_webhook(
+                    listen="0.0.0.0",
+                    port=config.BOT_WEBHOOK_PORT,
+                    url_path=WEBHOOK_PATH,
+                    webhook_url=webhook_url,
+                    secret_token=config.BOT_WEBHOOK_SECRET
+                )
+            else:
+                logger.info("Bot started successfully. Polling for updates...")
+                app.run_polling()
             break  # If we get here, the bot ran successfully
 
         except Exception as e:
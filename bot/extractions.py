@@ -0,0 +1,46 @@
+"""Running LLM extractions per user, so a newer update can cancel a stale one."""
+
+import asyncio
+from collections.abc import Awaitable
+from typing import TypeVar
+
+T = TypeVar("T")
+
+class UserExtractions:
+    """The running extraction of each user.
+
+    A handler waiting for Gemini keeps the user's later updates waiting too.
+    Whoever sees such a later update arrive calls ``cancel``, and the waiting
+    handler gets None instead of an answer nobody wants any more.
+    """
+
+    def __init__(self):
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def cancel(self, user_id: int) -> bool:
+        """Cancel the user's running extraction. Returns whether one was running."""
+        task = self._tasks.pop(user_id, None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    async def run(self, user_id: int, extraction: Awaitable[T]) -> T | None:
+        """Run ``extraction`` as the user's current one, cancelling an earlier one.
+
+        Returns None when this extraction is cancelled through ``cancel``.
+        Cancelling the calling handler itself still raises CancelledError.
+        """
+        self.cancel(user_id)
+        task = asyncio.ensure_future(extraction)
+        self._tasks[user_id] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # Only swallow the cancellation of a superseded extraction, not of the handler
+            if task.cancelled() and self._tasks.get(user_id) is not task:
+                return None
+            raise
+        finally:
+            if self._tasks.get(user_id) is task:
+                del self._tasks[user_id]
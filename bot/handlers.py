@@ -1,5 +1,6 @@
 """Improved conversation handlers for the Telegram bot."""
 
+import asyncio
 import logging
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
@@ -9,20 +10,39 @@ from core.constants import (
     MSG_WELCOME, MSG_HELP, MSG_NO_PREFERENCES, MSG_PREFERENCES_REMOVED, 
     MSG_NO_PREFERENCES_TO_REMOVE, MSG_PREFERENCE_SAVED, MSG_ENTER_LOCATION, 
     MSG_ENTER_PRICE, MSG_ENTER_CATEGORY, MSG_ENTER_TIME, MSG_PROCESSING,
-    MSG_TELL_ME_WHAT_LOOKING_FOR
+    MSG_TELL_ME_WHAT_LOOKING_FOR, MSG_EXTRACTION_TIMEOUT
 )
-from core.mongo_client import MongoClientManager
+from core.async_mongo_client import AsyncMongoClientManager
+from bot.extractions import UserExtractions
 from llm.gemini_client import GeminiClient
 from llm.formatters import format_location, format_category, format_price, format_time_window
 from models.preferences import Location, Category, Price, Preference
 from bot.keyboards import get_main_menu_keyboard, get_remove_keyboard
 
 logger = logging.getLogger(__name__)
-mongo_client = MongoClientManager()
-gemini_client = GeminiClient()
+mongo_client = AsyncMongoClientManager()
+gemini_client = GeminiClient(cache_store=mongo_client.mongo_client)
+extractions = UserExtractions()
+
+async def extract_latest(update: Update, user_input: str, field: str | None = None) -> dict | None:
+    """Extract preference data for the user's newest message.
+
+    Returns None when the extraction was cancelled because a newer update of
+    the same user arrived, since its answer would be stale. ``field`` names
+    the preference field being edited, if any.
+    """
+    return await extractions.run(
+        update.effective_user.id, gemini_client.aextract_preference_data(user_input, field)
+    )
+
+async def reply_extraction_timeout(update: Update):
+    await update.message.reply_text(MSG_EXTRACTION_TIMEOUT, reply_markup=get_main_menu_keyboard())
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a welcome message when the /start command is issued."""
+    # A user who talks to the bot can receive offers again
+    await mongo_client.reactivate_user(update.effective_user.id)
+    
     await update.message.reply_text(
         f"{MSG_WELCOME}\n{MSG_HELP}",
         reply_markup=get_main_menu_keyboard(),
@@ -89,7 +109,10 @@ async def handle_preference_input(update: Update, context: ContextTypes.DEFAULT_
         processing_msg = await update.message.reply_text(MSG_PROCESSING)
         
         # Extract data using Gemini
-        extracted_data = gemini_client.extract_preference_data(user_input)
+        extracted_data = await extract_latest(update, user_input)
+        if extracted_data is None:
+            await processing_msg.delete()
+            return
         
         # Store in context
         context.user_data["preference_draft"] = extracted_data
@@ -100,6 +123,9 @@ async def handle_preference_input(update: Update, context: ContextTypes.DEFAULT_
         # Show confirmation
         await show_confirmation(update, context, extracted_data)
         
+    except asyncio.TimeoutError:
+        await processing_msg.delete()
+        await reply_extraction_timeout(update)
     except Exception as e:
         logger.error(f"Error processing input: {e}")
         await update.message.reply_text(
@@ -186,7 +212,11 @@ async def handle_location_edit(update: Update, context: ContextTypes.DEFAULT_TYP
         processing_msg = await update.message.reply_text(MSG_PROCESSING)
         
         # Re-extract with new location
-        location_data = gemini_client.extract_preference_data(f"location: {location_text}")["location"]
+        extracted_data = await extract_latest(update, location_text, field="location")
+        if extracted_data is None:
+            await processing_msg.delete()
+            return
+        location_data = extracted_data["location"]
         
         # Update draft
         draft = context.user_data.get("preference_draft", {})
@@ -197,6 +227,9 @@ async def handle_location_edit(update: Update, context: ContextTypes.DEFAULT_TYP
         await processing_msg.delete()
         await show_confirmation(update, context, draft)
         
+    except asyncio.TimeoutError:
+        await processing_msg.delete()
+        await reply_extraction_timeout(update)
     except Exception as e:
         logger.error(f"Error updating location: {e}")
         await update.message.reply_text(
@@ -212,7 +245,11 @@ async def handle_price_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         processing_msg = await update.message.reply_text(MSG_PROCESSING)
         
         # Re-extract with new price
-        price_data = gemini_client.extract_preference_data(f"price: {price_text}")["price"]
+        extracted_data = await extract_latest(update, price_text, field="price")
+        if extracted_data is None:
+            await processing_msg.delete()
+            return
+        price_data = extracted_data["price"]
         
         # Update draft
         draft = context.user_data.get("preference_draft", {})
@@ -223,6 +260,9 @@ async def handle_price_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await processing_msg.delete()
         await show_confirmation(update, context, draft)
         
+    except asyncio.TimeoutError:
+        await processing_msg.delete()
+        await reply_extraction_timeout(update)
     except Exception as e:
         logger.error(f"Error updating price: {e}")
         await update.message.reply_text(
@@ -238,7 +278,11 @@ async def handle_category_edit(update: Update, context: ContextTypes.DEFAULT_TYP
         processing_msg = await update.message.reply_text(MSG_PROCESSING)
         
         # Re-extract with new category
-        category_data = gemini_client.extract_preference_data(f"category: {category_text}")["category"]
+        extracted_data = await extract_latest(update, category_text, field="category")
+        if extracted_data is None:
+            await processing_msg.delete()
+            return
+        category_data = extracted_data["category"]
         
         # Update draft
         draft = context.user_data.get("preference_draft", {})
@@ -249,6 +293,9 @@ async def handle_category_edit(update: Update, context: ContextTypes.DEFAULT_TYP
         await processing_msg.delete()
         await show_confirmation(update, context, draft)
         
+    except asyncio.TimeoutError:
+        await processing_msg.delete()
+        await reply_extraction_timeout(update)
     except Exception as e:
         logger.error(f"Error updating category: {e}")
         await update.message.reply_text(
@@ -264,7 +311,11 @@ async def handle_time_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         processing_msg = await update.message.reply_text(MSG_PROCESSING)
         
         # Re-extract with new time window
-        time_data = gemini_client.extract_preference_data(f"time: {time_text}")["time_window"]
+        extracted_data = await extract_latest(update, time_text, field="time_window")
+        if extracted_data is None:
+            await processing_msg.delete()
+            return
+        time_data = extracted_data["time_window"]
         
         # Update draft
         draft = context.user_data.get("preference_draft", {})
@@ -275,6 +326,9 @@ async def handle_time_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await processing_msg.delete()
         await show_confirmation(update, context, draft)
         
+    except asyncio.TimeoutError:
+        await processing_msg.delete()
+        await reply_extraction_timeout(update)
     except Exception as e:
         logger.error(f"Error updating time: {e}")
         await update.message.reply_text(
@@ -299,7 +353,7 @@ async def save_preference(update: Update, context: ContextTypes.DEFAULT_TYPE):
             time_window=draft["time_window"]
         )
         
-        mongo_client.add_user_preference(user_id, preference)
+        await mongo_client.add_user_preference(user_id, preference)
         
         # Clear context
         context.user_data.pop("preference_draft", None)
@@ -322,7 +376,7 @@ async def save_preference(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_user_preferences(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show all user preferences."""
     user_id = update.effective_user.id
-    user_prefs = mongo_client.get_user_preferences(user_id)
+    user_prefs = await mongo_client.get_user_preferences(user_id)
     
     if not user_prefs or not user_prefs.preferences:
         await update.message.reply_text(MSG_NO_PREFERENCES, parse_mode='Markdown')
@@ -341,7 +395,7 @@ async def remove_user_preferences(update: Update, context: ContextTypes.DEFAULT_
     """Remove all user preferences."""
     user_id = update.effective_user.id
     
-    if mongo_client.delete_all_user_preferences(user_id):
+    if await mongo_client.delete_all_user_preferences(user_id):
         await update.message.reply_text(MSG_PREFERENCES_REMOVED, parse_mode='Markdown')
     else:
         await update.message.reply_text(MSG_NO_PREFERENCES_TO_REMOVE, parse_mode='Markdown')
@@ -0,0 +1,110 @@
+"""Concurrent Telegram update processing that keeps each user's updates in order."""
+
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from core.constants import UPDATE_STATS_LOG_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different users concurrently and those of one user in arrival order.
+
+    The first update of a user runs right away and then works through every
+    update the same user sent meanwhile, so ``context.user_data`` is never
+    touched by two handlers at once and ConversationHandler, which keys its
+    conversations by user, still sees them one by one. Queued updates do not hold one of the
+    ``max_concurrent_updates`` slots, only the user's running one does, so a
+    user flooding the bot cannot starve the others.
+
+    ``on_queued`` is called with the user id as soon as an update queues up
+    behind the user's running one, e.g. to cancel a slow LLM extraction the
+    new message makes stale.
+    """
+
+    def __init__(self, max_concurrent_updates: int, stats_interval: float = UPDATE_STATS_LOG_INTERVAL,
+                 on_queued: Callable[[int], Any] | None = None):
+        super().__init__(max_concurrent_updates)
+        self.stats_interval = stats_interval
+        self.on_queued = on_queued
+        self._user_queues: dict[int, deque[Awaitable[Any]]] = {}
+        self._stats_task: asyncio.Task | None = None
+        self.processed = 0
+        self.peak_queued = 0
+
+    @staticmethod
+    def ordering_key(update: object) -> int | None:
+        """User whose updates must not overlap, None for updates without a user."""
+        if isinstance(update, Update) and update.effective_user:
+            return update.effective_user.id
+        return None
+
+    @property
+    def queued(self) -> int:
+        """Updates waiting behind an earlier update of the same user."""
+        return sum(len(queue) for queue in self._user_queues.values())
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict, e.g. for logging."""
+        return {
+            "active": self.current_concurrent_updates,
+            "active_users": len(self._user_queues),
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "processed": self.processed,
+        }
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.ordering_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        queue = self._user_queues.get(key)
+        if queue is not None:
+            # The user's running update picks this one up when it is done
+            queue.append(coroutine)
+            if self.on_queued is not None:
+                self.on_queued(key)
+            self.peak_queued = max(self.peak_queued, self.queued)
+            return
+
+        self._user_queues[key] = queue = deque()
+        try:
+            await self._run(coroutine)
+            while queue:
+                await self._run(queue.popleft())
+        finally:
+            del self._user_queues[key]
+            for pending in queue:
+                if asyncio.iscoroutine(pending):
+                    pending.close()
+
+    async def _run(self, coroutine: Awaitable[Any]):
+        try:
+            await coroutine
+        except Exception as e:
+            # Application.process_update reports handler errors itself, this only guards the queue
+            logger.error(f"Error processing update: {e}", exc_info=True)
+        finally:
+            self.processed += 1
+
+    async def _log_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            logger.info(f"Update processing: {self.snapshot()}")
+
+    async def initialize(self) -> None:
+        if self.stats_interval > 0:
+            self._stats_task = asyncio.create_task(self._log_stats())
+
+    async def shutdown(self) -> None:
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+            self._stats_task = None
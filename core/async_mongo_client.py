@@ -0,0 +1,33 @@
+"""Awaitable access to MongoClientManager for code running on an event loop."""
+
+import asyncio
+import functools
+
+from core.mongo_client import MongoClientManager
+
+class AsyncMongoClientManager:
+    """Exposes every MongoClientManager method as a coroutine.
+
+    Calls run in the default thread pool on the process-wide pooled client,
+    so a slow query only occupies a worker thread while the event loop keeps
+    serving other updates. Streaming ``iter_*`` methods are not offered
+    because their cursor would be consumed on the event loop; use the
+    ``get_*`` variants instead.
+    """
+
+    def __init__(self, mongo_client: MongoClientManager | None = None):
+        self.mongo_client = mongo_client or MongoClientManager()
+
+    def __getattr__(self, name: str):
+        if name == "mongo_client":
+            raise AttributeError(name)
+        if name.startswith("iter_"):
+            raise AttributeError(f"{name} streams a cursor and has no async variant, use the get_* method")
+        method = getattr(self.mongo_client, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
@@ -10,15 +10,34 @@ class Config:
     
     # Bot configuration
     BOT_TOKEN = os.getenv("BOT_TOKEN")
+    BOT_MAX_CONCURRENT_UPDATES = int(os.getenv("BOT_MAX_CONCURRENT_UPDATES", "32"))
+    # Public HTTPS base URL Telegram posts updates to; unset means long polling
+    BOT_WEBHOOK_URL = os.getenv("BOT_WEBHOOK_URL")
+    BOT_WEBHOOK_PORT = int(os.getenv("BOT_WEBHOOK_PORT", "8000"))
+    BOT_WEBHOOK_SECRET = os.getenv("BOT_WEBHOOK_SECRET")
     
     # Database configuration
     MONGO_URI = os.getenv("MONGO_URI")
     MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+    MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")  # comma-separated: zstd, snappy, zlib
+    
+    # Message sender configuration
+    SENDER_MATCH_STRATEGY = os.getenv("SENDER_MATCH_STRATEGY", "query")
     
     # LLM configuration
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
     GEMINI_MODEL = "gemini-1.5-flash"
     GEMINI_TEMPERATURE = 0.1
+    GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "20"))  # seconds per extraction
+    GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+    GEMINI_PARSE_RETRIES = int(os.getenv("GEMINI_PARSE_RETRIES", "1"))  # extra calls when an answer misses the schema
+    EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL", "604800"))  # seconds, 0 disables the cache
     
     # Logging configuration
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -60,6 +60,73 @@ MSG_OFFER_TEMPLATE = """**{description}**
 
 # Bot message sending
 TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+PHOTO_CACHE_SIZE = 1000  # photo URL -> Telegram file_id entries kept in memory
+RENDER_CACHE_SIZE = 1000  # rendered offer messages kept in memory
+OFFER_DESCRIPTION_MAX_LENGTH = 200
+
+# Bot update processing
+UPDATE_STATS_LOG_INTERVAL = 300  # seconds
+WEBHOOK_PATH = "telegram"
+
+# LLM extraction
+EXTRACTION_CACHE_SIZE = 2000  # extraction results kept in memory per process
+# Bump when the shape of cached extraction results changes
+EXTRACTION_CACHE_FORMAT = 1
+
+# Delivery acknowledgements (flushed when either threshold is reached)
+ACK_FLUSH_SIZE = 50
+ACK_FLUSH_INTERVAL = 5  # seconds
+
+# Delivery outbox
+OUTBOX_STATUS_PENDING = "pending"
+OUTBOX_STATUS_LEASED = "leased"
+OUTBOX_STATUS_SENT = "sent"
+OUTBOX_STATUS_DEAD = "dead"
+OUTBOX_CLAIM_BATCH = 50
+OUTBOX_LEASE_SECONDS = 120
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BACKOFF = 30  # seconds, doubled on every failed attempt
+OUTBOX_INACTIVE_CHAT_ERROR = "chat inactive"
+OUTBOX_USER_CLAIM_CAP = 5  # deliveries per user in one claim batch, so no user's backlog blocks others
+OUTBOX_CLAIM_SCAN_FACTOR = 4  # candidates scanned per claimed entry when applying the cap
+OUTBOX_SENT_RETENTION = TIME_ONE_WEEK  # seconds a sent outbox entry is kept
+OUTBOX_DEAD_RETENTION = 2 * TIME_ONE_MONTH  # longer than any time window, so expiry never re-queues an offer
+
+# Delivery priority is the offer's creation time in seconds, plus boosts that
+# let time-sensitive matches overtake slightly fresher ones
+PRIORITY_FREE_OFFER_BOOST = 3600  # free items are gone fast
+PRIORITY_URGENT_BOOST = 1800  # preferences with a short time window
+PRIORITY_URGENT_TIME_WINDOW = TIME_ONE_DAY
+
+# Inactive (blocked or deleted) chats are probed at most this often
+DEAD_CHAT_PROBE_INTERVAL = 86400  # seconds
+
+# Message sender modes
+SENDER_MODE_ALL = "all"
+SENDER_MODE_MATCH = "match"
+SENDER_MODE_DELIVER = "deliver"
+SENDER_MODE_DAEMON = "daemon"
+SENDER_MODE_WITH_SCRAPER = "with-scraper"
+SENDER_MODES = [
+    SENDER_MODE_ALL, SENDER_MODE_MATCH, SENDER_MODE_DELIVER,
+    SENDER_MODE_DAEMON, SENDER_MODE_WITH_SCRAPER
+]
+
+# Documents fetched per round trip when streaming users or offers
+CURSOR_BATCH_SIZE = 500
+
+# How the match pass finds pending deliveries: one query per distinct
+# preference, or a single aggregation joining preferences with offers
+MATCH_STRATEGY_QUERY = "query"
+MATCH_STRATEGY_AGGREGATE = "aggregate"
+MATCH_STRATEGIES = [MATCH_STRATEGY_QUERY, MATCH_STRATEGY_AGGREGATE]
+AGGREGATE_CURSOR_BATCH = 500  # preferences per cursor batch
+AGGREGATE_ENQUEUE_BATCH = 1000  # deliveries per outbox bulk write
+
+# Message sender daemon
+DAEMON_BATCH_SIZE = 100
+DAEMON_POLL_INTERVAL = 5  # seconds
+PREFERENCES_REFRESH_INTERVAL = 60  # seconds
 
 # Timeframe options for user selection
 TIMEFRAME_OPTIONS = [
@@ -97,4 +164,5 @@ MSG_ENTER_PRICE = "💰 What's your price range? (e.g., 'max 50 EUR', 'verschenk
 MSG_ENTER_CATEGORY = "🏷️ What category are you looking for? (e.g., 'Wohnzimmer', 'Electronics', 'Büro'):"
 MSG_ENTER_TIME = "⏰ How long should I search? (e.g., '1 week', '3 days', '1 month'):"
 MSG_PROCESSING = "🔄 **Processing your request...**"
+MSG_EXTRACTION_TIMEOUT = "⌛ That took too long, please try again in a moment."
 MSG_TELL_ME_WHAT_LOOKING_FOR = "Tell me what you're looking for! 🔍\n\n*Example: 'Schreibtisch in München bis 50 Euro'*"
@@ -1,14 +1,51 @@
 import logging
-from pymongo import MongoClient
+import threading
+import uuid
+from collections.abc import Iterator
+from datetime import datetime, timezone, timedelta
+from pymongo import UpdateOne, ASCENDING, DESCENDING
 from bson import ObjectId
 from pymongo.errors import BulkWriteError
 
 from core.config import config
+from core.mongo_pool import get_mongo_client, pool_stats
+from core.constants import (
+    OUTBOX_STATUS_PENDING, OUTBOX_STATUS_LEASED, OUTBOX_STATUS_SENT, OUTBOX_STATUS_DEAD,
+    OUTBOX_LEASE_SECONDS, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BACKOFF, OUTBOX_INACTIVE_CHAT_ERROR,
+    OUTBOX_USER_CLAIM_CAP, OUTBOX_CLAIM_SCAN_FACTOR, OUTBOX_SENT_RETENTION, OUTBOX_DEAD_RETENTION, PRIORITY_FREE_OFFER_BOOST, PRIORITY_URGENT_BOOST,
+    PRIORITY_URGENT_TIME_WINDOW, AGGREGATE_CURSOR_BATCH, CURSOR_BATCH_SIZE
+)
+from core.offer_query import OFFER_MATCH_PROJECTION, OFFER_INDEXES, pending_deliveries_pipeline
 from models.preferences import UserPreferences, Preference
 from models.offer import Offer
+from utils.helpers import as_utc
 
 logger = logging.getLogger(__name__)
 
+# Offers are stamped and inserted one batch at a time, so insertion times follow commit order
+_offer_insert_lock = threading.Lock()
+_last_inserted_at = datetime.min.replace(tzinfo=timezone.utc)
+
+def _next_insertion_time() -> datetime:
+    """Current time at Mongo's millisecond precision, never before the previous stamp."""
+    global _last_inserted_at
+    now = datetime.now(timezone.utc)
+    _last_inserted_at = max(_last_inserted_at, now.replace(microsecond=now.microsecond // 1000 * 1000))
+    return _last_inserted_at
+
+def delivery_id(user_id: int, offer_id: str) -> str:
+    """Deterministic outbox key, so an offer is queued once per user however many preferences match it."""
+    return f"{user_id}:{offer_id}"
+
+def delivery_priority(created_at: datetime, price: float, time_window: int) -> float:
+    """Outbox claim priority, higher first: fresher offers, boosted for free items and urgent preferences."""
+    priority = as_utc(created_at).timestamp()
+    if price == 0:
+        priority += PRIORITY_FREE_OFFER_BOOST
+    if time_window <= PRIORITY_URGENT_TIME_WINDOW:
+        priority += PRIORITY_URGENT_BOOST
+    return priority
+
 class MongoClientManager:
     def __init__(self):
         self.mongo_uri = config.MONGO_URI
@@ -16,12 +53,17 @@ class MongoClientManager:
         if not self.mongo_uri or not self.db_name:
             raise ValueError("MONGO_URI and MONGO_DB_NAME must be set in the .env file")
 
-        logger.info(f"Connecting to MongoDB: {self.mongo_uri}")
-        self.client = MongoClient(self.mongo_uri)
+        # Every manager in the process shares one client and connection pool
+        self.client = get_mongo_client()
         self.db = self.client[self.db_name]
         self.user_preferences_collection = self.db["user_preferences"]
         self.offers_collection = self.db["offers"]
-        logger.info("MongoDB connection established")
+        self.outbox_collection = self.db["outbox"]
+        self.extraction_cache_collection = self.db["extraction_cache"]
+
+    def pool_stats(self) -> dict:
+        """Command and connection pool counters of the shared client."""
+        return pool_stats.snapshot()
 
     def add_user_preference(self, user_id: int, preference: Preference) -> str:
         """Add a new preference for a user."""
@@ -29,7 +71,7 @@ class MongoClientManager:
         user_prefs = self.user_preferences_collection.find_one({"user_id": user_id})
         
         if user_prefs:
-            preference_dict = preference.model_dump(exclude={"_id"})
+            preference_dict = preference.model_dump(exclude={"id"})
             preference_dict["_id"] = str(ObjectId())
             
             self.user_preferences_collection.update_one(
@@ -39,7 +81,7 @@ class MongoClientManager:
             logger.info(f"Updated existing user preferences for user {user_id}")
             return preference_dict["_id"]
         else:
-            preference_dict = preference.model_dump(exclude={"_id"})
+            preference_dict = preference.model_dump(exclude={"id"})
             preference_dict["_id"] = str(ObjectId())
             
             new_user_prefs = UserPreferences(
@@ -48,7 +90,7 @@ class MongoClientManager:
             )
             
             result = self.user_preferences_collection.insert_one(
-                new_user_prefs.model_dump(exclude={"_id"})
+                new_user_prefs.model_dump(by_alias=True, exclude={"_id"})
             )
             logger.info(f"Created new user preferences for user {user_id}")
             return preference_dict["_id"]
@@ -74,31 +116,155 @@ class MongoClientManager:
         return result.deleted_count > 0
 
     def create_offers(self, offers: list[dict] | None = None) -> list[str]:
-        """Create offers in the database."""
+        """Create offers in the database.
+
+        Each offer gets ``inserted_at``, the time of its insert. Unlike
+        ``created_at``, set while scraping, it increases in the order offers
+        become visible, also with several scraper lanes inserting at once, so
+        pollers can use it as a watermark.
+        """
         if not offers:
             return []
             
-        try:
-            result = self.offers_collection.insert_many(offers, ordered=False)
-            return [str(oid) for oid in result.inserted_ids]
-        except BulkWriteError as e:
-            logger.warning(f"Some offers already exist: {len(e.details.get('writeErrors', []))}")
-            return [str(oid) for oid in e.details.get('insertedIds', [])]
-
-    def get_offers(self, filter_criteria: dict) -> list[Offer]:
+        with _offer_insert_lock:
+            inserted_at = _next_insertion_time()
+            for offer in offers:
+                offer["inserted_at"] = inserted_at
+            try:
+                result = self.offers_collection.insert_many(offers, ordered=False)
+                return [str(oid) for oid in result.inserted_ids]
+            except BulkWriteError as e:
+                write_errors = e.details.get('writeErrors', [])
+                logger.warning(f"Some offers already exist: {len(write_errors)}")
+                failed = {error["index"] for error in write_errors}
+                return [str(offer["_id"]) for i, offer in enumerate(offers) if i not in failed]
+
+    def get_offers(self, filter_criteria: dict, projection: dict | None = None) -> list[Offer]:
         """Get offers based on filter criteria."""
-        offers_data = self.offers_collection.find(filter_criteria)
-        return [Offer(**offer) for offer in offers_data]
+        return list(self.iter_offers(filter_criteria, projection))
+
+    def iter_offers(self, filter_criteria: dict, projection: dict | None = None,
+                    batch_size: int = CURSOR_BATCH_SIZE) -> Iterator[Offer]:
+        """Yield offers one at a time, fetching ``batch_size`` documents per round trip."""
+        for offer in self.offers_collection.find(filter_criteria, projection, batch_size=batch_size):
+            yield Offer(**offer)
+
+    def get_matching_offers(self, filter_criteria: dict) -> list[dict]:
+        """Get the ID, creation time and price of offers matching the filter, without loading full documents."""
+        offers = list(self.offers_collection.find(filter_criteria, OFFER_MATCH_PROJECTION))
+        for offer in offers:
+            offer["_id"] = str(offer["_id"])
+        return offers
+
+    def iter_pending_matches(self, now: datetime | None = None,
+                             batch_size: int = AGGREGATE_CURSOR_BATCH) -> Iterator[tuple[int, Preference, list[dict]]]:
+        """Stream (user_id, preference, offers) for every active preference with unsent matches.
+
+        ``offers`` are the fields of OFFER_MATCH_PROJECTION, as from get_matching_offers.
+
+        All matching runs server-side in one aggregation; results arrive in
+        cursor batches of ``batch_size`` preferences.
+        """
+        cursor = self.user_preferences_collection.aggregate(
+            pending_deliveries_pipeline(now), batchSize=batch_size
+        )
+        for doc in cursor:
+            for offer in doc["offers"]:
+                offer["_id"] = str(offer["_id"])
+            yield doc["user_id"], Preference(**doc["preference"]), doc["offers"]
+
+    def ensure_offer_indexes(self):
+        """Create the indexes used by compiled preference filters and by offer polling."""
+        for keys in OFFER_INDEXES:
+            self.offers_collection.create_index(keys)
+        # Watermark of the polling offer source
+        self.offers_collection.create_index("inserted_at")
+
+    def set_offer_photo_file_id(self, offer_id: str, file_id: str) -> bool:
+        """Store the Telegram file_id of an offer's first photo."""
+        result = self.offers_collection.update_one(
+            {"_id": offer_id},
+            {"$set": {"photo_file_id": file_id}}
+        )
+        return result.modified_count > 0
 
     def get_existing_offer_ids(self, filter_criteria: dict) -> set[str]:
         """Get existing offer IDs for given criteria."""
         offers = self.offers_collection.find(filter_criteria, {"_id": 1})
         return {offer["_id"] for offer in offers}
 
-    def get_all_user_preferences(self) -> list[UserPreferences]:
-        """Get all user preferences."""
-        all_prefs = self.user_preferences_collection.find()
-        return [UserPreferences(**prefs) for prefs in all_prefs]
+    def get_all_user_preferences(self, include_inactive: bool = False) -> list[UserPreferences]:
+        """Get all user preferences, skipping users whose chat is inactive unless asked for."""
+        return list(self.iter_user_preferences(include_inactive))
+
+    def iter_user_preferences(self, include_inactive: bool = False,
+                              batch_size: int = CURSOR_BATCH_SIZE) -> Iterator[UserPreferences]:
+        """Yield user preferences one user at a time, fetching ``batch_size`` documents per round trip."""
+        filter_criteria = {} if include_inactive else {"inactive_since": None}
+        for prefs in self.user_preferences_collection.find(filter_criteria, batch_size=batch_size):
+            yield UserPreferences(**prefs)
+
+    def mark_user_inactive(self, user_id: int) -> int:
+        """Record that a user's chat is unreachable and drop their queued deliveries.
+
+        Returns the number of outbox entries that will no longer be attempted.
+        """
+        now = datetime.now(timezone.utc)
+        self.user_preferences_collection.update_one(
+            {"user_id": user_id, "inactive_since": None},
+            {"$set": {"inactive_since": now, "last_probe_at": now}}
+        )
+        result = self.outbox_collection.update_many(
+            {"user_id": user_id, "status": {"$in": [OUTBOX_STATUS_PENDING, OUTBOX_STATUS_LEASED]}},
+            {"$set": {
+                "status": OUTBOX_STATUS_DEAD,
+                "lease_owner": None,
+                "lease_expires_at": None,
+                "last_error": OUTBOX_INACTIVE_CHAT_ERROR,
+                "dead_at": now,
+                "updated_at": now
+            }}
+        )
+        return result.modified_count
+
+    def reactivate_user(self, user_id: int) -> bool:
+        """Mark a user's chat as reachable again."""
+        result = self.user_preferences_collection.update_one(
+            {"user_id": user_id, "inactive_since": {"$ne": None}},
+            {"$set": {"inactive_since": None, "last_probe_at": None}}
+        )
+        if result.modified_count:
+            # Let matching queue offers that were dropped while the chat was inactive
+            self.outbox_collection.delete_many(
+                {"user_id": user_id, "status": OUTBOX_STATUS_DEAD, "last_error": OUTBOX_INACTIVE_CHAT_ERROR}
+            )
+        return result.modified_count > 0
+
+    def get_users_to_probe(self, probe_interval: int) -> list[int]:
+        """Get inactive users whose last reachability probe is older than ``probe_interval`` seconds."""
+        probe_before = datetime.now(timezone.utc) - timedelta(seconds=probe_interval)
+        users = self.user_preferences_collection.find(
+            {"inactive_since": {"$ne": None}, "last_probe_at": {"$lte": probe_before}},
+            {"user_id": 1}
+        )
+        return [user["user_id"] for user in users]
+
+    def set_user_probed(self, user_id: int):
+        """Record a failed reachability probe."""
+        self.user_preferences_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {"last_probe_at": datetime.now(timezone.utc)}}
+        )
+
+    def get_inactive_user_stats(self) -> tuple[int, int]:
+        """Count inactive users and the preferences they hold."""
+        stats = list(self.user_preferences_collection.aggregate([
+            {"$match": {"inactive_since": {"$ne": None}}},
+            {"$group": {"_id": None, "users": {"$sum": 1}, "preferences": {"$sum": {"$size": "$preferences"}}}}
+        ]))
+        if not stats:
+            return 0, 0
+        return stats[0]["users"], stats[0]["preferences"]
     
     def mark_offer_as_sent(self, user_id: int, preference_id: str, offer_id: str) -> bool:
         """Mark an offer as sent for a user's preference."""
@@ -107,3 +273,213 @@ class MongoClientManager:
             {"$addToSet": {"preferences.$.sent_offers": offer_id}}
         )
         return result.modified_count > 0
+
+    def mark_offers_as_sent_bulk(self, acks: list[tuple[int, str, str]]) -> int:
+        """Mark many (user_id, preference_id, offer_id) deliveries as sent in one unordered bulk write."""
+        if not acks:
+            return 0
+
+        grouped: dict[tuple[int, str], list[str]] = {}
+        for user_id, preference_id, offer_id in acks:
+            grouped.setdefault((user_id, preference_id), []).append(offer_id)
+
+        operations = [
+            UpdateOne(
+                {"user_id": user_id, "preferences._id": preference_id},
+                {"$addToSet": {"preferences.$.sent_offers": {"$each": offer_ids}}}
+            )
+            for (user_id, preference_id), offer_ids in grouped.items()
+        ]
+        result = self.user_preferences_collection.bulk_write(operations, ordered=False)
+
+        now = datetime.now(timezone.utc)
+        self.outbox_collection.update_many(
+            {"_id": {"$in": list({delivery_id(user_id, offer_id) for user_id, _, offer_id in acks})}},
+            {"$set": {
+                "status": OUTBOX_STATUS_SENT,
+                "lease_expires_at": None,
+                "sent_at": now,
+                "updated_at": now
+            }}
+        )
+        return result.modified_count
+
+    def ensure_extraction_cache_indexes(self, ttl: float):
+        """Let Mongo expire cached extraction results ``ttl`` seconds after they were stored."""
+        self.extraction_cache_collection.create_index("created_at", expireAfterSeconds=int(ttl))
+
+    def get_cached_extraction(self, key: str, max_age: float) -> dict | None:
+        """Cached extraction result, unless older than ``max_age`` seconds.
+
+        Mongo removes expired entries only periodically, so the age is checked here too.
+        """
+        doc = self.extraction_cache_collection.find_one(
+            {"_id": key, "created_at": {"$gt": datetime.now(timezone.utc) - timedelta(seconds=max_age)}},
+            {"data": 1}
+        )
+        return doc["data"] if doc else None
+
+    def cache_extraction(self, key: str, version: str, data: dict):
+        """Store an extraction result under its cache key."""
+        self.extraction_cache_collection.update_one(
+            {"_id": key},
+            {"$set": {"version": version, "data": data, "created_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    def ensure_outbox_indexes(self):
+        """Create the indexes used to claim outbox entries, and expire finished ones.
+
+        Sent and dead-lettered entries are kept for a while to inspect, then
+        Mongo drops them; ``sent_offers`` keeps sent offers from being queued again.
+        """
+        self.outbox_collection.create_index([("status", ASCENDING), ("available_at", ASCENDING)])
+        self.outbox_collection.create_index([("status", ASCENDING), ("lease_expires_at", ASCENDING)])
+        self.outbox_collection.create_index([("status", ASCENDING), ("priority", DESCENDING)])
+        self.outbox_collection.create_index("sent_at", expireAfterSeconds=OUTBOX_SENT_RETENTION)
+        self.outbox_collection.create_index("dead_at", expireAfterSeconds=OUTBOX_DEAD_RETENTION)
+
+    def enqueue_deliveries(self, deliveries: list[tuple[int, str, str]],
+                           preference_labels: dict[str, str] | None = None,
+                           priorities: dict[tuple[int, str, str], float] | None = None) -> int:
+        """Persist pending (user_id, preference_id, offer_id) deliveries in the outbox.
+
+        Entries are keyed per (user, offer) and upserted with $setOnInsert, so re-running
+        matching never resets a delivery that is leased, sent or dead-lettered. Every
+        preference that matched is recorded in ``matches`` together with its label.
+        An entry's claim priority is the highest of its deliveries' ``priorities``.
+        """
+        if not deliveries:
+            return 0
+
+        preference_labels = preference_labels or {}
+        priorities = priorities or {}
+        now = datetime.now(timezone.utc)
+        operations = [
+            UpdateOne(
+                {"_id": delivery_id(user_id, offer_id)},
+                {
+                    "$setOnInsert": {
+                        "user_id": user_id,
+                        "offer_id": offer_id,
+                        "status": OUTBOX_STATUS_PENDING,
+                        "attempts": 0,
+                        "available_at": now,
+                        "lease_owner": None,
+                        "lease_expires_at": None,
+                        "last_error": None,
+                        "created_at": now,
+                        "updated_at": now
+                    },
+                    "$addToSet": {"matches": {
+                        "preference_id": preference_id,
+                        "label": preference_labels.get(preference_id)
+                    }},
+                    "$max": {"priority": priorities.get((user_id, preference_id, offer_id), 0)}
+                },
+                upsert=True
+            )
+            for user_id, preference_id, offer_id in deliveries
+        ]
+        result = self.outbox_collection.bulk_write(operations, ordered=False)
+        return result.upserted_count
+
+    def claim_deliveries(self, worker_id: str, limit: int, lease_seconds: int = OUTBOX_LEASE_SECONDS,
+                         per_user_cap: int = OUTBOX_USER_CLAIM_CAP) -> list[dict]:
+        """Lease up to ``limit`` due outbox entries for this worker, highest priority first.
+
+        Pending entries that are due and leased entries whose lease expired (for
+        example because a previous sender crashed) can be claimed. At most
+        ``per_user_cap`` entries per user are taken in one batch, so a user with
+        a large backlog cannot hold up fresh matches for everyone else.
+        """
+        now = datetime.now(timezone.utc)
+        claimable = {"$or": [
+            {"status": OUTBOX_STATUS_PENDING, "available_at": {"$lte": now}},
+            {"status": OUTBOX_STATUS_LEASED, "lease_expires_at": {"$lte": now}}
+        ]}
+        candidates = (
+            self.outbox_collection.find(claimable, {"_id": 1, "user_id": 1})
+            .sort([("priority", DESCENDING), ("available_at", ASCENDING)])
+            .limit(limit * OUTBOX_CLAIM_SCAN_FACTOR)
+        )
+        candidate_ids = []
+        per_user: dict[int, int] = {}
+        for entry in candidates:
+            user_id = entry.get("user_id")
+            if per_user.get(user_id, 0) >= per_user_cap:
+                continue
+            per_user[user_id] = per_user.get(user_id, 0) + 1
+            candidate_ids.append(entry["_id"])
+            if len(candidate_ids) >= limit:
+                break
+        if not candidate_ids:
+            return []
+
+        # Re-check the claim condition so concurrent workers never share an entry
+        lease_token = f"{worker_id}:{uuid.uuid4().hex}"
+        self.outbox_collection.update_many(
+            {"_id": {"$in": candidate_ids}, **claimable},
+            {
+                "$set": {
+                    "status": OUTBOX_STATUS_LEASED,
+                    "lease_owner": lease_token,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            }
+        )
+        return list(
+            self.outbox_collection.find({"status": OUTBOX_STATUS_LEASED, "lease_owner": lease_token})
+            .sort([("priority", DESCENDING), ("available_at", ASCENDING)])
+        )
+
+    def fail_delivery(self, entry: dict, error: str, retry_after: float | None = None,
+                      max_attempts: int = OUTBOX_MAX_ATTEMPTS) -> bool:
+        """Schedule a retry for a failed delivery, or dead-letter it. Returns True if dead-lettered."""
+        now = datetime.now(timezone.utc)
+        attempts = entry.get("attempts", 1)
+        dead = attempts >= max_attempts
+
+        update = {
+            "status": OUTBOX_STATUS_DEAD if dead else OUTBOX_STATUS_PENDING,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "last_error": error,
+            "updated_at": now
+        }
+        if dead:
+            update["dead_at"] = now
+        else:
+            delay = retry_after if retry_after is not None else OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1)
+            update["available_at"] = now + timedelta(seconds=delay)
+
+        self.outbox_collection.update_one({"_id": entry["_id"], "lease_owner": entry.get("lease_owner")}, {"$set": update})
+        return dead
+
+    def release_deliveries(self, entries: list[dict], retry_after: float | None = None):
+        """Return leased but unprocessed entries to the queue without counting an attempt.
+
+        With ``retry_after`` they are claimable again only after that many seconds.
+        """
+        if not entries:
+            return
+
+        now = datetime.now(timezone.utc)
+        update = {
+            "status": OUTBOX_STATUS_PENDING,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "updated_at": now
+        }
+        if retry_after is not None:
+            update["available_at"] = now + timedelta(seconds=retry_after)
+        self.outbox_collection.update_many(
+            {
+                "_id": {"$in": [entry["_id"] for entry in entries]},
+                "status": OUTBOX_STATUS_LEASED,
+                "lease_owner": {"$in": list({entry.get("lease_owner") for entry in entries})}
+            },
+            {"$set": update, "$inc": {"attempts": -1}}
+        )
@@ -0,0 +1,137 @@
+"""Process-wide MongoClient with tuned pool settings and pool/command statistics."""
+
+import logging
+import os
+import threading
+
+from pymongo import MongoClient, monitoring
+
+from core.config import config
+
+logger = logging.getLogger(__name__)
+
+class MongoPoolStats(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    """Counts commands and connection pool events reported by pymongo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.commands_started = 0
+            self.commands_succeeded = 0
+            self.commands_failed = 0
+            self.command_time_ms = 0.0
+            self.connections_created = 0
+            self.connections_closed = 0
+            self.checked_out = 0
+            self.checkout_failures = 0
+            self.peak_checked_out = 0
+
+    def snapshot(self) -> dict:
+        """Current counters as a plain dict, e.g. for logging."""
+        with self._lock:
+            return {
+                "commands_started": self.commands_started,
+                "commands_succeeded": self.commands_succeeded,
+                "commands_failed": self.commands_failed,
+                "command_time_ms": round(self.command_time_ms, 1),
+                "connections_open": self.connections_created - self.connections_closed,
+                "connections_created": self.connections_created,
+                "checked_out": self.checked_out,
+                "peak_checked_out": self.peak_checked_out,
+                "checkout_failures": self.checkout_failures,
+            }
+
+    # Command events
+
+    def started(self, event):
+        with self._lock:
+            self.commands_started += 1
+
+    def succeeded(self, event):
+        with self._lock:
+            self.commands_succeeded += 1
+            self.command_time_ms += event.duration_micros / 1000
+
+    def failed(self, event):
+        with self._lock:
+            self.commands_failed += 1
+            self.command_time_ms += event.duration_micros / 1000
+
+    # Connection pool events
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        logger.warning(f"MongoDB connection pool cleared for {event.address}")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+pool_stats = MongoPoolStats()
+
+_client: MongoClient | None = None
+_client_pid: int | None = None
+_client_lock = threading.Lock()
+
+def get_mongo_client() -> MongoClient:
+    """Return the MongoClient shared by every module in this process.
+
+    MongoClient is thread-safe and owns the connection pool and monitor
+    threads, so one per process is enough. A forked child gets its own.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            if not config.MONGO_URI:
+                raise ValueError("MONGO_URI and MONGO_DB_NAME must be set in the .env file")
+            logger.info(f"Connecting to MongoDB: {config.MONGO_URI}")
+            options = {}
+            if config.MONGO_COMPRESSORS:
+                options["compressors"] = config.MONGO_COMPRESSORS
+            _client = MongoClient(
+                config.MONGO_URI,
+                maxPoolSize=config.MONGO_MAX_POOL_SIZE,
+                minPoolSize=config.MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=config.MONGO_MAX_IDLE_TIME_MS,
+                connectTimeoutMS=config.MONGO_CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                socketTimeoutMS=config.MONGO_SOCKET_TIMEOUT_MS,
+                event_listeners=[pool_stats],
+                **options
+            )
+            _client_pid = os.getpid()
+        return _client
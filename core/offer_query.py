@@ -0,0 +1,167 @@
+"""Compiles user preferences into Mongo queries over the offers collection."""
+
+import math
+from datetime import datetime, timedelta, timezone
+
+from models.preferences import Preference, Price
+
+# Fields needed to render and send an offer; photos are trimmed to the one we send
+OFFER_DELIVERY_PROJECTION = {
+    "_id": 1,
+    "title": 1,
+    "description": 1,
+    "address": 1,
+    "link": 1,
+    "offer_date": 1,
+    "photos": {"$slice": 1},
+    "photo_file_id": 1,
+    "location": 1,
+    "category": 1,
+    "price": 1,
+    "lane": 1,
+    "created_at": 1,
+}
+
+# Matching needs to know which offers qualify and how urgent their delivery is
+OFFER_MATCH_PROJECTION = {"_id": 1, "created_at": 1, "price": 1}
+
+# Equality fields first, then the range on created_at, so filters can use them
+OFFER_INDEXES = [
+    [("location.city_id", 1), ("category.category_id", 1), ("created_at", -1)],
+    [("location.state_id", 1), ("category.category_id", 1), ("created_at", -1)],
+]
+
+def price_bounds(price: Price) -> tuple[float, float]:
+    """Inclusive (low, high) price interval of a preference.
+
+    ``price_to`` of 0 means no upper limit when ``price_from`` is set, and
+    free offers only ("verschenken") when both are 0.
+    """
+    if price.price_to > 0:
+        return float(price.price_from), float(price.price_to)
+    if price.price_from > 0:
+        return float(price.price_from), math.inf
+    return 0.0, 0.0
+
+def is_free_only(price: Price) -> bool:
+    """Whether a preference only wants free ("Zu verschenken") offers."""
+    return price_bounds(price) == (0.0, 0.0)
+
+def compile_offer_filter(preference: Preference, now: datetime | None = None, exclude_ids=(),
+                         match_price: bool = True, match_time_window: bool = True) -> dict:
+    """Turn a preference into a Mongo filter selecting exactly the offers it matches.
+
+    Every field set on the preference becomes a condition, so the database
+    does the filtering and results need no further checks in Python.
+    """
+    filter_criteria = {}
+
+    if preference.location.city_id:
+        filter_criteria["location.city_id"] = preference.location.city_id
+    if preference.location.state_id:
+        filter_criteria["location.state_id"] = preference.location.state_id
+    if preference.category.category_id:
+        filter_criteria["category.category_id"] = preference.category.category_id
+    if preference.category.subcategory_id:
+        filter_criteria["category.subcategory_id"] = preference.category.subcategory_id
+
+    if match_price:
+        low, high = price_bounds(preference.price)
+        if low == high:
+            filter_criteria["price"] = low
+        else:
+            price_range = {"$gte": low} if low > 0 else {}
+            if high != math.inf:
+                price_range["$lte"] = high
+            if price_range:
+                filter_criteria["price"] = price_range
+
+    if match_time_window:
+        now = now or datetime.now(timezone.utc)
+        filter_criteria["created_at"] = {"$gte": now - timedelta(seconds=preference.time_window)}
+
+    if exclude_ids:
+        filter_criteria["_id"] = {"$nin": list(exclude_ids)}
+
+    return filter_criteria
+
+def _field_matches(field: str, variable: str) -> dict:
+    """$expr condition: the preference leaves ``variable`` unset or the offer field equals it."""
+    return {"$or": [
+        {"$eq": [{"$ifNull": [f"$${variable}", ""]}, ""]},
+        {"$eq": [f"${field}", f"$${variable}"]},
+    ]}
+
+def pending_deliveries_pipeline(now: datetime | None = None) -> list[dict]:
+    """Aggregation over user_preferences that joins every active preference with its matching offers.
+
+    Each output document is one preference with at least one match:
+    ``{"user_id", "preference": {"_id", "location", "category", "time_window"}, "offers"}``
+    where ``offers`` holds the fields of OFFER_MATCH_PROJECTION.
+    The join applies the same conditions as ``compile_offer_filter`` and
+    leaves out offers the user already got through any preference.
+
+    The conditions are ``$expr`` comparisons with optional fields, which the
+    OFFER_INDEXES cannot serve, so every preference scans the offers. That
+    is why MATCH_STRATEGY_QUERY stays the default.
+    """
+    now = now or datetime.now(timezone.utc)
+    return [
+        {"$match": {"inactive_since": None}},
+        {"$project": {
+            "user_id": 1,
+            "preferences": 1,
+            "sent_offers": {"$reduce": {
+                "input": "$preferences.sent_offers",
+                "initialValue": [],
+                "in": {"$setUnion": ["$$value", "$$this"]},
+            }},
+        }},
+        {"$unwind": "$preferences"},
+        {"$lookup": {
+            "from": "offers",
+            "let": {
+                "city_id": "$preferences.location.city_id",
+                "state_id": "$preferences.location.state_id",
+                "category_id": "$preferences.category.category_id",
+                "subcategory_id": "$preferences.category.subcategory_id",
+                # Same interval as price_bounds
+                "price_from": "$preferences.price.price_from",
+                "price_to": {"$switch": {
+                    "branches": [
+                        {"case": {"$gt": ["$preferences.price.price_to", 0]}, "then": "$preferences.price.price_to"},
+                        {"case": {"$gt": ["$preferences.price.price_from", 0]}, "then": math.inf},
+                    ],
+                    "default": 0,
+                }},
+                "since": {"$subtract": [now, {"$multiply": ["$preferences.time_window", 1000]}]},
+                "sent_offers": "$sent_offers",
+            },
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$gte": ["$created_at", "$$since"]},
+                    _field_matches("location.city_id", "city_id"),
+                    _field_matches("location.state_id", "state_id"),
+                    _field_matches("category.category_id", "category_id"),
+                    _field_matches("category.subcategory_id", "subcategory_id"),
+                    {"$gte": ["$price", "$$price_from"]},
+                    {"$lte": ["$price", "$$price_to"]},
+                    {"$not": [{"$in": ["$_id", "$$sent_offers"]}]},
+                ]}}},
+                {"$project": OFFER_MATCH_PROJECTION},
+            ],
+            "as": "offers",
+        }},
+        {"$match": {"offers.0": {"$exists": True}}},
+        {"$project": {
+            "_id": 0,
+            "user_id": 1,
+            "preference": {
+                "_id": "$preferences._id",
+                "location": "$preferences.location",
+                "category": "$preferences.category",
+                "time_window": "$preferences.time_window",
+            },
+            "offers": 1,
+        }},
+    ]
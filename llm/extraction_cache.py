@@ -0,0 +1,127 @@
+"""Two-level cache of LLM preference extraction results."""
+
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from core.config import config
+from core.constants import EXTRACTION_CACHE_SIZE
+from core.mongo_client import MongoClientManager
+
+logger = logging.getLogger(__name__)
+
+def extraction_cache_version(*parts) -> str:
+    """Fingerprint of everything an extraction result depends on.
+
+    Pass the compiled prompt and the reference data the answer is resolved
+    against. Any change gives a new version, and entries cached under the old
+    one are never read again.
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def normalize_input(user_input: str) -> str:
+    """Case and whitespace do not change what the LLM extracts."""
+    return " ".join(user_input.casefold().split())
+
+class ExtractionCache:
+    """Extraction results by normalised input, field and prompt version.
+
+    An in-process LRU with a TTL sits in front of a Mongo collection, which
+    survives restarts and is shared by every bot replica. Without a store
+    only the in-process tier is used. Store errors are logged and treated as
+    misses, the cache never fails an extraction.
+    """
+
+    def __init__(self, version: str, store: MongoClientManager | None = None,
+                 max_size: int = EXTRACTION_CACHE_SIZE, ttl: float | None = None):
+        self.version = version
+        self.store = store
+        self.max_size = max_size
+        self.ttl = ttl if ttl is not None else config.EXTRACTION_CACHE_TTL
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        # The async client reads the store from worker threads
+        self._lock = threading.Lock()
+        self._indexed = False
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def key(self, user_input: str, field: str | None = None) -> str:
+        raw = f"{self.version}\x00{field or ''}\x00{normalize_input(user_input)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def snapshot(self) -> dict:
+        """Hit counters per tier as a plain dict, e.g. for logging."""
+        lookups = self.local_hits + self.shared_hits + self.misses
+        hits = self.local_hits + self.shared_hits
+        return {
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def get_local(self, key: str) -> dict | None:
+        """In-process lookup, cheap enough to run on the event loop."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.local_hits += 1
+        return copy.deepcopy(data)
+
+    def get_shared(self, key: str) -> dict | None:
+        """Look the key up in the store, and keep a hit in process. Blocking."""
+        data = None
+        if self.store is not None:
+            try:
+                data = self.store.get_cached_extraction(key, self.ttl)
+            except Exception as e:
+                logger.warning(f"Extraction cache read failed: {e}")
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+            self._remember(key, data)
+        return copy.deepcopy(data)
+
+    def get(self, key: str) -> dict | None:
+        """Both tiers, in-process first. Blocking on an in-process miss."""
+        data = self.get_local(key)
+        return data if data is not None else self.get_shared(key)
+
+    def put(self, key: str, data: dict):
+        """Cache a result in both tiers. Blocking."""
+        data = copy.deepcopy(data)
+        with self._lock:
+            self._remember(key, data)
+        if self.store is None:
+            return
+        if not self._indexed:
+            self._indexed = True
+            try:
+                self.store.ensure_extraction_cache_indexes(self.ttl)
+            except Exception as e:
+                # E.g. an index left with another TTL; reads still check the age
+                logger.warning(f"Extraction cache index not created: {e}")
+        try:
+            self.store.cache_extraction(key, self.version, data)
+        except Exception as e:
+            logger.warning(f"Extraction cache write failed: {e}")
+
+    def _remember(self, key: str, data: dict):
+        self._entries[key] = (time.monotonic() + self.ttl, data)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -1,5 +1,6 @@
 """Gemini client for LLM operations using LangChain."""
 
+import asyncio
 import json
 import logging
 from pathlib import Path
@@ -7,13 +8,26 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import HumanMessage, SystemMessage
 
 from core.config import config
-from core.constants import DATA_DIR, CATEGORIES_FILE, CITIES_FILE
-from prompts.prompts import PREFERENCE_EXTRACTION_PROMPT
+from core.constants import DATA_DIR, CATEGORIES_FILE, CITIES_FILE, ZIPCODES_FILE, EXTRACTION_CACHE_FORMAT
+from core.mongo_client import MongoClientManager
+from llm.extraction_cache import ExtractionCache, extraction_cache_version
+from llm.resolvers import CategoryResolver, CityResolver, ZipCodeResolver
+from llm.rule_parser import RuleBasedParser
+from models.preferences import PreferenceExtraction
+from prompts.prompts import build_preference_extraction_prompt
 
 logger = logging.getLogger(__name__)
 
+# How a single-field edit is introduced to the LLM
+FIELD_PROMPT_LABELS = {
+    "location": "location",
+    "category": "category",
+    "price": "price",
+    "time_window": "time",
+}
+
 class GeminiClient:
-    def __init__(self):
+    def __init__(self, cache_store: MongoClientManager | None = None):
         self.api_key = config.GOOGLE_API_KEY
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY must be set in the .env file")
@@ -24,10 +38,37 @@ class GeminiClient:
             google_api_key=self.api_key,
             temperature=config.GEMINI_TEMPERATURE
         )
+        # Gemini answers through a function call bound to the schema, parsed into PreferenceExtraction
+        self.extractor = self.llm.with_structured_output(PreferenceExtraction, include_raw=True)
+        self._llm_slots = asyncio.Semaphore(config.GEMINI_MAX_CONCURRENCY)
         
         data_path = Path(DATA_DIR)
         self.categories = self._load_json_data(data_path / CATEGORIES_FILE)
         self.cities = self._load_json_data(data_path / CITIES_FILE)
+        self.locations = CityResolver(self.cities)
+        zipcodes = self._load_json_data(data_path / ZIPCODES_FILE)
+        self.zipcodes = ZipCodeResolver(zipcodes, self.locations)
+        self.category_index = CategoryResolver(self.categories)
+        self.rules = RuleBasedParser(self.locations, self.category_index, self.zipcodes)
+        self.rule_hits = 0
+        self.llm_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.extractions = 0
+        self.parse_failures = 0
+        self.retries = 0
+        # Compiled once, every extraction reuses the same message
+        self.system_message = SystemMessage(content=build_preference_extraction_prompt(self.categories))
+        logger.info(f"Compiled extraction prompt: {len(self.system_message.content)} characters")
+        # Answers depend on the prompt and on the data they are resolved against
+        self.cache = None
+        if config.EXTRACTION_CACHE_TTL > 0:
+            version = extraction_cache_version(
+                EXTRACTION_CACHE_FORMAT, config.GEMINI_MODEL, config.GEMINI_TEMPERATURE,
+                self.system_message.content, FIELD_PROMPT_LABELS, self.categories, self.cities, zipcodes
+            )
+            self.cache = ExtractionCache(version, cache_store)
+            logger.info(f"Extraction cache version {version}")
         logger.info("Gemini client initialized successfully")
 
     def _load_json_data(self, file_path: Path) -> dict:
@@ -38,84 +79,146 @@ class GeminiClient:
         except FileNotFoundError:
             return {}
 
-    def extract_preference_data(self, user_input: str) -> dict:
-        """Extract structured preference data from user input using Gemini."""
+    def _build_messages(self, user_input: str) -> list:
+        """The precompiled system prompt followed by the user input."""
+        return [self.system_message, HumanMessage(content=user_input)]
+
+    def _log_usage(self, response):
+        """Log the tokens Gemini reports for a call and keep running totals."""
+        usage = getattr(response, "usage_metadata", None) or {}
+        if not usage:
+            return
+        self.input_tokens += usage.get("input_tokens", 0)
+        self.output_tokens += usage.get("output_tokens", 0)
+        logger.info(
+            f"Gemini tokens: {usage.get('input_tokens')} in, {usage.get('output_tokens')} out "
+            f"({self.input_tokens} in, {self.output_tokens} out over {self.llm_calls} calls)"
+        )
+
+    def _extract_with_rules(self, user_input: str, field: str | None) -> dict | None:
+        """Answer from the rule-based parser when it is sure, sparing the LLM round trip."""
+        parsed = self.rules.parse(user_input, field)
+        if parsed is None:
+            return None
+        self.rule_hits += 1
+        data = self._empty_preference_data()
+        data.update(parsed)
+        logger.info(f"Answered by rules ({self.rule_hits} rule hits, {self.llm_calls} LLM calls): {data}")
+        return data
+
+    def extraction_stats(self) -> dict:
+        """Structured output counters as a plain dict, e.g. for logging."""
+        return {
+            "llm_calls": self.llm_calls,
+            "extractions": self.extractions,
+            "parse_failures": self.parse_failures,
+            "parse_failure_rate": round(self.parse_failures / self.llm_calls, 3) if self.llm_calls else 0.0,
+            "retries_per_extraction": round(self.retries / self.extractions, 3) if self.extractions else 0.0,
+        }
+
+    def _log_cache_hit(self, data: dict):
+        logger.info(f"Answered from cache ({self.cache.snapshot()}): {data}")
+
+    def _llm_input(self, user_input: str, field: str | None) -> str:
+        return f"{FIELD_PROMPT_LABELS[field]}: {user_input}" if field else user_input
+
+    def extract_preference_data(self, user_input: str, field: str | None = None) -> dict:
+        """Extract structured preference data from user input using Gemini.
+
+        ``field`` names the one preference field the input is about, e.g.
+        "price" when editing it, which lets more inputs skip the LLM.
+        Answers the LLM gave are cached (see ExtractionCache), so a repeated
+        input is only sent once per prompt version.
+        """
         logger.info(f"Extracting preference data from: {user_input}")
+        if (data := self._extract_with_rules(user_input, field)) is not None:
+            return data
+        key = self.cache.key(user_input, field) if self.cache else None
+        if key and (data := self.cache.get(key)) is not None:
+            self._log_cache_hit(data)
+            return data
         
-        categories_info = json.dumps(self.categories, indent=2, ensure_ascii=False)
-        cities_sample = self._get_cities_sample()
+        messages = self._build_messages(self._llm_input(user_input, field))
         
-        system_prompt = f"""{PREFERENCE_EXTRACTION_PROMPT}
-
-Available categories:
-{categories_info}
+        try:
+            data = None
+            for attempt in range(config.GEMINI_PARSE_RETRIES + 1):
+                if (data := self._read_result(self.extractor.invoke(messages), attempt)) is not None:
+                    break
+        except Exception as e:
+            logger.error(f"Gemini extraction error: {e}")
+            return self._empty_preference_data()
+        if data is None:
+            return self._empty_preference_data()
+        if key:
+            self.cache.put(key, data)
+        return data
 
-Sample cities (there are more available):
-{cities_sample}"""
+    async def aextract_preference_data(self, user_input: str, field: str | None = None,
+                                       timeout: float | None = None) -> dict:
+        """Async variant of extract_preference_data for code running on an event loop.
 
+        At most GEMINI_MAX_CONCURRENCY requests are in flight per client; the
+        rest wait for a slot. Raises asyncio.TimeoutError when no answer arrives within
+        ``timeout`` seconds (GEMINI_TIMEOUT by default), waiting and retries included, so
+        callers can tell the user instead of showing an empty preference.
+        """
+        logger.info(f"Extracting preference data from: {user_input}")
+        if (data := self._extract_with_rules(user_input, field)) is not None:
+            return data
+        key = self.cache.key(user_input, field) if self.cache else None
+        if key:
+            data = self.cache.get_local(key)
+            if data is None:
+                data = await asyncio.to_thread(self.cache.get_shared, key)
+            if data is not None:
+                self._log_cache_hit(data)
+                return data
+        messages = self._build_messages(self._llm_input(user_input, field))
+        
         try:
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_input)
-            ]
-            
-            response = self.llm.invoke(messages)
-            result = response.content.strip()
-            logger.info(f"LLM response: {result}")
-            
-            try:
-                parsed_data = json.loads(result)
-                cleaned_data = self._validate_and_clean_data(parsed_data)
-                logger.info(f"Cleaned extracted data: {cleaned_data}")
-                return cleaned_data
-            except json.JSONDecodeError:
-                logger.warning("Failed to parse JSON, trying fallback extraction")
-                
-                # Handle markdown code blocks
-                if '```json' in result:
-                    start = result.find('```json') + 7
-                    end = result.find('```', start)
-                    if end > start:
-                        json_str = result[start:end].strip()
-                        try:
-                            parsed_data = json.loads(json_str)
-                            cleaned_data = self._validate_and_clean_data(parsed_data)
-                            logger.info(f"Cleaned extracted data from markdown: {cleaned_data}")
-                            return cleaned_data
-                        except json.JSONDecodeError:
-                            logger.error("Failed to parse JSON from markdown block")
-                
-                # Fallback: find JSON object
-                if '{' in result and '}' in result:
-                    start = result.find('{')
-                    end = result.rfind('}') + 1
-                    json_str = result[start:end]
-                    try:
-                        parsed_data = json.loads(json_str)
-                        cleaned_data = self._validate_and_clean_data(parsed_data)
-                        logger.info(f"Cleaned extracted data from fallback: {cleaned_data}")
-                        return cleaned_data
-                    except json.JSONDecodeError:
-                        logger.error("Failed to parse JSON from fallback extraction")
-                
-                logger.error("No valid JSON found in response")
-                return self._empty_preference_data()
-                    
+            data = await asyncio.wait_for(self._aextract(messages), timeout or config.GEMINI_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Gemini extraction timed out for: {user_input}")
+            raise
         except Exception as e:
             logger.error(f"Gemini extraction error: {e}")
             return self._empty_preference_data()
+        if data is None:
+            return self._empty_preference_data()
+        if key:
+            await asyncio.to_thread(self.cache.put, key, data)
+        return data
 
-    def _get_cities_sample(self) -> str:
-        """Get a sample of cities for the prompt."""
-        sample_cities = []
-        count = 0
-        for state, state_data in self.cities.items():
-            if count >= 3:
-                break
-            cities_list = list(state_data.get("cities", {}).keys())[:5]
-            sample_cities.append(f"{state}: {', '.join(cities_list)}")
-            count += 1
-        return "\n".join(sample_cities)
+    async def _aextract(self, messages: list) -> dict | None:
+        for attempt in range(config.GEMINI_PARSE_RETRIES + 1):
+            async with self._llm_slots:
+                result = await self.extractor.ainvoke(messages)
+            if (data := self._read_result(result, attempt)) is not None:
+                return data
+        return None
+
+    def _read_result(self, result: dict, attempt: int) -> dict | None:
+        """Cleaned data of one structured output call, None when the answer did not fit the schema.
+
+        ``result`` is what the extractor returns with ``include_raw``: the raw
+        message, the parsed PreferenceExtraction and the parsing error.
+        """
+        self.llm_calls += 1
+        self._log_usage(result["raw"])
+        parsed = result.get("parsed")
+        if parsed is None:
+            self.parse_failures += 1
+            logger.warning(
+                f"Gemini answer did not fit the schema (attempt {attempt + 1}): "
+                f"{result.get('parsing_error')} {self.extraction_stats()}"
+            )
+            return None
+        self.extractions += 1
+        self.retries += attempt
+        data = self._validate_and_clean_data(parsed.model_dump())
+        logger.info(f"Cleaned extracted data: {data}")
+        return data
 
     def _validate_and_clean_data(self, data: dict) -> dict:
         """Validate and clean extracted data."""
@@ -128,19 +231,18 @@ Sample cities (there are more available):
         
         if "location" in data and data["location"]:
             loc = data["location"]
-            if loc.get("city"):
+            zipcode = str(loc.get("zipcode") or "")
+            if zipcode and (location := self.zipcodes.resolve(zipcode)):
+                cleaned["location"].update(location)
+            elif loc.get("city"):
                 cleaned["location"]["city"] = loc["city"]
-                city_id, state, state_id = self._find_city_details(loc["city"])
-                if city_id:
-                    cleaned["location"]["city_id"] = city_id
-                if state:
-                    cleaned["location"]["state"] = state
-                if state_id:
-                    cleaned["location"]["state_id"] = state_id
+                location = self.locations.resolve(loc["city"], state=loc.get("state"))
+                if location:
+                    cleaned["location"].update(location)
         
         if "category" in data and data["category"]:
             cat = data["category"]
-            category_info = self._find_category_details(cat.get("category"), cat.get("subcategory"))
+            category_info = self.category_index.details(cat.get("category"), cat.get("subcategory"))
             cleaned["category"].update(category_info)
         
         if "price" in data and data["price"]:
@@ -155,40 +257,6 @@ Sample cities (there are more available):
         
         return cleaned
 
-    def _find_city_details(self, city_name: str) -> tuple[str | None, str | None, str | None]:
-        """Find city_id, state, and state_id for a given city name."""
-        for state, state_data in self.cities.items():
-            if "cities" in state_data:
-                for city, city_id in state_data["cities"].items():
-                    if city.lower() == city_name.lower():
-                        return city_id, state, state_data.get("id")
-        return None, None, None
-
-    def _find_category_details(self, category_name: str | None, subcategory_name: str | None) -> dict:
-        """Find category and subcategory IDs."""
-        result = {}
-        
-        if category_name:
-            for cat, cat_data in self.categories.items():
-                if cat.lower() == category_name.lower():
-                    result["category"] = cat
-                    result["category_id"] = cat_data.get("id")
-                    break
-        
-        if subcategory_name:
-            for cat, cat_data in self.categories.items():
-                if "subcategories" in cat_data:
-                    for subcat, subcat_id in cat_data["subcategories"].items():
-                        if subcat.lower() == subcategory_name.lower():
-                            result["subcategory"] = subcat
-                            result["subcategory_id"] = subcat_id
-                            if not result.get("category"):
-                                result["category"] = cat
-                                result["category_id"] = cat_data.get("id")
-                            break
-        
-        return result
-
     def _empty_preference_data(self) -> dict:
         """Return empty preference data structure."""
         return {
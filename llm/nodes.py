@@ -10,8 +10,8 @@ from models.preferences import Location, Category, Price, Preference
 
 logger = logging.getLogger(__name__)
 
-gemini_client = GeminiClient()
 mongo_client = MongoClientManager()
+gemini_client = GeminiClient(cache_store=mongo_client)
 
 def extract_preference_node(state: PreferenceState) -> PreferenceState:
     """Extract preference data from user input."""
@@ -158,26 +158,10 @@ def location_node(state: PreferenceState) -> PreferenceState:
     user_input = state.user_input.strip()
     
     # Try to extract city from user input (more flexible matching)
-    city_info = gemini_client._find_city_details(user_input)
-    if city_info[0]:  # city_id found
-        # Find the properly capitalized city name from the database
-        proper_city_name = None
-        for state_name, state_data in gemini_client.cities.items():
-            if "cities" in state_data:
-                for city, city_id in state_data["cities"].items():
-                    if city.lower() == user_input.lower():
-                        proper_city_name = city
-                        break
-                if proper_city_name:
-                    break
-        
+    location = gemini_client.locations.resolve(user_input)
+    if location:
         # Update the preference with the new location
-        updated_location = Location(
-            city=proper_city_name or user_input.title(),
-            city_id=city_info[0],
-            state=city_info[1],
-            state_id=city_info[2]
-        )
+        updated_location = Location(**location)
         
         # Update preference
         preference = state.preference
@@ -0,0 +1,324 @@
+"""Indexed lookups of cities, states and categories from the Kleinanzeigen reference data."""
+
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+from rapidfuzz import fuzz, process
+
+# Shortest postal code prefix that narrows a location down
+MIN_ZIPCODE_PREFIX = 2
+
+# Minimum rapidfuzz score to accept a misspelt name
+FUZZY_SCORE_CUTOFF = 85
+
+# Words joining the parts of place names: "Frankfurt am Main", "Halle (Saale)", "Bad Homburg v. d. Höhe"
+NAME_CONNECTORS = {"am", "an", "auf", "der", "den", "dem", "im", "in", "ob", "bei", "a", "i", "d", "v", "vor"}
+
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+
+# Everyday words mapped to (category, subcategory), beyond the category names themselves
+CATEGORY_KEYWORDS = {
+    "sofa": ("Haus & Garten", "Wohnzimmer"),
+    "couch": ("Haus & Garten", "Wohnzimmer"),
+    "sessel": ("Haus & Garten", "Wohnzimmer"),
+    "regal": ("Haus & Garten", "Wohnzimmer"),
+    "bett": ("Haus & Garten", "Schlafzimmer"),
+    "kleiderschrank": ("Haus & Garten", "Schlafzimmer"),
+    "geschirr": ("Haus & Garten", "Küche & Esszimmer"),
+    "teller": ("Haus & Garten", "Küche & Esszimmer"),
+    "tassen": ("Haus & Garten", "Küche & Esszimmer"),
+    "esstisch": ("Haus & Garten", "Küche & Esszimmer"),
+    "stuhl": ("Haus & Garten", "Küche & Esszimmer"),
+    "stühle": ("Haus & Garten", "Küche & Esszimmer"),
+    "schreibtisch": ("Haus & Garten", "Büro"),
+    "schreibtischstuhl": ("Haus & Garten", "Büro"),
+    "bürostuhl": ("Haus & Garten", "Büro"),
+    "lampe": ("Haus & Garten", "Lampen & Licht"),
+    "pflanzen": ("Haus & Garten", "Gartenzubehör & Pflanzen"),
+    "fahrrad": ("Auto, Rad & Boot", "Fahrräder & Zubehör"),
+    "bike": ("Auto, Rad & Boot", "Fahrräder & Zubehör"),
+    "auto": ("Auto, Rad & Boot", "Autos"),
+    "car": ("Auto, Rad & Boot", "Autos"),
+    "smartphone": ("Elektronik", "Handy & Telefon"),
+    "iphone": ("Elektronik", "Handy & Telefon"),
+    "laptop": ("Elektronik", "Notebooks"),
+    "notebook": ("Elektronik", "Notebooks"),
+    "fernseher": ("Elektronik", "TV & Video"),
+    "tv": ("Elektronik", "TV & Video"),
+    "xbox": ("Elektronik", "Konsolen"),
+    "playstation": ("Elektronik", "Konsolen"),
+    "ps5": ("Elektronik", "Konsolen"),
+    "controller": ("Elektronik", "Konsolen"),
+    "kinderwagen": ("Familie, Kind & Baby", "Kinderwagen & Buggys"),
+    "spielzeug": ("Familie, Kind & Baby", "Spielzeug"),
+    "bücher": ("Musik, Filme & Bücher", "Bücher & Zeitschriften"),
+    "gitarre": ("Musik, Filme & Bücher", "Musikinstrumente"),
+    "klavier": ("Musik, Filme & Bücher", "Musikinstrumente"),
+    "wohnung": ("Immobilien", "Mietwohnungen"),
+}
+
+def _words(name: str) -> list[str]:
+    name = unicodedata.normalize("NFKC", name).casefold().translate(UMLAUTS)
+    # Remaining accents, e.g. "Citroën"
+    name = "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+    return re.findall(r"[a-z0-9]+", name)
+
+def normalize_name(name: str) -> str:
+    """Key under which spelling variants of a name meet.
+
+    Ignores case, punctuation and connecting words, and spells umlauts and ß
+    out, so "Frankfurt am Main", "Frankfurt (Main)" and "frankfurt main" or
+    "München" and "Muenchen" share a key.
+    """
+    words = _words(name)
+    return " ".join(word for word in words if word not in NAME_CONNECTORS) or " ".join(words)
+
+def _short_name(name: str) -> str | None:
+    """The part before a qualifier: "Halle" for "Halle (Westfalen)", "Freiburg" for "Freiburg im Breisgau"."""
+    base = name.split("(")[0]
+    words = _words(base)
+    for i, word in enumerate(words):
+        if word in NAME_CONNECTORS:
+            words = words[:i]
+            break
+    short = " ".join(words)
+    return short if short and short != normalize_name(name) else None
+
+def _location_rank(location: dict) -> int:
+    return int(location["city_id"].lstrip("l") or 0)
+
+class _NameIndex:
+    """Normalised name -> candidates, best first, with a fuzzy fallback over the keys."""
+
+    def __init__(self):
+        self.entries: dict[str, list[dict]] = {}
+        self.choices: dict[tuple[str, int], list[str]] = {}
+
+    def add(self, key: str, entry: dict):
+        candidates = self.entries.setdefault(key, [])
+        if entry not in candidates:
+            candidates.append(entry)
+
+    def freeze(self):
+        """Precompute the fuzzy choice arrays, by first letter and length, once all names are added."""
+        self.choices = {}
+        for key in self.entries:
+            self.choices.setdefault((key[:1], len(key)), []).append(key)
+
+    def get(self, name: str) -> list[dict]:
+        return self.entries.get(normalize_name(name), [])
+
+    def fuzzy(self, name: str) -> list[dict]:
+        """Candidates of the closest name starting with the same letter."""
+        key = normalize_name(name)
+        # fuzz.ratio cannot reach the cutoff when lengths differ by more than this share of their sum
+        max_share = 1 - FUZZY_SCORE_CUTOFF / 100
+        best, best_score = None, FUZZY_SCORE_CUTOFF
+        for (first, length), keys in self.choices.items():
+            if first != key[:1] or abs(length - len(key)) > max_share * (length + len(key)):
+                continue
+            match = process.extractOne(key, keys, scorer=fuzz.ratio, processor=None, score_cutoff=best_score)
+            if match and (best is None or match[1] > best_score):
+                best, best_score = match[0], match[1]
+        return self.entries[best] if best else []
+
+class CityResolver:
+    """Finds the Kleinanzeigen location of a city or state name in O(1).
+
+    States come first, then cities by their full name, then cities by their
+    short name without qualifier. Several cities of one name, like the
+    "Neustadt"s of four states, are kept in file order; of several short
+    name matches the lowest location id wins, e.g. "Frankfurt" resolves to
+    Frankfurt am Main rather than Frankfurt (Oder).
+    """
+
+    def __init__(self, cities: dict):
+        self.index = _NameIndex()
+        short_names: dict[str, list[dict]] = {}
+        for state, state_data in cities.items():
+            self.index.add(normalize_name(state), {"state": state, "state_id": state_data.get("id")})
+        for state, state_data in cities.items():
+            for city, city_id in state_data.get("cities", {}).items():
+                location = {"city": city, "city_id": city_id, "state": state, "state_id": state_data.get("id")}
+                self.index.add(normalize_name(city), location)
+                if short := _short_name(city):
+                    short_names.setdefault(short, []).append(location)
+        for short, locations in short_names.items():
+            for location in sorted(locations, key=_location_rank):
+                self.index.add(short, location)
+        self.index.freeze()
+
+    @staticmethod
+    def _pick(candidates: list[dict], state: str | None, unique: bool = False) -> dict | None:
+        if state:
+            state_key = normalize_name(state)
+            in_state = [c for c in candidates if normalize_name(c["state"]) == state_key]
+            candidates = in_state or candidates
+        if unique and len({c["state"] for c in candidates}) > 1:
+            return None
+        return dict(candidates[0]) if candidates else None
+
+    def lookup(self, name: str, state: str | None = None, unique: bool = False) -> dict | None:
+        """Location for an exactly known name (up to normalisation), preferring cities in ``state``.
+
+        With ``unique`` a name found in several states, like "Neustadt"
+        without a state, gives None instead of the first of them.
+        """
+        return self._pick(self.index.get(name), state, unique)
+
+    def resolve(self, name: str, state: str | None = None, unique: bool = False) -> dict | None:
+        """Like lookup, falling back to the name without qualifier and then the closest name.
+
+        "Halle an der Saale" finds Halle, "Wiesbdaen" finds Wiesbaden.
+        """
+        candidates = self.index.get(name)
+        if not candidates and (short := _short_name(name)):
+            candidates = self.index.get(short)
+        if not candidates:
+            candidates = self.index.fuzzy(name)
+        return self._pick(candidates, state, unique)
+
+class ZipCodeResolver:
+    """Maps German postal codes (PLZ) and their 2- to 4-digit prefixes to locations.
+
+    Codes are kept as one sorted array plus the position of each code's
+    location in a deduplicated location table; a prefix is the range of
+    codes found by bisection. A prefix, or a 5-digit code missing from the
+    data, resolves to the city all its codes share, else to their common
+    state, else to nothing.
+    """
+
+    def __init__(self, zipcodes: dict, cities: CityResolver):
+        self.cities = cities
+        self.locations: list[dict] = []
+        slot_of: dict[tuple, int] = {}
+        self.codes = sorted(zipcodes)
+        self.slots = array("H")
+        for code in self.codes:
+            location = self._locate(zipcodes[code]["city"], zipcodes[code]["state"])
+            key = tuple(sorted(location.items()))
+            if key not in slot_of:
+                slot_of[key] = len(self.locations)
+                self.locations.append(location)
+            self.slots.append(slot_of[key])
+
+    def _locate(self, city: str, state: str) -> dict:
+        """Location of a postal code's place name, within its state; the state itself if the city is unknown."""
+        # "Schipkau Annahütte, Karl-Marx-Siedlung" is a district of Schipkau
+        for name in dict.fromkeys((city, city.split(",")[0], city.split()[0])):
+            location = self.cities.resolve(name, state=state)
+            if location and location["state"] == state:
+                return location
+        return self.cities.lookup(state) or {"state": state}
+
+    def _common(self, start: int, end: int) -> dict | None:
+        slots = set(self.slots[start:end])
+        if len(slots) == 1:
+            return dict(self.locations[slots.pop()])
+        states = {(self.locations[slot]["state"], self.locations[slot].get("state_id")) for slot in slots}
+        if len(states) == 1:
+            state, state_id = states.pop()
+            return {"state": state, "state_id": state_id}
+        return None
+
+    def resolve(self, code: str) -> dict | None:
+        """Location for a 5-digit postal code or a prefix of at least MIN_ZIPCODE_PREFIX digits."""
+        code = code.strip()
+        if not code.isdigit() or not MIN_ZIPCODE_PREFIX <= len(code) <= 5:
+            return None
+        
+        i = bisect_left(self.codes, code)
+        if len(code) == 5 and i < len(self.codes) and self.codes[i] == code:
+            return dict(self.locations[self.slots[i]])
+        
+        for prefix in (code[:length] for length in range(min(len(code), 4), MIN_ZIPCODE_PREFIX - 1, -1)):
+            start = bisect_left(self.codes, prefix)
+            end = bisect_left(self.codes, prefix + ":")  # ":" sorts right after "9"
+            if start < end:
+                return self._common(start, end)
+        return None
+
+class CategoryResolver:
+    """Finds categories and subcategories by name, everyday keyword or name part in O(1).
+
+    Main categories win over subcategories of the same name, full names over
+    keywords, and keywords over the parts of "A & B" names. Parts of main
+    category names come before parts of subcategory names, which only count
+    when they belong to a single subcategory: "Auto" is the keyword for Autos
+    and "Haus" means Haus & Garten, not the Dienstleistungen of that name.
+    """
+
+    def __init__(self, categories: dict, keywords: dict[str, tuple[str, str]] = CATEGORY_KEYWORDS):
+        self.categories = categories
+        self.main = _NameIndex()
+        self.sub = _NameIndex()
+        self.index = _NameIndex()
+
+        main_parts: dict[str, list[dict]] = {}
+        for category in categories:
+            entry = self._entry(category)
+            self.main.add(normalize_name(category), entry)
+            self.index.add(normalize_name(category), entry)
+            for part in self._name_parts(category):
+                main_parts.setdefault(part, []).append(entry)
+        sub_parts: dict[str, list[dict]] = {}
+        for category, cat_data in categories.items():
+            for subcategory in cat_data.get("subcategories", {}):
+                entry = self._entry(category, subcategory)
+                self.sub.add(normalize_name(subcategory), entry)
+                self.index.add(normalize_name(subcategory), entry)
+                for part in self._name_parts(subcategory):
+                    sub_parts.setdefault(part, []).append(entry)
+        for keyword, (category, subcategory) in keywords.items():
+            if subcategory in categories.get(category, {}).get("subcategories", {}):
+                self.index.add(normalize_name(keyword), self._entry(category, subcategory))
+        for parts in (main_parts, sub_parts):
+            for part, owners in parts.items():
+                # A part naming several categories is ambiguous, and never overrides a name or keyword
+                if len(owners) == 1 and part not in self.index.entries:
+                    self.index.add(part, owners[0])
+
+        for index in (self.main, self.sub, self.index):
+            index.freeze()
+
+    @staticmethod
+    def _name_parts(name: str) -> list[str]:
+        """Normalised parts of "A, B & C" names, without the catch-all "Weitere ..." ones."""
+        return [
+            normalize_name(part) for part in re.split(r"\s*(?:&|,|/)\s*", name)
+            if part and not part.lower().startswith(("weitere", "-"))
+        ]
+
+    def _entry(self, category: str, subcategory: str | None = None) -> dict:
+        entry = {"category": category, "category_id": self.categories[category].get("id")}
+        if subcategory:
+            entry["subcategory"] = subcategory
+            entry["subcategory_id"] = self.categories[category]["subcategories"][subcategory]
+        return entry
+
+    def lookup(self, name: str) -> dict | None:
+        """Category for a known name, name part or keyword (up to normalisation)."""
+        candidates = self.index.get(name)
+        return dict(candidates[0]) if candidates else None
+
+    def resolve(self, name: str) -> dict | None:
+        """Like lookup, falling back to the closest name for misspellings."""
+        candidates = self.index.get(name) or self.index.fuzzy(name)
+        return dict(candidates[0]) if candidates else None
+
+    def details(self, category_name: str | None, subcategory_name: str | None) -> dict:
+        """Category and subcategory IDs for the names an LLM answered with.
+
+        A subcategory is looked up in the given category first; found
+        elsewhere, its own parent category replaces the given one so the IDs
+        stay consistent.
+        """
+        result = {}
+        if category_name and (main := self.main.get(category_name)):
+            result.update(main[0])
+        if subcategory_name and (subs := self.sub.get(subcategory_name)):
+            in_category = [s for s in subs if s["category"] == result.get("category")]
+            result.update((in_category or subs)[0])
+        return result
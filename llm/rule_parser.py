@@ -0,0 +1,191 @@
+"""Deterministic parsing of common preference inputs, so they need no LLM call."""
+
+import re
+
+from llm.resolvers import CategoryResolver, CityResolver, ZipCodeResolver
+from utils.helpers import find_time_window, parse_time_window
+
+FREE_PATTERN = re.compile(r"\b(?:zu verschenken|verschenken|kostenlos|umsonst|gratis|geschenkt|free)\b")
+# German thousands grouping, "1.500" or "1.500,50", before a plain or decimal amount
+GROUPED_AMOUNT = r"\d{1,3}(?:\.\d{3})+(?:,\d+)?"
+AMOUNT = rf"({GROUPED_AMOUNT}(?!\d)|\d+(?:[.,]\d+)?)"
+CURRENCY_WORD = r"\s*(?:€|eur\b|euro\b)"
+CURRENCY = rf"(?:{CURRENCY_WORD})?"
+PRICE_RANGE_PATTERN = re.compile(rf"\b{AMOUNT}{CURRENCY}\s*(?:-|–|bis|to)\s*{AMOUNT}{CURRENCY}")
+PRICE_MAX_PATTERN = re.compile(
+    rf"(?:\b(?:max(?:imal)?|bis|unter|höchstens|under|up to|below)|<)\s*{AMOUNT}{CURRENCY}"
+)
+PRICE_MIN_PATTERN = re.compile(rf"(?:\b(?:ab|mindestens|min|über|from|over|above)|>)\s*{AMOUNT}{CURRENCY}")
+PRICE_ONLY_PATTERN = re.compile(rf"^{AMOUNT}{CURRENCY}$")
+CURRENCY_WORD_PATTERN = re.compile(CURRENCY_WORD)
+ZIPCODE_PATTERN = re.compile(r"\b\d{5}\b")
+
+# Words that carry no preference of their own
+FILLER_WORDS = {
+    "in", "im", "aus", "bei", "um", "nähe", "near", "around", "for", "für", "und", "and", "mit", "with",
+    "ich", "suche", "i", "search", "looking", "want", "a", "an", "the", "ein", "eine", "einen",
+    "der", "die", "das", "den", "letzte", "letzten", "last", "past", "innerhalb", "within", "preis", "price",
+    "plz", "postleitzahl",
+}
+
+# Words that may stand right before a price range in free text
+RANGE_LEAD_WORDS = FILLER_WORDS | {"zwischen", "between", "von"}
+
+# Longest city or category name, in words, tried when scanning free text
+MAX_NAME_WORDS = 5
+
+def _amount(value: str) -> int:
+    if re.fullmatch(GROUPED_AMOUNT, value):
+        value = value.replace(".", "")
+    return int(float(value.replace(",", ".")))
+
+def _is_bare_range(text: str, match: re.Match) -> bool:
+    """Whether a range in free text may as well be something else than a price.
+
+    Without a currency "11-13" is as likely a model or size, and a range right
+    after a name, like "iPhone 11 bis 13 Euro", probably starts with a model number.
+    """
+    if not CURRENCY_WORD_PATTERN.search(match.group(0)):
+        return True
+    before = re.findall(r"[\w\-()&]+", text[:match.start()])
+    return bool(before) and before[-1] not in RANGE_LEAD_WORDS
+
+def _price_range(match: re.Match) -> dict | None:
+    low, high = _amount(match.group(1)), _amount(match.group(2))
+    # A descending "range" is something else, like "55130 bis 100" with a postal code
+    return {"price_from": low, "price_to": high} if low <= high else None
+
+def _price_conditions(text: str) -> list[tuple[dict | None, re.Match]]:
+    """Every price condition in lowercased text, most specific kind first.
+
+    A range that may not be a price at all is listed with None as its condition.
+    """
+    conditions = [({"price_from": 0, "price_to": 0}, match) for match in FREE_PATTERN.finditer(text)]
+    for match in PRICE_RANGE_PATTERN.finditer(text):
+        if price := _price_range(match):
+            conditions.append((None if _is_bare_range(text, match) else price, match))
+    conditions += [({"price_from": 0, "price_to": _amount(match.group(1))}, match)
+                   for match in PRICE_MAX_PATTERN.finditer(text)]
+    # price_to 0 with price_from set means no upper limit
+    conditions += [({"price_from": _amount(match.group(1)), "price_to": 0}, match)
+                   for match in PRICE_MIN_PATTERN.finditer(text)]
+    return conditions
+
+def find_price(text: str) -> tuple[dict, re.Match] | None:
+    """Locate the price condition in lowercased text, with the match that expressed it.
+
+    None also when the text holds conflicting conditions, like "kostenlos bis 10",
+    or a range that may be a model number, like "iPhone 11-13".
+    """
+    conditions = _price_conditions(text)
+    if not conditions or any(price is None for price, _ in conditions):
+        return None
+    price, match = conditions[0]
+    # "bis 100" inside "10 bis 100" is the same condition, anything outside it another one
+    if any(other.start() < match.start() or other.end() > match.end() for _, other in conditions[1:]):
+        return None
+    return price, match
+
+def parse_price(text: str) -> dict | None:
+    """Parse a price answer such as "max 50 EUR", "10-100", "ab 20" or "verschenken"."""
+    text = text.lower().strip()
+    if match := PRICE_ONLY_PATTERN.match(text):
+        # A bare amount answers "what's your price range?" with a maximum
+        return {"price_from": 0, "price_to": _amount(match.group(1))}
+    if match := PRICE_RANGE_PATTERN.fullmatch(text):
+        # As the answer to the price question a bare range is a price after all
+        return _price_range(match)
+    found = find_price(text)
+    return found[0] if found else None
+
+class RuleBasedParser:
+    """Answers price, time window, city and category inputs without the LLM.
+
+    Every ``parse*`` method returns None when it is not sure, which callers
+    take as the cue to ask Gemini instead.
+    """
+
+    def __init__(self, locations: CityResolver, categories: CategoryResolver,
+                 zipcodes: ZipCodeResolver | None = None):
+        self.locations = locations
+        self.categories = categories
+        self.zipcodes = zipcodes
+
+    def _name(self, text: str) -> str:
+        return " ".join(word for word in self._words(text) if word not in FILLER_WORDS)
+
+    def parse_location(self, text: str) -> dict | None:
+        """Postal code or prefix, or exact or slightly misspelt city or state name.
+
+        A city name found in several states is left to the LLM.
+        """
+        name = self._name(text)
+        if name.isdigit():
+            return self.zipcodes.resolve(name) if self.zipcodes else None
+        return self.locations.resolve(name, unique=True) if name else None
+
+    def parse_category(self, text: str) -> dict | None:
+        """Category keyword or exact or slightly misspelt (sub)category name."""
+        name = self._name(text)
+        return self.categories.resolve(name) if name else None
+
+    def parse(self, text: str, field: str | None = None) -> dict | None:
+        """Parse one field of a preference, or a whole preference when ``field`` is None.
+
+        Returns only the fields found, e.g. ``{"price": {...}}``. A whole
+        preference is only returned when every word of the text was
+        understood, otherwise the LLM gets the chance to do better.
+        """
+        if field == "price":
+            price = parse_price(text)
+            return {"price": price} if price else None
+        if field == "time_window":
+            time_window = parse_time_window(text)
+            return {"time_window": time_window} if time_window else None
+        if field == "location":
+            location = self.parse_location(text)
+            return {"location": location} if location else None
+        if field == "category":
+            category = self.parse_category(text)
+            return {"category": category} if category else None
+        return self._parse_preference(text)
+
+    def _parse_preference(self, text: str) -> dict | None:
+        text = text.lower()
+        result = {}
+
+        if found := find_price(text):
+            result["price"], match = found
+            text = text[:match.start()] + " " + text[match.end():]
+        if (match := find_time_window(text)) and (time_window := parse_time_window(match.group(0))):
+            result["time_window"] = time_window
+            text = text[:match.start()] + " " + text[match.end():]
+        if self.zipcodes and (match := ZIPCODE_PATTERN.search(text)):
+            if location := self.zipcodes.resolve(match.group(0)):
+                result["location"] = location
+                text = text[:match.start()] + " " + text[match.end():]
+
+        words = [word for word in self._words(text) if word not in FILLER_WORDS]
+        while words:
+            for size in range(min(MAX_NAME_WORDS, len(words)), 0, -1):
+                name = " ".join(words[:size])
+                location = self.locations.lookup(name, unique=True) if "location" not in result else None
+                category = self.categories.lookup(name)
+                if location:
+                    result["location"] = location
+                elif category and result.get("category", category) == category:
+                    # Repeats are fine, "Xbox Controller" names one category twice
+                    result["category"] = category
+                else:
+                    continue
+                words = words[size:]
+                break
+            else:
+                # A word we cannot place, e.g. a brand or a misspelling
+                return None
+
+        return result or None
+
+    @staticmethod
+    def _words(text: str) -> list[str]:
+        return re.findall(r"[\w\-()&]+", text.lower())
@@ -2,6 +2,7 @@ import logging
 import sys
 
 from core.config import config
+from core.constants import SENDER_MODE_ALL, SENDER_MODES
 from core.mongo_client import MongoClientManager
 from bot.bot import run_bot
 
@@ -20,10 +21,10 @@ def run_offers_scraper():
     from runners.offers_scraper import main as scraper_main
     scraper_main()
 
-def run_message_sender():
+def run_message_sender(mode: str = SENDER_MODE_ALL):
     """Run the message sender."""
     from runners.message_sender import main as sender_main
-    sender_main()
+    sender_main(mode)
 
 if __name__ == "__main__":
     logger.info("Starting application...")
@@ -44,8 +45,13 @@ if __name__ == "__main__":
             logger.info("Starting offers scraper")
             run_offers_scraper()
         elif command == "sender":
-            logger.info("Starting message sender")
-            run_message_sender()
+            mode = sys.argv[2] if len(sys.argv) > 2 else SENDER_MODE_ALL
+            if mode not in SENDER_MODES:
+                logger.error(f"Unknown sender mode: {mode}")
+                logger.info(f"Available sender modes: {', '.join(SENDER_MODES)}")
+                exit(1)
+            logger.info(f"Starting message sender ({mode})")
+            run_message_sender(mode)
         elif command == "bot":
             logger.info("Starting Telegram bot")
             run_bot()
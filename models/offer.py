@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from datetime import datetime, timezone
 
 class Location(BaseModel):
@@ -21,12 +21,15 @@ class Offer(BaseModel):
     link: str | None = None
     offer_date: str
     photos: list[str] = []
+    photo_file_id: str | None = None  # Telegram file_id of photos[0] once uploaded
     location: Location
     category: Category
     price: float = 0.0  # 0 for "Zu verschenken", actual price for priced offers
+    lane: str | None = None  # scraping lane that found the offer, unset for offers from before lanes
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     
-    def __init__(self, **data):
-        if data.get("_id"):
-            data["_id"] = str(data["_id"])
-        super().__init__(**data)
+    @field_validator("id", mode="before")
+    @classmethod
+    def coerce_object_id(cls, value):
+        # Mongo may hand back ObjectIds; done as a validator so construction stays in pydantic-core
+        return str(value) if value else value
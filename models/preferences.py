@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime, timezone
 
 class Location(BaseModel):
@@ -18,7 +18,9 @@ class Price(BaseModel):
     price_to: int = 0
 
 class Preference(BaseModel):
-    _id: str | None = None
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: str | None = Field(default=None, alias='_id')
     location: Location
     category: Category
     price: Price = Price()
@@ -30,3 +32,21 @@ class UserPreferences(BaseModel):
     _id: str | None = None
     user_id: int
     preferences: list[Preference] = []
+    inactive_since: datetime | None = None  # Set when the user blocked the bot or the chat is gone
+    last_probe_at: datetime | None = None
+
+class ExtractedLocation(BaseModel):
+    city: str = Field(default="", description="City as the user wrote it, empty if not mentioned")
+    state: str = Field(default="", description="German federal state, empty if not mentioned")
+    zipcode: str = Field(default="", description="German postal code (PLZ), empty if not mentioned")
+
+class ExtractedCategory(BaseModel):
+    category: str = Field(default="", description="Main category name from the list")
+    subcategory: str = Field(default="", description="Subcategory name from the list")
+
+class PreferenceExtraction(BaseModel):
+    """Fields of a Preference as the LLM fills them in, before names are resolved to IDs."""
+    location: ExtractedLocation = ExtractedLocation()
+    category: ExtractedCategory = ExtractedCategory()
+    price: Price = Price()
+    time_window: int = Field(default=604800, description="Search window in seconds")
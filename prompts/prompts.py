@@ -2,16 +2,16 @@
 
 PREFERENCE_EXTRACTION_PROMPT = """You are a helpful assistant that extracts structured preference data from German/English mixed user input for Kleinanzeigen searches.
 
-Extract the following information from user input and return ONLY valid JSON:
-- location: city, state, city_id, state_id (if mentioned)
-- category: category, subcategory, category_id, subcategory_id (match to available categories)
+Extract the following information from user input and fill in the preference fields:
+- location: city, state, zipcode (if mentioned)
+- category: category, subcategory (names from the list below)
 - price: price_from, price_to (0 means free/"verschenken")
 - time_window: seconds (default 604800 for one week, 172800 for 2 days, etc.)
 
 Category Matching Rules:
 - Always prefer subcategories over main categories when applicable
 - "Geschirr", "Teller", "Tassen" → "Küche & Esszimmer" subcategory
-- "Schreibtischstuhl", "Bürostuhl" → "Büro" subcategory  
+- "Schreibtischstuhl", "Bürostuhl" → "Büro" subcategory
 - "Xbox Controller", "PlayStation Controller" → "Konsolen" subcategory
 - "Sofa", "Couch" → "Wohnzimmer" subcategory
 - Match German and English terms to the most specific available category
@@ -19,15 +19,27 @@ Category Matching Rules:
 Price Rules:
 - "unter X EUR", "max X EUR", "bis X EUR" means price_to: X, price_from: 0
 - "verschenken", "kostenlos", "free" means both price_from: 0, price_to: 0
-- "ab X EUR" means price_from: X, price_to: null
+- "ab X EUR" means price_from: X, price_to: 0 (no upper limit)
 
 Location Rules:
-- If city is mentioned, try to match it with available data
-- Return null for city if not mentioned or not found
+- Return the city as the user wrote it, it is matched against all German cities afterwards
+- A German postal code (PLZ) such as "55130" goes into zipcode
+- Leave city empty if not mentioned
 
 Time Rules:
 - "letzte 2 Tage" = 172800, "eine Woche" = 604800, "letzte Woche" = 604800
 - Default to 604800 (one week) if not specified
 
-Return JSON format:
-{{"location": {{"city": "...", "state": "...", "city_id": "...", "state_id": "..."}}, "category": {{"category": "...", "subcategory": "...", "category_id": "...", "subcategory_id": "..."}}, "price": {{"price_from": 0, "price_to": 0}}, "time_window": 604800}}"""
+Categories (category: subcategory | subcategory | ...):
+{categories}"""
+
+def build_preference_extraction_prompt(categories: dict) -> str:
+    """Extraction prompt with one compact line per category of the categories.json data.
+
+    IDs are left out, they are looked up by name after extraction.
+    """
+    category_lines = "\n".join(
+        f"{category}: {' | '.join(cat_data.get('subcategories', {}))}"
+        for category, cat_data in categories.items()
+    )
+    return PREFERENCE_EXTRACTION_PROMPT.format(categories=category_lines)
@@ -0,0 +1,83 @@
+"""Buffered delivery acknowledgements for the message sender."""
+
+import asyncio
+import logging
+import time
+
+from core.constants import ACK_FLUSH_SIZE, ACK_FLUSH_INTERVAL
+from core.mongo_client import MongoClientManager
+
+logger = logging.getLogger(__name__)
+
+class DeliveryAckBuffer:
+    """Collects sent-offer acknowledgements and writes them to Mongo in batches.
+
+    Acks are flushed as one unordered bulk write once ``max_size`` acks are
+    pending or ``max_interval`` seconds have passed since the last flush. The
+    write runs in a worker thread so the event loop keeps sending. Use the
+    buffer as an async context manager to guarantee a final flush on shutdown.
+    """
+
+    def __init__(self, mongo_client: MongoClientManager, max_size: int = ACK_FLUSH_SIZE,
+                 max_interval: float = ACK_FLUSH_INTERVAL):
+        self.mongo_client = mongo_client
+        self.max_size = max_size
+        self.max_interval = max_interval
+        self._pending: list[tuple[int, str, str]] = []
+        self._last_flush = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._flusher: asyncio.Task | None = None
+        self.total_flushed = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def __aenter__(self) -> "DeliveryAckBuffer":
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def add(self, user_id: int, preference_id: str, offer_id: str):
+        """Record a successful delivery, flushing if a threshold is reached."""
+        self._pending.append((user_id, preference_id, offer_id))
+        if len(self._pending) >= self.max_size or self._interval_elapsed():
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Write all pending acks to Mongo. Returns the number of acks written."""
+        async with self._lock:
+            if not self._pending:
+                return 0
+
+            batch, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+            try:
+                await asyncio.to_thread(self.mongo_client.mark_offers_as_sent_bulk, batch)
+            except Exception as e:
+                # Keep the acks so the next flush retries them
+                self._pending = batch + self._pending
+                logger.error(f"Failed to flush {len(batch)} delivery acks: {e}")
+                return 0
+
+            self.total_flushed += len(batch)
+            logger.info(f"Flushed {len(batch)} delivery acks")
+            return len(batch)
+
+    def _interval_elapsed(self) -> bool:
+        return time.monotonic() - self._last_flush >= self.max_interval
+
+    async def _flush_periodically(self):
+        """Flush on the time threshold even when no new acks arrive."""
+        while True:
+            await asyncio.sleep(self.max_interval)
+            if self._pending and self._interval_elapsed():
+                await self.flush()
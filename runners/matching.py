@@ -0,0 +1,183 @@
+"""Helpers for matching offers against many user preferences at once."""
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from core.mongo_client import delivery_priority
+from core.offer_query import price_bounds
+from models.offer import Offer
+from models.preferences import Preference, UserPreferences
+from utils.helpers import as_utc
+
+def preference_key(preference: Preference) -> tuple:
+    """Hashable key of everything that decides which offers a preference matches.
+
+    Preferences with the same key match exactly the same offers, so their
+    matches only need to be computed once.
+    """
+    return (
+        preference.location.city_id,
+        preference.location.state_id,
+        preference.category.category_id,
+        preference.category.subcategory_id,
+        preference.price.price_from,
+        preference.price.price_to,
+        preference.time_window,
+    )
+
+def user_sent_offers(user_prefs: UserPreferences) -> set[str]:
+    """Offers already sent to a user through any of their preferences."""
+    return set().union(*(preference.sent_offers for preference in user_prefs.preferences))
+
+def group_preferences(user_preferences: list[UserPreferences]) -> dict[tuple, list[tuple[UserPreferences, Preference]]]:
+    """Group all (user, preference) pairs by their canonical preference key."""
+    groups: dict[tuple, list[tuple[UserPreferences, Preference]]] = {}
+    for user_prefs in user_preferences:
+        for preference in user_prefs.preferences:
+            groups.setdefault(preference_key(preference), []).append((user_prefs, preference))
+    return groups
+
+# Code of a preference field that is not set and matches any offer
+ANY = -1
+# Code of an offer value that no preference asks for
+UNKNOWN = -2
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+def to_micros(dt: datetime) -> int:
+    """Microseconds since the epoch, exact for comparisons with datetimes."""
+    return (as_utc(dt) - EPOCH) // MICROSECOND
+
+class BatchMatcher:
+    """Matches a window of offers against many preferences with NumPy.
+
+    Preferences are compiled once into columnar arrays: location and category
+    ids become interned integer codes, prices float64 bounds and time windows
+    int64 microseconds. ``match`` converts offers the same way and evaluates every
+    predicate as a vectorised comparison. Offers are bucketed by city so
+    preferences for one city are only compared with offers from that city.
+    """
+
+    FIELDS = (
+        ("location", "city_id"),
+        ("location", "state_id"),
+        ("category", "category_id"),
+        ("category", "subcategory_id"),
+    )
+
+    def __init__(self, preferences: list[Preference], chunk_size: int = 1 << 22):
+        self.preferences = preferences
+        # Upper bound on the number of cells evaluated in one broadcast
+        self.chunk_size = chunk_size
+        self.vocabularies: list[dict[str, int]] = [{} for _ in self.FIELDS]
+
+        codes = np.empty((len(self.FIELDS), len(preferences)), dtype=np.int64)
+        for column, (group, field) in enumerate(self.FIELDS):
+            vocabulary = self.vocabularies[column]
+            for row, preference in enumerate(preferences):
+                value = getattr(getattr(preference, group), field)
+                codes[column, row] = vocabulary.setdefault(value, len(vocabulary)) if value else ANY
+        self.codes = codes
+
+        bounds = np.array([price_bounds(p.price) for p in preferences], dtype=np.float64).reshape(-1, 2)
+        self.price_from, self.price_to = bounds[:, 0], bounds[:, 1]
+        self.time_window = np.array([p.time_window for p in preferences], dtype=np.int64) * 1_000_000
+
+        # Preference rows grouped by city code, wildcard cities first
+        self._order = np.argsort(codes[0], kind="stable")
+        self._city_codes, self._city_starts = np.unique(codes[0][self._order], return_index=True)
+
+    def _offer_columns(self, offers: list[Offer]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        codes = np.empty((len(self.FIELDS), len(offers)), dtype=np.int64)
+        for column, (group, field) in enumerate(self.FIELDS):
+            vocabulary = self.vocabularies[column]
+            codes[column] = [vocabulary.get(getattr(getattr(offer, group), field), UNKNOWN) for offer in offers]
+        prices = np.array([offer.price for offer in offers], dtype=np.float64)
+        created_at = np.array([to_micros(offer.created_at) for offer in offers], dtype=np.int64)
+        return codes, prices, created_at
+
+    def match(self, offers: list[Offer], now: datetime | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Return the sparse match matrix as (preference index, offer index) arrays.
+
+        Pairs are sorted by preference index, then offer index.
+        """
+        if not offers or not self.preferences:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+
+        now_ts = to_micros(now or datetime.now(timezone.utc))
+        codes, prices, created_at = self._offer_columns(offers)
+        offer_order = np.argsort(codes[0], kind="stable")
+        offer_cities = codes[0][offer_order]
+
+        pref_hits, offer_hits = [], []
+        bounds = list(self._city_starts[1:]) + [len(self.preferences)]
+        for city, start, end in zip(self._city_codes.tolist(), self._city_starts.tolist(), bounds):
+            if city == ANY:
+                candidates = offer_order
+            else:
+                left, right = np.searchsorted(offer_cities, [city, city + 1])
+                candidates = offer_order[left:right]
+            if len(candidates) == 0:
+                continue
+
+            rows = self._order[start:end]
+            step = max(1, self.chunk_size // len(candidates))
+            for chunk_start in range(0, len(rows), step):
+                chunk = rows[chunk_start:chunk_start + step]
+                mask = self._evaluate(chunk, candidates, codes, prices, created_at, now_ts)
+                chunk_index, candidate_index = np.nonzero(mask)
+                pref_hits.append(chunk[chunk_index])
+                offer_hits.append(candidates[candidate_index])
+
+        if not pref_hits:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        pref_indices = np.concatenate(pref_hits)
+        offer_indices = np.concatenate(offer_hits)
+        order = np.lexsort((offer_indices, pref_indices))
+        return pref_indices[order], offer_indices[order]
+
+    def _evaluate(self, rows: np.ndarray, candidates: np.ndarray, codes: np.ndarray,
+                  prices: np.ndarray, created_at: np.ndarray, now_ts: int) -> np.ndarray:
+        """Boolean (len(rows), len(candidates)) matrix of preference/offer matches."""
+        offer_prices = prices[candidates]
+        mask = (offer_prices >= self.price_from[rows, None]) & (offer_prices <= self.price_to[rows, None])
+        mask &= created_at[candidates] >= (now_ts - self.time_window[rows])[:, None]
+        # The city already matches by construction of the buckets
+        for column in range(1, len(self.FIELDS)):
+            wanted = self.codes[column, rows][:, None]
+            mask &= (wanted == ANY) | (wanted == codes[column, candidates])
+        return mask
+
+class PreferenceSnapshot:
+    """All preferences compiled once for matching new offers.
+
+    Built whenever preferences are reloaded, so matching a batch of new
+    offers only converts the offers. ``labels`` maps preference ids to the
+    labels stored with their deliveries.
+    """
+
+    def __init__(self, user_preferences: list[UserPreferences], labels: dict[str, str]):
+        self.user_preferences = user_preferences
+        self.labels = labels
+        self.sent_by_user = {user_prefs.user_id: user_sent_offers(user_prefs) for user_prefs in user_preferences}
+        # Identical preferences match the same offers, so only evaluate one of each
+        self.groups = list(group_preferences(user_preferences).values())
+        self.matcher = BatchMatcher([subscribers[0][1] for subscribers in self.groups])
+
+    def match(self, offers: list[Offer], now: datetime | None = None) -> dict[tuple[int, str, str], float]:
+        """Deliveries of not yet sent offers, as (user_id, preference_id, offer_id) with their priority."""
+        group_indices, offer_indices = self.matcher.match(offers, now)
+
+        deliveries = {}
+        for group_index, offer_index in zip(group_indices.tolist(), offer_indices.tolist()):
+            offer = offers[offer_index]
+            subscribers = self.groups[group_index]
+            priority = delivery_priority(offer.created_at, offer.price, subscribers[0][1].time_window)
+            for user_prefs, preference in subscribers:
+                if offer.id not in self.sent_by_user[user_prefs.user_id]:
+                    deliveries[(user_prefs.user_id, preference.id, offer.id)] = priority
+        return deliveries
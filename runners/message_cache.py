@@ -0,0 +1,71 @@
+"""In-process caches shared across recipients by the message sender."""
+
+from collections import OrderedDict
+from typing import Callable
+
+from pydantic import BaseModel
+
+from core.constants import PHOTO_CACHE_SIZE, RENDER_CACHE_SIZE
+from models.offer import Offer
+
+class RenderedOffer(BaseModel):
+    """Telegram payload for an offer. Identical for every recipient."""
+    caption: str
+    text: str
+    parse_mode: str = "Markdown"
+    photo_url: str | None = None
+
+class PhotoFileIdCache:
+    """LRU map from offer photo URLs to the Telegram file_id of an uploaded copy.
+
+    The first send of a photo makes Telegram fetch the remote URL. Later
+    recipients reuse the returned file_id, which Telegram serves from its own
+    storage without touching the image host again.
+    """
+
+    def __init__(self, max_size: int = PHOTO_CACHE_SIZE):
+        self.max_size = max_size
+        self._file_ids: OrderedDict[str, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, photo_url: str) -> str | None:
+        file_id = self._file_ids.get(photo_url)
+        if file_id is None:
+            self.misses += 1
+            return None
+        self._file_ids.move_to_end(photo_url)
+        self.hits += 1
+        return file_id
+
+    def put(self, photo_url: str, file_id: str):
+        self._file_ids[photo_url] = file_id
+        self._file_ids.move_to_end(photo_url)
+        if len(self._file_ids) > self.max_size:
+            self._file_ids.popitem(last=False)
+
+    def invalidate(self, photo_url: str):
+        self._file_ids.pop(photo_url, None)
+
+class RenderCache:
+    """LRU of rendered offer payloads, so each offer is formatted once per run."""
+
+    def __init__(self, max_size: int = RENDER_CACHE_SIZE):
+        self.max_size = max_size
+        self._rendered: OrderedDict[str, RenderedOffer] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, offer: Offer, render: Callable[[Offer], RenderedOffer]) -> RenderedOffer:
+        rendered = self._rendered.get(offer.id)
+        if rendered is not None:
+            self._rendered.move_to_end(offer.id)
+            self.hits += 1
+            return rendered
+
+        self.misses += 1
+        rendered = render(offer)
+        self._rendered[offer.id] = rendered
+        if len(self._rendered) > self.max_size:
+            self._rendered.popitem(last=False)
+        return rendered
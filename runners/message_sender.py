@@ -1,184 +1,499 @@
 #!/usr/bin/env python3
 """Message sender runner for sending offers to users."""
 
+import os
 import logging
 import asyncio
-from datetime import datetime, timezone, timedelta
+import signal
+import socket
+import statistics
+import threading
+import time
+from collections.abc import Iterable
+from datetime import datetime, timezone
 from urllib.parse import urlparse
 
 from telegram import Bot
-from telegram.error import TelegramError
+from telegram.constants import ParseMode, ChatAction
+from telegram.helpers import escape_markdown
+from telegram.error import TelegramError, RetryAfter, BadRequest, Forbidden
 
 from core.config import config
-from core.mongo_client import MongoClientManager
-from core.constants import MSG_OFFER_TEMPLATE, TELEGRAM_MAX_MESSAGE_LENGTH
+from core.async_mongo_client import AsyncMongoClientManager
+from core.mongo_client import MongoClientManager, delivery_priority
+from core.offer_query import OFFER_DELIVERY_PROJECTION, compile_offer_filter
+from core.constants import (
+    MSG_OFFER_TEMPLATE, TELEGRAM_MAX_MESSAGE_LENGTH, OFFER_DESCRIPTION_MAX_LENGTH, OUTBOX_CLAIM_BATCH,
+    PREFERENCES_REFRESH_INTERVAL, DEAD_CHAT_PROBE_INTERVAL, SENDER_MODE_ALL, SENDER_MODE_MATCH,
+    SENDER_MODE_DELIVER, SENDER_MODE_DAEMON, SENDER_MODE_WITH_SCRAPER, MATCH_STRATEGY_AGGREGATE,
+    AGGREGATE_ENQUEUE_BATCH, OUTBOX_INACTIVE_CHAT_ERROR
+)
+from llm.formatters import format_location, format_category
 from models.offer import Offer
-from models.preferences import UserPreferences
+from models.preferences import UserPreferences, Preference
+from runners.ack_buffer import DeliveryAckBuffer
+from runners.matching import PreferenceSnapshot, preference_key, user_sent_offers
+from runners.message_cache import PhotoFileIdCache, RenderCache, RenderedOffer
+from runners.offer_events import OfferEventSource, QueueOfferSource, create_offer_source
+from runners.offers_scraper import LANE_REGULAR, OffersScraper
+from utils.helpers import as_utc
 
 logger = logging.getLogger(__name__)
 
+def is_dead_chat_error(error: TelegramError) -> bool:
+    """Whether an error means the chat blocked the bot or no longer exists."""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and "chat not found" in str(error).lower()
+
+def preference_label(preference: Preference) -> str:
+    """Short description of a preference for the 'matched by' note."""
+    return f"{format_category(preference.category)} in {format_location(preference.location)}"
+
+def preference_labels(user_prefs: UserPreferences) -> dict[str, str]:
+    return {preference.id: preference_label(preference) for preference in user_prefs.preferences}
+
+def offer_priority(offer: dict, preference: Preference) -> float:
+    """Delivery priority of an offer document from get_matching_offers."""
+    return delivery_priority(offer["created_at"], offer.get("price", 0.0), preference.time_window)
+
 class MessageSender:
     def __init__(self):
         self.mongo_client = MongoClientManager()
+        # Same client, awaitable from the event loop
+        self.async_mongo_client = AsyncMongoClientManager(self.mongo_client)
         self.bot = Bot(token=config.BOT_TOKEN)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.photo_cache = PhotoFileIdCache()
+        self.render_cache = RenderCache()
+        self.api_calls_saved = 0
         
     def _format_offer_message(self, offer: Offer) -> str:
-        """Format offer data into message template."""
-        # Clean description text (Markdown doesn't need HTML escaping)
-        description = offer.description.strip()[:200] + "..." if len(offer.description) > 200 else offer.description.strip()
+        """Format offer data into message template, escaping Markdown in scraped text."""
+        description = offer.description.strip()
+        if len(description) > OFFER_DESCRIPTION_MAX_LENGTH:
+            description = description[:OFFER_DESCRIPTION_MAX_LENGTH] + "..."
         
         return MSG_OFFER_TEMPLATE.format(
-            description=description,
-            address=offer.address,
-            date=offer.offer_date,
+            description=escape_markdown(description),
+            address=escape_markdown(offer.address),
+            date=escape_markdown(offer.offer_date),
             link=offer.link or "https://www.kleinanzeigen.de"
         )
     
-    def _matches_preference(self, offer: Offer, preference) -> bool:
-        """Check if offer matches user preference criteria."""
-        # Check location match
-        if preference.location.city_id and offer.location.city_id != preference.location.city_id:
-            return False
-        if preference.location.state_id and offer.location.state_id != preference.location.state_id:
-            return False
-            
-        # Check category match
-        if preference.category.category_id and offer.category.category_id != preference.category.category_id:
-            return False
-        if preference.category.subcategory_id and offer.category.subcategory_id != preference.category.subcategory_id:
-            return False
-            
-        # Check price range
-        if preference.price.price_to > 0 and offer.price > preference.price.price_to:
-            return False
-        if preference.price.price_from > 0 and offer.price < preference.price.price_from:
-            return False
-            
-        # Check time window
-        offer_time = datetime.now(timezone.utc) - timedelta(seconds=preference.time_window)
-        if offer.created_at < offer_time:
-            return False
-            
-        return True
+    def _render_offer(self, offer: Offer) -> RenderedOffer:
+        """Build the Telegram payload for an offer."""
+        text = f"**{escape_markdown(offer.title)}**\n\n{self._format_offer_message(offer)}"
+        if len(text) > TELEGRAM_MAX_MESSAGE_LENGTH:
+            text = text[:TELEGRAM_MAX_MESSAGE_LENGTH-3] + "..."
+        
+        return RenderedOffer(
+            caption=offer.title,
+            text=text,
+            parse_mode=ParseMode.MARKDOWN,
+            photo_url=offer.photos[0] if offer.photos else None
+        )
     
-    async def _send_offer_to_user(self, user_id: int, offer: Offer) -> bool:
-        """Send a single offer to a user."""
-        try:
-            message = self._format_offer_message(offer)
-            
-            # Send photo if available
-            if offer.photos:
-                try:
-                    await self.bot.send_photo(
-                        chat_id=user_id,
-                        photo=offer.photos[0],
-                        caption=offer.title
-                    )
-                except TelegramError as e:
-                    logger.warning(f"Failed to send photo to user {user_id}: {e}")
-                    # Continue with text message
-            
-            # Send message
-            if len(message) > TELEGRAM_MAX_MESSAGE_LENGTH:
-                message = message[:TELEGRAM_MAX_MESSAGE_LENGTH-3] + "..."
-                
-            await self.bot.send_message(
-                chat_id=user_id,
-                text=f"**{offer.title}**\n\n{message}",
-                parse_mode='Markdown',
-                disable_web_page_preview=True
+    async def _send_offer_photo(self, user_id: int, offer: Offer, rendered: RenderedOffer):
+        """Send the offer's first photo, reusing Telegram's file_id once it was uploaded."""
+        photo_url = rendered.photo_url
+        file_id = self.photo_cache.get(photo_url) or offer.photo_file_id
+        
+        if file_id:
+            try:
+                await self.bot.send_photo(chat_id=user_id, photo=file_id, caption=rendered.caption)
+                return
+            except BadRequest as e:
+                # Stale or foreign file_id, fall back to the original URL
+                logger.warning(f"Cached photo for offer {offer.id} rejected, resending from URL: {e}")
+                self.photo_cache.invalidate(photo_url)
+        
+        message = await self.bot.send_photo(chat_id=user_id, photo=photo_url, caption=rendered.caption)
+        if message and message.photo:
+            file_id = message.photo[-1].file_id
+            self.photo_cache.put(photo_url, file_id)
+            offer.photo_file_id = file_id
+            try:
+                await self.async_mongo_client.set_offer_photo_file_id(offer.id, file_id)
+            except Exception as e:
+                logger.warning(f"Failed to store photo file_id for offer {offer.id}: {e}")
+    
+    async def _send_offer_to_user(self, user_id: int, offer: Offer, matched_labels: list[str] | None = None):
+        """Send a single offer to a user. Raises TelegramError if the message could not be sent."""
+        rendered = self.render_cache.get_or_render(offer, self._render_offer)
+        text = rendered.text
+        if matched_labels:
+            note = "\n\n🔎 " + escape_markdown("; ".join(matched_labels))
+            text = text[:TELEGRAM_MAX_MESSAGE_LENGTH - len(note)] + note
+        
+        # Send photo if available
+        if rendered.photo_url:
+            try:
+                await self._send_offer_photo(user_id, offer, rendered)
+            except TelegramError as e:
+                logger.warning(f"Failed to send photo to user {user_id}: {e}")
+                # Continue with text message
+        
+        await self.bot.send_message(
+            chat_id=user_id,
+            text=text,
+            parse_mode=rendered.parse_mode,
+            disable_web_page_preview=True
+        )
+        
+        logger.info(f"Successfully sent offer {offer.id} to user {user_id}")
+    
+    def _query_preference_offers(self, preference: Preference, exclude_ids: set[str]) -> list[dict]:
+        """Query the offers matching one preference, leaving out ``exclude_ids``."""
+        return self.mongo_client.get_matching_offers(compile_offer_filter(preference, exclude_ids=exclude_ids))
+    
+    def _match_new_offers(self, offer_docs: list[dict],
+                          snapshot: PreferenceSnapshot) -> dict[tuple[int, str, str], float]:
+        """Match freshly inserted offers against a snapshot of all preferences. CPU bound, run it in a thread."""
+        return snapshot.match([Offer(**doc) for doc in offer_docs])
+    
+    def _enqueue_aggregated_deliveries(self) -> int:
+        """Compute all pending deliveries with one server-side aggregation and queue them."""
+        total_enqueued = 0
+        total_preferences = 0
+        deliveries: dict[tuple[int, str, str], float] = {}
+        labels: dict[str, str] = {}
+        
+        for user_id, preference, offers in self.mongo_client.iter_pending_matches():
+            total_preferences += 1
+            labels[preference.id] = preference_label(preference)
+            for offer in offers:
+                deliveries[(user_id, preference.id, offer["_id"])] = offer_priority(offer, preference)
+            if len(deliveries) >= AGGREGATE_ENQUEUE_BATCH:
+                total_enqueued += self.mongo_client.enqueue_deliveries(list(deliveries), labels, deliveries)
+                deliveries, labels = {}, {}
+        
+        total_enqueued += self.mongo_client.enqueue_deliveries(list(deliveries), labels, deliveries)
+        logger.info(
+            f"Aggregation matched {total_preferences} preferences: "
+            f"queued {total_enqueued} new deliveries"
+        )
+        return total_enqueued
+    
+    def enqueue_pending_deliveries(self, strategy: str | None = None,
+                                   user_preferences: Iterable[UserPreferences] | None = None,
+                                   preference_ids: set[str] | None = None) -> int:
+        """Match offers against user preferences and persist the deliveries in the outbox.
+        
+        ``strategy`` defaults to SENDER_MATCH_STRATEGY from the config. Preferences
+        are streamed from the database unless ``user_preferences`` are given, and
+        only those in ``preference_ids`` are matched when it is set; such a partial
+        pass always runs the per-preference queries.
+        """
+        if preference_ids is None and (strategy or config.SENDER_MATCH_STRATEGY) == MATCH_STRATEGY_AGGREGATE:
+            return self._enqueue_aggregated_deliveries()
+        
+        # Stream users from the database, keeping only what matching needs per user
+        sent_by_user: dict[int, set[str]] = {}
+        labels_by_user: dict[int, dict[str, str]] = {}
+        groups: dict[tuple, list[tuple[int, Preference]]] = {}
+        if user_preferences is None:
+            user_preferences = self.mongo_client.iter_user_preferences()
+        for user_prefs in user_preferences:
+            sent_by_user[user_prefs.user_id] = user_sent_offers(user_prefs)
+            labels_by_user[user_prefs.user_id] = preference_labels(user_prefs)
+            for preference in user_prefs.preferences:
+                if preference_ids is None or preference.id in preference_ids:
+                    groups.setdefault(preference_key(preference), []).append((user_prefs.user_id, preference))
+        logger.info(f"Found {len(sent_by_user)} users with preferences")
+        
+        inactive_users, skipped_preferences = self.mongo_client.get_inactive_user_stats()
+        if inactive_users:
+            logger.info(
+                f"Skipped {inactive_users} inactive users "
+                f"({skipped_preferences} preference queries saved)"
             )
+        
+        deliveries_by_user: dict[int, dict[tuple[int, str, str], float]] = {user_id: {} for user_id in sent_by_user}
+        
+        # Run one query per distinct preference and fan the result out to its subscribers
+        total_preferences = sum(len(subscribers) for subscribers in groups.values())
+        for subscribers in groups.values():
+            representative = subscribers[0][1]
+            # Offers every subscriber already got can be left out of the shared query
+            sent_to_all = set.intersection(*(sent_by_user[user_id] for user_id, _ in subscribers))
+            try:
+                offers = self._query_preference_offers(representative, sent_to_all)
+            except Exception as e:
+                logger.error(f"Error processing preference shared by {len(subscribers)} users: {e}")
+                continue
             
-            logger.info(f"Successfully sent offer {offer.id} to user {user_id}")
-            return True
+            priorities = [offer_priority(offer, representative) for offer in offers]
+            for user_id, preference in subscribers:
+                sent_offers = sent_by_user[user_id]
+                deliveries_by_user[user_id].update(
+                    ((user_id, preference.id, offer["_id"]), priority)
+                    for offer, priority in zip(offers, priorities) if offer["_id"] not in sent_offers
+                )
+        
+        if total_preferences:
+            logger.info(
+                f"Matched {total_preferences} preferences with {len(groups)} distinct queries "
+                f"(ratio {len(groups) / total_preferences:.2f}, "
+                f"{total_preferences - len(groups)} queries saved)"
+            )
+        
+        total_enqueued = 0
+        
+        for user_id, deliveries in deliveries_by_user.items():
+            if not deliveries:
+                continue
+            try:
+                enqueued = self.mongo_client.enqueue_deliveries(list(deliveries), labels_by_user[user_id], deliveries)
+            except Exception as e:
+                logger.error(f"Error queueing deliveries for user {user_id}: {e}")
+                continue
             
-        except TelegramError as e:
-            logger.error(f"Failed to send offer {offer.id} to user {user_id}: {e}")
-            return False
-    
-    def _mark_offer_as_sent(self, user_id: int, preference_id: str, offer_id: str):
-        """Mark offer as sent for a user's preference."""
-        try:
-            self.mongo_client.user_preferences_collection.update_one(
-                {"user_id": user_id, "preferences._id": preference_id},
-                {"$addToSet": {"preferences.$.sent_offers": offer_id}}
+            total_enqueued += enqueued
+            duplicates = len(deliveries) - len({offer_id for _, _, offer_id in deliveries})
+            logger.info(
+                f"Queued {enqueued} new deliveries for user {user_id}"
+                + (f" ({duplicates} matched more than one preference)" if duplicates else "")
             )
-        except Exception as e:
-            logger.error(f"Failed to mark offer {offer_id} as sent for user {user_id}: {e}")
+        
+        logger.info(f"Matching completed: queued {total_enqueued} new deliveries")
+        return total_enqueued
     
-    async def send_offers_to_users(self):
-        """Main method to send offers to all users."""
-        logger.info("Starting message sender process")
+    async def deliver_pending(self) -> int:
+        """Drain the outbox: lease due deliveries, send them, then acknowledge, retry or dead-letter."""
+        total_sent = 0
+        # Seconds from an offer's creation until it reached the user, per lane
+        notify_latencies: dict[str, list[float]] = {}
+        # Chats found unreachable during this run. Kept per run, a user can reactivate with /start any time
+        unreachable_users: set[int] = set()
+        # Set when Telegram rate limits us, which ends this run
+        retry_after = None
         
-        try:
-            # Get all users with preferences
-            all_user_preferences = self.mongo_client.get_all_user_preferences()
-            logger.info(f"Found {len(all_user_preferences)} users with preferences")
-            
-            total_sent = 0
-            total_users_processed = 0
-            
-            for user_prefs in all_user_preferences:
-                user_id = user_prefs.user_id
-                logger.info(f"Processing user {user_id} with {len(user_prefs.preferences)} preferences")
+        async with DeliveryAckBuffer(self.mongo_client) as acks:
+            while retry_after is None:
+                entries = await self.async_mongo_client.claim_deliveries(
+                    self.worker_id, OUTBOX_CLAIM_BATCH
+                )
+                if not entries:
+                    break
                 
-                user_sent_count = 0
+                offer_ids = [entry["offer_id"] for entry in entries]
+                offers = await self.async_mongo_client.get_offers(
+                    {"_id": {"$in": offer_ids}}, OFFER_DELIVERY_PROJECTION
+                )
+                offers_by_id = {offer.id: offer for offer in offers}
                 
-                for preference in user_prefs.preferences:
-                    try:
-                        # Get offers matching this preference
-                        filter_criteria = {}
-                        
-                        # Build filter based on preference
-                        if preference.location.city_id:
-                            filter_criteria["location.city_id"] = preference.location.city_id
-                        elif preference.location.state_id:
-                            filter_criteria["location.state_id"] = preference.location.state_id
-                            
-                        if preference.category.category_id:
-                            filter_criteria["category.category_id"] = preference.category.category_id
-                        if preference.category.subcategory_id:
-                            filter_criteria["category.subcategory_id"] = preference.category.subcategory_id
-                        
-                        # Time window filter
-                        time_threshold = datetime.now(timezone.utc) - timedelta(seconds=preference.time_window)
-                        filter_criteria["created_at"] = {"$gte": time_threshold}
-                        
-                        # Exclude already sent offers
-                        sent_offers = getattr(preference, 'sent_offers', [])
-                        if sent_offers:
-                            filter_criteria["_id"] = {"$nin": sent_offers}
+                remaining = list(entries)
+                try:
+                    while remaining:
+                        entry = remaining[0]
+                        offer = offers_by_id.get(entry["offer_id"])
                         
-                        # Get matching offers
-                        offers = self.mongo_client.get_offers(filter_criteria)
-                        logger.info(f"Found {len(offers)} new offers for user {user_id} preference")
+                        if entry["user_id"] in unreachable_users:
+                            # Usually dead-lettered already when the chat was marked inactive, then this is a no-op
+                            await self.async_mongo_client.fail_delivery(
+                                entry, OUTBOX_INACTIVE_CHAT_ERROR, max_attempts=0
+                            )
+                        elif offer is None:
+                            await self.async_mongo_client.fail_delivery(
+                                entry, "Offer no longer exists", max_attempts=0
+                            )
+                        else:
+                            try:
+                                matches = entry.get("matches", [])
+                                await self._send_offer_to_user(
+                                    entry["user_id"], offer, [match["label"] for match in matches if match.get("label")]
+                                )
+                            except (Forbidden, BadRequest) as e:
+                                if not is_dead_chat_error(e):
+                                    logger.error(f"Failed to send offer {offer.id} to user {entry['user_id']}: {e}")
+                                    await self.async_mongo_client.fail_delivery(entry, str(e))
+                                else:
+                                    unreachable_users.add(entry["user_id"])
+                                    await self._mark_user_inactive(entry["user_id"], e)
+                            except RetryAfter as e:
+                                # Not the entry's fault: hand back it and the rest of the batch, uncounted
+                                logger.warning(f"Rate limited, pausing delivery for {e.retry_after}s")
+                                retry_after = e.retry_after
+                                break
+                            except TelegramError as e:
+                                logger.error(f"Failed to send offer {offer.id} to user {entry['user_id']}: {e}")
+                                if await self.async_mongo_client.fail_delivery(entry, str(e)):
+                                    logger.error(f"Dead-lettered delivery {entry['_id']}")
+                            else:
+                                for match in matches:
+                                    await acks.add(entry["user_id"], match["preference_id"], offer.id)
+                                total_sent += 1
+                                # Offers scraped before lanes existed all came from the regular one
+                                lane = offer.lane or LANE_REGULAR
+                                notify_latencies.setdefault(lane, []).append(
+                                    (datetime.now(timezone.utc) - as_utc(offer.created_at)).total_seconds()
+                                )
+                                
+                                # Small delay to avoid rate limiting
+                                await asyncio.sleep(0.5)
                         
-                        # Send offers to user
-                        for offer in offers:
-                            if self._matches_preference(offer, preference):
-                                success = await self._send_offer_to_user(user_id, offer)
-                                if success:
-                                    self._mark_offer_as_sent(user_id, preference._id, offer.id)
-                                    user_sent_count += 1
-                                    total_sent += 1
-                                    
-                                    # Small delay to avoid rate limiting
-                                    await asyncio.sleep(0.5)
-                                    
-                    except Exception as e:
-                        logger.error(f"Error processing preference for user {user_id}: {e}")
-                        continue
-                
-                logger.info(f"Sent {user_sent_count} offers to user {user_id}")
-                total_users_processed += 1
+                        remaining.pop(0)
+                finally:
+                    # Hand back leases we will not process so a restart resumes immediately
+                    if remaining:
+                        await self.async_mongo_client.release_deliveries(remaining, retry_after=retry_after)
+        
+        if total_sent:
+            logger.info(
+                f"Delivery completed: sent {total_sent} offers "
+                f"(rendered {self.render_cache.misses} messages, reused {self.render_cache.hits}; "
+                f"photo file_id cache: {self.photo_cache.hits} hits, {self.photo_cache.misses} misses)"
+            )
+            for lane, latencies in notify_latencies.items():
+                p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else latencies[0]
+                logger.info(
+                    f"Time to notify ({lane} lane, {len(latencies)} offers): "
+                    f"median {statistics.median(latencies):.0f}s, p99 {p99:.0f}s"
+                )
+        if self.api_calls_saved:
+            logger.info(f"Skipped {self.api_calls_saved} deliveries to inactive chats so far")
+        return total_sent
+    
+    async def _mark_user_inactive(self, user_id: int, error: TelegramError):
+        """Stop delivering to a chat that blocked the bot or no longer exists."""
+        logger.warning(f"Chat {user_id} is unreachable ({error}), marking user inactive")
+        dropped = await self.async_mongo_client.mark_user_inactive(user_id)
+        # The delivery that failed was attempted, the rest will not be
+        self.api_calls_saved += max(dropped - 1, 0)
+    
+    async def probe_inactive_users(self) -> int:
+        """Check whether inactive chats are reachable again. Returns the number of reactivated users."""
+        user_ids = await self.async_mongo_client.get_users_to_probe(DEAD_CHAT_PROBE_INTERVAL)
+        reactivated = 0
+        
+        for user_id in user_ids:
+            try:
+                await self.bot.send_chat_action(chat_id=user_id, action=ChatAction.TYPING)
+            except TelegramError as e:
+                logger.info(f"Chat {user_id} is still unreachable: {e}")
+                await self.async_mongo_client.set_user_probed(user_id)
+                continue
             
-            logger.info(f"Message sender completed: processed {total_users_processed} users, sent {total_sent} total offers")
+            await self.async_mongo_client.reactivate_user(user_id)
+            reactivated += 1
+        
+        if user_ids:
+            logger.info(f"Probed {len(user_ids)} inactive chats, reactivated {reactivated}")
+        return reactivated
+    
+    async def send_offers_to_users(self, mode: str = SENDER_MODE_ALL):
+        """Main method to send offers to all users.
+        
+        ``match`` only queues deliveries, ``deliver`` only drains the outbox and
+        ``all`` does both, so the two sides can also run as separate processes.
+        """
+        logger.info(f"Starting message sender process (mode={mode})")
+        
+        try:
+            await self.async_mongo_client.ensure_outbox_indexes()
+            await self.async_mongo_client.ensure_offer_indexes()
+            
+            if mode in (SENDER_MODE_ALL, SENDER_MODE_MATCH):
+                await self.probe_inactive_users()
+                await asyncio.to_thread(self.enqueue_pending_deliveries)
+            if mode in (SENDER_MODE_ALL, SENDER_MODE_DELIVER):
+                await self.deliver_pending()
+            
+            logger.info(f"MongoDB pool: {self.mongo_client.pool_stats()}")
                     
         except Exception as e:
             logger.error(f"Error in send_offers_to_users: {e}")
             raise
 
-def main():
+    async def _refresh_preferences(self, known_preference_ids: set[str]) -> PreferenceSnapshot:
+        """Reload all preferences and catch up on existing offers for ones created since the last load.
+        
+        On the first load every preference is new, and the catch-up is the full
+        matching pass. Returns the preferences compiled for matching new offers.
+        """
+        await self.probe_inactive_users()
+        user_preferences = await self.async_mongo_client.get_all_user_preferences()
+        
+        all_labels = {preference.id: preference_label(preference)
+                      for user_prefs in user_preferences for preference in user_prefs.preferences}
+        new_preference_ids = all_labels.keys() - known_preference_ids
+        if new_preference_ids:
+            # Identical new preferences share one query, like in the full pass
+            enqueued = await asyncio.to_thread(
+                self.enqueue_pending_deliveries,
+                user_preferences=user_preferences,
+                preference_ids=new_preference_ids if known_preference_ids else None,
+            )
+            logger.info(f"Queued {enqueued} deliveries for {len(new_preference_ids)} newly added preferences")
+            known_preference_ids.update(new_preference_ids)
+        
+        return await asyncio.to_thread(PreferenceSnapshot, user_preferences, all_labels)
+    
+    async def run_daemon(self, source: OfferEventSource):
+        """Keep running and deliver offers as soon as they are inserted.
+        
+        On start the full matching pass runs once to catch up. After that only
+        new offers from ``source`` are matched against an in-memory snapshot of
+        all preferences, which is refreshed every PREFERENCES_REFRESH_INTERVAL.
+        """
+        logger.info("Starting message sender daemon")
+        await self.async_mongo_client.ensure_outbox_indexes()
+        await self.async_mongo_client.ensure_offer_indexes()
+        
+        known_preference_ids: set[str] = set()
+        snapshot = await self._refresh_preferences(known_preference_ids)
+        preferences_loaded_at = time.monotonic()
+        
+        try:
+            while True:
+                # Also picks up retries that became due
+                await self.deliver_pending()
+                
+                if time.monotonic() - preferences_loaded_at >= PREFERENCES_REFRESH_INTERVAL:
+                    snapshot = await self._refresh_preferences(known_preference_ids)
+                    preferences_loaded_at = time.monotonic()
+                
+                offers = await source.next_batch()
+                if not offers:
+                    continue
+                
+                # Keep the loop free for ack flushing while the batch is matched
+                deliveries = await asyncio.to_thread(self._match_new_offers, offers, snapshot)
+                enqueued = await self.async_mongo_client.enqueue_deliveries(
+                    list(deliveries), snapshot.labels, deliveries
+                )
+                logger.info(f"Received {len(offers)} new offers, queued {enqueued} deliveries")
+        finally:
+            source.close()
+    
+    async def run_alongside_scraper(self):
+        """Run the offers scraper in a thread and feed its new offers straight to the daemon."""
+        source = QueueOfferSource()
+        scraper = OffersScraper(on_new_offers=source.publish)
+        threading.Thread(target=scraper.run_lanes, name="offers-scraper", daemon=True).start()
+        await self.run_daemon(source)
+
+    async def run(self, mode: str = SENDER_MODE_ALL):
+        """Run the sender, stopping cleanly on SIGTERM so buffered acks are flushed."""
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass  # Signal handlers are not available on this platform
+
+        try:
+            if mode == SENDER_MODE_DAEMON:
+                source = await asyncio.to_thread(create_offer_source, self.mongo_client)
+                await self.run_daemon(source)
+            elif mode == SENDER_MODE_WITH_SCRAPER:
+                await self.run_alongside_scraper()
+            else:
+                await self.send_offers_to_users(mode)
+        except asyncio.CancelledError:
+            logger.warning("Message sender interrupted, pending delivery acks were flushed")
+
+def main(mode: str = SENDER_MODE_ALL):
     """Main entry point for the message sender."""
     logging.basicConfig(
         format=config.LOG_FORMAT,
@@ -190,7 +505,7 @@ def main():
     sender = MessageSender()
     
     try:
-        asyncio.run(sender.send_offers_to_users())
+        asyncio.run(sender.run(mode))
         logger.info("Message sender completed successfully")
     except Exception as e:
         logger.error(f"Message sender failed: {e}")
@@ -0,0 +1,148 @@
+"""Sources of newly inserted offers for the message sender daemon."""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+from core.constants import DAEMON_BATCH_SIZE, DAEMON_POLL_INTERVAL
+from core.mongo_client import MongoClientManager
+
+logger = logging.getLogger(__name__)
+
+# Error code Mongo returns when change streams are used on a standalone server
+CHANGE_STREAM_NOT_SUPPORTED = 40573
+
+class OfferEventSource(ABC):
+    """Yields batches of newly inserted offer documents."""
+
+    @abstractmethod
+    async def next_batch(self) -> list[dict]:
+        """Wait briefly for new offers. Returns an empty list if none arrived."""
+
+    def close(self):
+        """Release resources held by the source."""
+
+class ChangeStreamOfferSource(OfferEventSource):
+    """Reads offer inserts from a Mongo change stream (replica sets only)."""
+
+    def __init__(self, mongo_client: MongoClientManager, batch_size: int = DAEMON_BATCH_SIZE,
+                 max_await_ms: int = DAEMON_POLL_INTERVAL * 1000):
+        self.mongo_client = mongo_client
+        self.batch_size = batch_size
+        self.max_await_ms = max_await_ms
+        self.resume_token = None
+        self._stream = None
+
+    def open(self):
+        """Open the change stream. Raises OperationFailure on standalone servers."""
+        self._stream = self.mongo_client.offers_collection.watch(
+            [{"$match": {"operationType": "insert"}}],
+            max_await_time_ms=self.max_await_ms,
+            resume_after=self.resume_token
+        )
+
+    def _read_batch(self) -> list[dict]:
+        offers = []
+        try:
+            if self._stream is None:
+                self.open()
+            while len(offers) < self.batch_size:
+                change = self._stream.try_next()
+                if change is None:
+                    break
+                self.resume_token = self._stream.resume_token
+                offers.append(change["fullDocument"])
+        except PyMongoError as e:
+            # Reopen from the last resume token on the next call
+            logger.warning(f"Change stream interrupted, resuming: {e}")
+            self.close()
+        return offers
+
+    async def next_batch(self) -> list[dict]:
+        return await asyncio.to_thread(self._read_batch)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+class WatermarkPollingOfferSource(OfferEventSource):
+    """Polls for offers inserted after the newest one already seen.
+
+    The watermark is ``inserted_at``, stamped by create_offers in insert
+    order. ``created_at`` would skip offers a slower scraper lane inserts
+    after a newer offer of another lane.
+    """
+
+    def __init__(self, mongo_client: MongoClientManager, batch_size: int = DAEMON_BATCH_SIZE,
+                 poll_interval: float = DAEMON_POLL_INTERVAL, watermark: datetime | None = None):
+        self.mongo_client = mongo_client
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        now = datetime.now(timezone.utc)
+        # Mongo keeps milliseconds, an offer inserted within this one must not fall below the watermark
+        self.watermark = watermark or now.replace(microsecond=now.microsecond // 1000 * 1000)
+        # Offers sharing the watermark timestamp that were already returned
+        self._seen_at_watermark: set[str] = set()
+
+    def _read_batch(self) -> list[dict]:
+        offers = list(
+            self.mongo_client.offers_collection
+            .find({"inserted_at": {"$gte": self.watermark}, "_id": {"$nin": list(self._seen_at_watermark)}})
+            .sort("inserted_at", ASCENDING)
+            .limit(self.batch_size)
+        )
+        for offer in offers:
+            inserted_at = offer["inserted_at"]
+            if inserted_at.tzinfo is None:
+                inserted_at = inserted_at.replace(tzinfo=timezone.utc)
+            if inserted_at > self.watermark:
+                self.watermark = inserted_at
+                self._seen_at_watermark = set()
+            self._seen_at_watermark.add(offer["_id"])
+        return offers
+
+    async def next_batch(self) -> list[dict]:
+        offers = await asyncio.to_thread(self._read_batch)
+        if not offers:
+            await asyncio.sleep(self.poll_interval)
+        return offers
+
+class QueueOfferSource(OfferEventSource):
+    """Receives offers directly from a scraper running in the same process."""
+
+    def __init__(self, poll_interval: float = DAEMON_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.queue: asyncio.Queue[list[dict]] = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+
+    def publish(self, offers: list[dict]):
+        """Hand newly saved offers to the sender. Safe to call from other threads."""
+        if offers:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, offers)
+
+    async def next_batch(self) -> list[dict]:
+        try:
+            offers = await asyncio.wait_for(self.queue.get(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            return []
+        while not self.queue.empty():
+            offers = offers + self.queue.get_nowait()
+        return offers
+
+def create_offer_source(mongo_client: MongoClientManager) -> OfferEventSource:
+    """Use a change stream when the server supports it, otherwise poll by watermark."""
+    source = ChangeStreamOfferSource(mongo_client)
+    try:
+        source.open()
+        logger.info("Listening for new offers on a change stream")
+        return source
+    except OperationFailure as e:
+        if e.code != CHANGE_STREAM_NOT_SUPPORTED:
+            raise
+        logger.info("Change streams not supported by this server, polling for new offers instead")
+        return WatermarkPollingOfferSource(mongo_client)
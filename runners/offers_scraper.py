@@ -1,26 +1,44 @@
 import time
 import logging
+import threading
 from datetime import datetime
+from typing import Callable, Iterable
 from core.mongo_client import MongoClientManager
-from scraper.scraper import find_offers
-from models.preferences import UserPreferences
+from core.offer_query import compile_offer_filter, is_free_only, price_bounds
+from scraper.scraper import MAX_PAGES, find_offers
+from models.preferences import UserPreferences, Price
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 SLEEP_INTERVAL = 300  # 5 minutes
+FREE_LANE_INTERVAL = 60  # free items are gone within minutes
+
+# Scraping lanes: the regular lane covers every preference with full price
+# pagination, the free lane polls page 1 for free-only preferences
+LANE_REGULAR = "regular"
+LANE_FREE = "free"
 
 class OffersScraper:
-    def __init__(self):
+    def __init__(self, on_new_offers: Callable[[list[dict]], None] | None = None):
         self.mongo_client = MongoClientManager()
+        # Called with newly saved offers, e.g. to notify a sender running in the same process
+        self.on_new_offers = on_new_offers
     
-    def build_scraping_urls(self, preferences: list[UserPreferences]) -> list[dict]:
-        """Build list of unique scraping criteria from user preferences."""
-        scraping_tasks = []
-        seen_criteria = set()
+    def build_scraping_urls(self, preferences: Iterable[UserPreferences], free_only: bool = False) -> list[dict]:
+        """Build list of unique scraping criteria from user preferences.
+        
+        ``preferences`` is consumed in a single pass, so it can be a stream
+        from the database. With ``free_only`` only preferences for free items
+        are considered.
+        """
+        tasks_by_criteria: dict[str, dict] = {}
         
         for user_prefs in preferences:
             for pref in user_prefs.preferences:
+                if free_only and not is_free_only(pref.price):
+                    continue
+                
                 category_id = pref.category.subcategory_id or pref.category.category_id
                 city_id = pref.location.city_id or pref.location.state_id
                 
@@ -28,33 +46,23 @@ class OffersScraper:
                     continue
                     
                 criteria_key = f"{category_id}_{city_id}"
-                if criteria_key not in seen_criteria:
-                    seen_criteria.add(criteria_key)
-                    scraping_tasks.append({
+                task = tasks_by_criteria.get(criteria_key)
+                if task is None:
+                    task = tasks_by_criteria[criteria_key] = {
                         'category_id': category_id,
                         'city_id': city_id,
+                        'preference': pref,
                         'price_ranges': []
-                    })
+                    }
+                task['price_ranges'].append({
+                    'price_from': pref.price.price_from,
+                    'price_to': pref.price.price_to
+                })
         
-        # Add price ranges for each unique criteria and merge overlapping ranges
+        # Merge overlapping price ranges to determine optimal scraping range
+        scraping_tasks = list(tasks_by_criteria.values())
         for task in scraping_tasks:
-            price_ranges = []
-            for user_prefs in preferences:
-                for pref in user_prefs.preferences:
-                    task_category_id = pref.category.subcategory_id or pref.category.category_id
-                    task_city_id = pref.location.city_id or pref.location.state_id
-                    
-                    if (task['category_id'] == task_category_id and 
-                        task['city_id'] == task_city_id):
-                        price_range = {
-                            'price_from': pref.price.price_from,
-                            'price_to': pref.price.price_to
-                        }
-                        price_ranges.append(price_range)
-            
-            # Merge overlapping price ranges to determine optimal scraping range
-            task['max_price'] = self._calculate_max_price_needed(price_ranges)
-            task['price_ranges'] = price_ranges
+            task['max_price'] = self._calculate_max_price_needed(task['price_ranges'])
         
         return scraping_tasks
     
@@ -80,47 +88,27 @@ class OffersScraper:
         if not price_ranges:
             return offers
             
+        bounds = [price_bounds(Price(**price_range)) for price_range in price_ranges]
         filtered_offers = []
         for offer in offers:
             offer_price = offer.get('price', 0.0)
-            
-            for price_range in price_ranges:
-                price_from = price_range['price_from']
-                price_to = price_range['price_to']
-                
-                # If both price_from and price_to are 0, user wants free items
-                if price_from == 0 and price_to == 0:
-                    if offer_price == 0:
-                        filtered_offers.append(offer)
-                        break
-                # If price_to is 0 but price_from > 0, user wants items from price_from onwards
-                elif price_to == 0 and price_from > 0:
-                    if offer_price >= price_from:
-                        filtered_offers.append(offer)
-                        break
-                # Normal price range
-                else:
-                    if price_from <= offer_price <= price_to:
-                        filtered_offers.append(offer)
-                        break
+            if any(low <= offer_price <= high for low, high in bounds):
+                filtered_offers.append(offer)
         
         return filtered_offers
     
-    def scrape_and_save_offers(self):
-        """Main scraping function that runs continuously."""
-        logger.info("Starting offers scraping session")
+    def scrape_and_save_offers(self, lane: str = LANE_REGULAR) -> int:
+        """Run one scraping session for ``lane``. Returns the number of new offers saved."""
+        logger.info(f"Starting offers scraping session ({lane} lane)")
+        free_lane = lane == LANE_FREE
         
-        # Get all user preferences
-        all_preferences = self.mongo_client.get_all_user_preferences()
-        if not all_preferences:
+        # Build scraping tasks while streaming user preferences
+        scraping_tasks = self.build_scraping_urls(self.mongo_client.iter_user_preferences(), free_only=free_lane)
+        if not scraping_tasks:
             logger.info("No user preferences found")
-            return
+            return 0
         
-        logger.info(f"Found {len(all_preferences)} users with preferences")
-        
-        # Build scraping tasks
-        scraping_tasks = self.build_scraping_urls(all_preferences)
-        logger.info(f"Generated {len(scraping_tasks)} unique scraping tasks")
+        logger.info(f"Generated {len(scraping_tasks)} unique scraping tasks ({lane} lane)")
         
         total_new_offers = 0
         
@@ -133,55 +121,69 @@ class OffersScraper:
             logger.info(f"Scraping category_id={category_id}, city_id={city_id}, max_price={max_price}")
             
             # Get existing offer IDs to avoid duplicates
-            filter_criteria = {
-                "location.city_id": city_id,
-                "category.category_id": category_id
-            }
+            filter_criteria = compile_offer_filter(task['preference'], match_price=False, match_time_window=False)
             existing_offer_ids = self.mongo_client.get_existing_offer_ids(filter_criteria)
             
-            # Scrape offers with pagination - continue until we reach max_price or no more offers
-            offers = find_offers(category_id, city_id, existing_offer_ids, max_price)
+            # Scrape offers with pagination - continue until we reach max_price or no more offers.
+            # Free offers sort first, so the free lane only needs the first page.
+            offers = find_offers(category_id, city_id, existing_offer_ids, max_price, max_pages=1 if free_lane else MAX_PAGES)
             
             if offers:
                 # Filter by price ranges
                 filtered_offers = self.filter_offers_by_price(offers, price_ranges)
                 
                 if filtered_offers:
+                    for offer in filtered_offers:
+                        offer['lane'] = lane
                     # Save to database
                     saved_ids = self.mongo_client.create_offers(filtered_offers)
                     total_new_offers += len(saved_ids)
+                    if self.on_new_offers and saved_ids:
+                        saved = set(saved_ids)
+                        self.on_new_offers([offer for offer in filtered_offers if offer["_id"] in saved])
                     logger.info(f"Saved {len(saved_ids)} new offers for category_id={category_id}, city_id={city_id}")
                 else:
                     logger.info(f"No offers matched price criteria for category_id={category_id}, city_id={city_id}")
             else:
                 logger.info(f"No new offers found for category_id={category_id}, city_id={city_id}")
         
-        logger.info(f"Scraping session completed. Total new offers: {total_new_offers}")
+        logger.info(f"Scraping session completed ({lane} lane). Total new offers: {total_new_offers}")
+        logger.info(f"MongoDB pool: {self.mongo_client.pool_stats()}")
+        return total_new_offers
     
-    def run_continuous(self):
+    def run_continuous(self, lane: str = LANE_REGULAR):
         """Run the scraper continuously with sleep intervals."""
-        logger.info(f"Starting continuous scraper with {SLEEP_INTERVAL}s intervals")
+        interval = FREE_LANE_INTERVAL if lane == LANE_FREE else SLEEP_INTERVAL
+        logger.info(f"Starting continuous scraper ({lane} lane) with {interval}s intervals")
         
         while True:
             try:
                 start_time = datetime.now()
-                self.scrape_and_save_offers()
+                new_offers = self.scrape_and_save_offers(lane)
                 end_time = datetime.now()
                 
                 duration = (end_time - start_time).total_seconds()
-                logger.info(f"Scraping session took {duration:.2f} seconds")
+                logger.info(
+                    f"Scraping session ({lane} lane) took {duration:.2f} seconds, "
+                    f"found {new_offers} new offers"
+                )
                 
-                logger.info(f"Sleeping for {SLEEP_INTERVAL} seconds...")
-                time.sleep(SLEEP_INTERVAL)
+                logger.info(f"Sleeping for {interval} seconds...")
+                time.sleep(interval)
                 
             except Exception as e:
-                logger.error(f"Error in scraping session: {e}")
-                logger.info(f"Continuing after error, sleeping for {SLEEP_INTERVAL} seconds...")
-                time.sleep(SLEEP_INTERVAL)
+                logger.error(f"Error in scraping session ({lane} lane): {e}")
+                logger.info(f"Continuing after error, sleeping for {interval} seconds...")
+                time.sleep(interval)
+    
+    def run_lanes(self):
+        """Run the free lane in a background thread and the regular lane in this one."""
+        threading.Thread(target=self.run_continuous, args=(LANE_FREE,), name="free-lane-scraper", daemon=True).start()
+        self.run_continuous(LANE_REGULAR)
 
 def main():
     scraper = OffersScraper()
-    scraper.run_continuous()
+    scraper.run_lanes()
 
 if __name__ == "__main__":
     main()
@@ -34,10 +34,9 @@ class OffersScraper:
 
     def get_scraping_tasks(self) -> list[tuple[str, str, dict]]:
         """Get unique scraping tasks from all user preferences."""
-        all_user_prefs = self.mongo_client.get_all_user_preferences()
         tasks = set()
         
-        for user_prefs in all_user_prefs:
+        for user_prefs in self.mongo_client.iter_user_preferences():
             for preference in user_prefs.preferences:
                 category_part, city_part = self.build_url_parts(preference)
                 
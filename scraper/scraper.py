@@ -6,6 +6,7 @@ from scraper.object_creator import create_category_object, create_location_objec
 
 BASE_URL = "https://www.kleinanzeigen.de"
 CUTOFF_DATE = 90
+MAX_PAGES = 50  # Safety limit for price-based scraping
 
 def scrap_category_location(soup: BeautifulSoup) -> dict[str, str]:
     """Extract category and location from breadcrumb."""
@@ -45,8 +46,9 @@ def scrap_category_location(soup: BeautifulSoup) -> dict[str, str]:
         "city": city.strip() if city else None
     }
 
-def find_offers(category_id: str = None, city_id: str = None, existing_offer_ids: set = None, max_price: float = 0) -> list[dict]:
-    """Find offers based on category and city filters up to max_price."""
+def find_offers(category_id: str = None, city_id: str = None, existing_offer_ids: set = None, max_price: float = 0,
+                max_pages: int = MAX_PAGES) -> list[dict]:
+    """Find offers based on category and city filters up to max_price, reading at most max_pages pages."""
     if existing_offer_ids is None:
         existing_offer_ids = set()
         
@@ -135,7 +137,7 @@ def find_offers(category_id: str = None, city_id: str = None, existing_offer_ids
             break
             
         page_number += 1
-        if page_number > 50:  # Increased safety limit for price-based scraping
+        if page_number > max_pages:
             break
             
     return results
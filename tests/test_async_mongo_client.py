@@ -0,0 +1,40 @@
+import asyncio
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from core.async_mongo_client import AsyncMongoClientManager
+
+class TestAsyncMongoClientManager:
+
+    def test_slow_query_does_not_block_other_calls(self):
+        """Calls run in worker threads, so one slow query leaves the event loop serving others."""
+        mongo_client = MagicMock()
+
+        def get_user_preferences(user_id):
+            if user_id == 1:
+                time.sleep(0.5)
+            return user_id
+
+        mongo_client.get_user_preferences.side_effect = get_user_preferences
+        async_client = AsyncMongoClientManager(mongo_client)
+
+        async def run():
+            slow = asyncio.create_task(async_client.get_user_preferences(1))
+            await asyncio.sleep(0.01)
+            start = time.perf_counter()
+            results = await asyncio.gather(*(async_client.get_user_preferences(user_id) for user_id in range(2, 12)))
+            elapsed = time.perf_counter() - start
+            assert await slow == 1
+            return results, elapsed
+
+        results, elapsed = asyncio.run(run())
+        assert results == list(range(2, 12))
+        assert elapsed < 0.2
+
+    def test_streaming_methods_are_not_exposed(self):
+        """A cursor would be consumed on the event loop, so iter_* methods have no async variant."""
+        async_client = AsyncMongoClientManager(MagicMock())
+        with pytest.raises(AttributeError):
+            async_client.iter_user_preferences
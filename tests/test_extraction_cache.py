@@ -0,0 +1,62 @@
+from unittest.mock import MagicMock, patch
+
+from core.mongo_client import MongoClientManager
+from llm.extraction_cache import ExtractionCache, extraction_cache_version
+
+DATA = {"location": {}, "category": {"category": "Elektronik"}, "price": {"price_from": 0, "price_to": 50}}
+
+class TestExtractionCache:
+
+    def test_key_ignores_case_and_whitespace(self):
+        cache = ExtractionCache("v1")
+        assert cache.key("Sofa  in Mainz ") == cache.key("sofa in mainz")
+        assert cache.key("Mainz", "location") != cache.key("Mainz")
+        assert cache.key("Mainz") != ExtractionCache("v2").key("Mainz")
+
+    def test_version_follows_prompt_and_data(self):
+        version = extraction_cache_version("prompt", {"Mainz": "l5315"})
+        assert version == extraction_cache_version("prompt", {"Mainz": "l5315"})
+        assert version != extraction_cache_version("prompt v2", {"Mainz": "l5315"})
+        assert version != extraction_cache_version("prompt", {"Mainz": "l5316"})
+
+    def test_local_lru_with_ttl(self):
+        cache = ExtractionCache("v1", max_size=2, ttl=60)
+        cache.put("a", DATA)
+        cache.put("b", DATA)
+        assert cache.get_local("a") == DATA
+        cache.put("c", DATA)
+        assert cache.get_local("b") is None
+        with patch("llm.extraction_cache.time.monotonic", return_value=10**9):
+            assert cache.get_local("a") is None
+
+    def test_results_are_copies(self):
+        cache = ExtractionCache("v1")
+        cache.put("a", DATA)
+        cache.get_local("a")["price"]["price_to"] = 100
+        assert cache.get_local("a") == DATA
+
+    def test_shared_tier(self):
+        """A result stored by another process is found in Mongo and then kept in process."""
+        store = MagicMock(spec=MongoClientManager)
+        store.get_cached_extraction.return_value = DATA
+        cache = ExtractionCache("v1", store, ttl=60)
+
+        assert cache.get("a") == DATA
+        assert cache.get("a") == DATA
+        store.get_cached_extraction.assert_called_once_with("a", 60)
+        assert cache.snapshot() == {"local_hits": 1, "shared_hits": 1, "misses": 0, "hit_rate": 1.0}
+
+        cache.put("b", DATA)
+        store.ensure_extraction_cache_indexes.assert_called_once_with(60)
+        store.cache_extraction.assert_called_once_with("b", "v1", DATA)
+
+    def test_store_errors_are_misses(self):
+        store = MagicMock(spec=MongoClientManager)
+        store.get_cached_extraction.side_effect = RuntimeError("down")
+        store.cache_extraction.side_effect = RuntimeError("down")
+        cache = ExtractionCache("v1", store)
+
+        assert cache.get("a") is None
+        cache.put("a", DATA)
+        assert cache.get("a") == DATA
+        assert cache.snapshot()["misses"] == 1
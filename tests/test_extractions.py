@@ -0,0 +1,169 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from bot.extractions import UserExtractions
+from core.config import config
+from core.constants import MSG_EXTRACTION_TIMEOUT, MSG_PROCESSING
+from models.preferences import PreferenceExtraction
+
+# Free text the rule-based parser cannot place, so it goes to the LLM
+LLM_INPUT = "etwas schönes für mein wohnzimmer"
+
+async def answer(text: str, delay: float = 0) -> str:
+    await asyncio.sleep(delay)
+    return text
+
+def stub_llm(client, delay: float = 0, running: list[int] | None = None):
+    """Replace the client's structured output runnable with one answering after ``delay`` seconds.
+
+    ``running`` gets the number of calls in flight each time one starts.
+    """
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+
+    in_flight = 0
+
+    async def extract(messages):
+        nonlocal in_flight
+        in_flight += 1
+        if running is not None:
+            running.append(in_flight)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            in_flight -= 1
+        return {"raw": AIMessage(content=""), "parsed": PreferenceExtraction(), "parsing_error": None}
+
+    client.extractor = RunnableLambda(extract)
+
+@pytest.fixture
+def gemini_client(monkeypatch):
+    """A GeminiClient without extraction cache and with two LLM slots."""
+    pytest.importorskip("langchain_google_genai")
+    from llm.gemini_client import GeminiClient
+
+    monkeypatch.setattr(config, "GOOGLE_API_KEY", "test-key")
+    monkeypatch.setattr(config, "EXTRACTION_CACHE_TTL", 0)
+    monkeypatch.setattr(config, "GEMINI_MAX_CONCURRENCY", 2)
+    return GeminiClient()
+
+@pytest.fixture
+def handlers(monkeypatch):
+    """The bot handlers with a fresh extraction registry and no extraction cache."""
+    pytest.importorskip("langchain_google_genai")
+    monkeypatch.setattr(config, "GOOGLE_API_KEY", "test-key")
+    from bot import handlers
+
+    monkeypatch.setattr(handlers, "extractions", UserExtractions())
+    monkeypatch.setattr(handlers.gemini_client, "cache", None)
+    return handlers
+
+def make_update(text: str = LLM_INPUT, user_id: int = 1):
+    """An incoming message whose first reply is the processing message."""
+    update = MagicMock()
+    update.effective_user.id = user_id
+    update.message.text = text
+    processing_msg = MagicMock()
+    processing_msg.delete = AsyncMock()
+    update.message.reply_text = AsyncMock(return_value=processing_msg)
+    return update, processing_msg
+
+class TestUserExtractions:
+
+    def test_newer_update_cancels_running_extraction(self):
+        """Two concurrent updates of one user: the first handler gets None, the second the answer."""
+        async def run():
+            extractions = UserExtractions()
+            first = asyncio.create_task(extractions.run(1, answer("stale", delay=5)))
+            await asyncio.sleep(0.01)
+            second = asyncio.create_task(extractions.run(1, answer("fresh")))
+            return await asyncio.wait_for(asyncio.gather(first, second), timeout=1)
+
+        assert asyncio.run(run()) == [None, "fresh"]
+
+    def test_cancel_from_where_the_update_arrives(self):
+        """Cancelling by user id stops only that user's extraction."""
+        async def run():
+            extractions = UserExtractions()
+            first = asyncio.create_task(extractions.run(1, answer("stale", delay=5)))
+            other = asyncio.create_task(extractions.run(2, answer("other", delay=0.05)))
+            await asyncio.sleep(0.01)
+            assert extractions.cancel(1)
+            assert not extractions.cancel(3)
+            return await asyncio.wait_for(asyncio.gather(first, other), timeout=1)
+
+        assert asyncio.run(run()) == [None, "other"]
+
+    def test_cancelled_handler_is_not_swallowed(self):
+        async def run():
+            extractions = UserExtractions()
+            handler = asyncio.create_task(extractions.run(1, answer("stale", delay=5)))
+            await asyncio.sleep(0.01)
+            handler.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await handler
+            assert not extractions.cancel(1)
+
+        asyncio.run(run())
+
+class TestGeminiExtraction:
+
+    def test_timeout_raises_and_frees_the_llm_slots(self, gemini_client):
+        """Timed out calls give their slot back, so later extractions still get one."""
+        async def run():
+            stub_llm(gemini_client, delay=5)
+            for _ in range(3):
+                with pytest.raises(asyncio.TimeoutError):
+                    await gemini_client.aextract_preference_data(LLM_INPUT, timeout=0.05)
+            stub_llm(gemini_client)
+            return await asyncio.wait_for(gemini_client.aextract_preference_data(LLM_INPUT), timeout=1)
+
+        assert asyncio.run(run()) == gemini_client._empty_preference_data()
+        assert gemini_client.extractions == 1
+
+    def test_concurrent_llm_calls_are_capped(self, gemini_client):
+        """Extractions beyond GEMINI_MAX_CONCURRENCY wait for a slot instead of calling Gemini."""
+        running = []
+        stub_llm(gemini_client, delay=0.05, running=running)
+
+        async def run():
+            return await asyncio.gather(*(gemini_client.aextract_preference_data(LLM_INPUT) for _ in range(5)))
+
+        assert len(asyncio.run(run())) == 5
+        assert max(running) == 2
+        assert gemini_client.llm_calls == 5
+
+class TestExtractionHandlers:
+
+    def test_superseded_extraction_only_removes_processing_message(self, handlers):
+        """A newer update cancels the running extraction: its handler cleans up and sends nothing."""
+        stub_llm(handlers.gemini_client, delay=5)
+        update, processing_msg = make_update()
+        context = MagicMock(user_data={})
+
+        async def run():
+            handler = asyncio.create_task(handlers.handle_preference_input(update, context))
+            await asyncio.sleep(0.05)
+            assert handlers.extractions.cancel(update.effective_user.id)
+            await asyncio.wait_for(handler, timeout=1)
+
+        asyncio.run(run())
+
+        processing_msg.delete.assert_awaited_once()
+        update.message.reply_text.assert_awaited_once_with(MSG_PROCESSING)
+        assert "preference_draft" not in context.user_data
+
+    def test_timed_out_extraction_tells_the_user(self, handlers, monkeypatch):
+        """When Gemini does not answer in time the user gets the timeout message, not an empty preference."""
+        monkeypatch.setattr(config, "GEMINI_TIMEOUT", 0.05)
+        stub_llm(handlers.gemini_client, delay=5)
+        update, processing_msg = make_update()
+        context = MagicMock(user_data={})
+
+        asyncio.run(asyncio.wait_for(handlers.handle_preference_input(update, context), timeout=1))
+
+        processing_msg.delete.assert_awaited_once()
+        assert update.message.reply_text.await_args.args == (MSG_EXTRACTION_TIMEOUT,)
+        assert "preference_draft" not in context.user_data
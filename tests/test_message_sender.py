@@ -0,0 +1,650 @@
+import asyncio
+import logging
+import threading
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch, MagicMock, AsyncMock
+from bson import ObjectId
+from pymongo import UpdateOne
+from telegram.error import TelegramError, Forbidden, BadRequest, RetryAfter
+from core.async_mongo_client import AsyncMongoClientManager
+from core.constants import OUTBOX_INACTIVE_CHAT_ERROR, OUTBOX_STATUS_LEASED
+from core.mongo_client import MongoClientManager, delivery_priority
+from core.offer_query import compile_offer_filter, price_bounds
+from models.offer import Offer
+from models.preferences import UserPreferences, Preference, Location, Category, Price
+from runners.ack_buffer import DeliveryAckBuffer
+from runners.matching import BatchMatcher, PreferenceSnapshot
+from runners.message_sender import MessageSender, is_dead_chat_error
+from runners.offer_events import QueueOfferSource, WatermarkPollingOfferSource
+from utils.helpers import as_utc
+
+@pytest.fixture
+def mongo_client():
+    """Mock MongoDB client."""
+    return MagicMock(spec=MongoClientManager)
+
+@pytest.fixture
+def sender(mongo_client):
+    """Create sender instance with mocked mongo client and bot."""
+    with patch("runners.message_sender.Bot"):
+        sender = MessageSender()
+    sender.mongo_client = mongo_client
+    sender.async_mongo_client = AsyncMongoClientManager(mongo_client)
+    sender.bot = MagicMock()
+    sender.bot.send_photo = AsyncMock()
+    sender.bot.send_message = AsyncMock()
+    return sender
+
+def make_offer(offer_id: str = "offer_1", **overrides) -> Offer:
+    data = {
+        "_id": offer_id,
+        "title": "Free table",
+        "description": "Solid wood",
+        "address": "55130 Mainz",
+        "link": f"https://www.kleinanzeigen.de/{offer_id}",
+        "offer_date": "2025-07-19",
+        "location": {"city_id": "l5315", "state_id": "l4938"},
+        "category": {"category_id": "c80", "subcategory_id": "c86"},
+        "price": 0.0,
+    }
+    data.update(overrides)
+    return Offer(**data)
+
+def make_entry(offer_id: str = "offer_1", user_id: int = 1, preference_ids: tuple = ("pref_1",)) -> dict:
+    return {
+        "_id": f"{user_id}:{offer_id}",
+        "user_id": user_id,
+        "matches": [{"preference_id": pref_id, "label": f"Label {pref_id}"} for pref_id in preference_ids],
+        "offer_id": offer_id,
+        "attempts": 1,
+        "lease_owner": "worker:token",
+    }
+
+def matches_preference(offer: Offer, preference: Preference, now: datetime) -> bool:
+    """Plain check of one pair, the reference for the vectorised matcher."""
+    low, high = price_bounds(preference.price)
+    return (
+        (not preference.location.city_id or offer.location.city_id == preference.location.city_id)
+        and (not preference.location.state_id or offer.location.state_id == preference.location.state_id)
+        and (not preference.category.category_id or offer.category.category_id == preference.category.category_id)
+        and (not preference.category.subcategory_id
+             or offer.category.subcategory_id == preference.category.subcategory_id)
+        and low <= offer.price <= high
+        and as_utc(offer.created_at) >= now - timedelta(seconds=preference.time_window)
+    )
+
+def make_match(offer_id: str = "offer_1", price: float = 0.0, age: timedelta = timedelta(minutes=5)) -> dict:
+    """An offer as returned by get_matching_offers."""
+    return {"_id": offer_id, "created_at": datetime.now(timezone.utc) - age, "price": price}
+
+class TestDeliveryAckBuffer:
+
+    def test_flushes_when_size_threshold_reached(self, mongo_client):
+        """Acks are written as one bulk write once the buffer is full."""
+        async def run():
+            async with DeliveryAckBuffer(mongo_client, max_size=2, max_interval=60) as acks:
+                await acks.add(1, "pref_1", "offer_1")
+                mongo_client.mark_offers_as_sent_bulk.assert_not_called()
+                await acks.add(1, "pref_1", "offer_2")
+                mongo_client.mark_offers_as_sent_bulk.assert_called_once_with(
+                    [(1, "pref_1", "offer_1"), (1, "pref_1", "offer_2")]
+                )
+
+        asyncio.run(run())
+
+    def test_flushes_pending_acks_on_exit(self, mongo_client):
+        """Leaving the context flushes acks even if an error interrupts sending."""
+        async def run():
+            async with DeliveryAckBuffer(mongo_client, max_size=100, max_interval=60) as acks:
+                await acks.add(1, "pref_1", "offer_1")
+                raise RuntimeError("sender crashed")
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(run())
+        mongo_client.mark_offers_as_sent_bulk.assert_called_once_with([(1, "pref_1", "offer_1")])
+
+    def test_failed_flush_keeps_acks_for_retry(self, mongo_client):
+        """A failed bulk write keeps the acks buffered."""
+        mongo_client.mark_offers_as_sent_bulk.side_effect = [Exception("network"), 1]
+
+        async def run():
+            acks = DeliveryAckBuffer(mongo_client, max_size=100, max_interval=60)
+            await acks.add(1, "pref_1", "offer_1")
+            assert await acks.flush() == 0
+            assert len(acks) == 1
+            assert await acks.flush() == 1
+            assert len(acks) == 0
+
+        asyncio.run(run())
+
+    def test_bulk_ack_groups_offers_per_preference(self):
+        """Acks for the same preference are merged into one $addToSet."""
+        manager = MongoClientManager.__new__(MongoClientManager)
+        manager.user_preferences_collection = MagicMock()
+        manager.outbox_collection = MagicMock()
+
+        manager.mark_offers_as_sent_bulk([
+            (1, "pref_1", "offer_1"),
+            (1, "pref_1", "offer_2"),
+            (2, "pref_2", "offer_1"),
+        ])
+
+        operations = manager.user_preferences_collection.bulk_write.call_args.args[0]
+        assert len(operations) == 2
+        assert operations[0] == UpdateOne(
+            {"user_id": 1, "preferences._id": "pref_1"},
+            {"$addToSet": {"preferences.$.sent_offers": {"$each": ["offer_1", "offer_2"]}}}
+        )
+        assert manager.user_preferences_collection.bulk_write.call_args.kwargs == {"ordered": False}
+
+    def test_preference_id_is_loaded_from_mongo(self):
+        """Stored preference IDs are available for acknowledgements."""
+        user_prefs = UserPreferences(**{
+            "user_id": 1,
+            "preferences": [{"_id": "pref_1", "location": {}, "category": {}}]
+        })
+        assert user_prefs.preferences[0].id == "pref_1"
+
+    def test_offer_object_id_is_coerced_to_str(self):
+        """Offers read back from Mongo with an ObjectId get a string id."""
+        object_id = ObjectId()
+        assert make_offer(object_id).id == str(object_id)
+
+class TestOutboxDelivery:
+
+    def test_successful_delivery_is_acknowledged(self, sender, mongo_client):
+        """Sent deliveries are acked and the outbox is drained."""
+        mongo_client.claim_deliveries.side_effect = [[make_entry()], []]
+        mongo_client.get_offers.return_value = [make_offer()]
+
+        assert asyncio.run(sender.deliver_pending()) == 1
+
+        mongo_client.mark_offers_as_sent_bulk.assert_called_once_with([(1, "pref_1", "offer_1")])
+        mongo_client.fail_delivery.assert_not_called()
+        mongo_client.release_deliveries.assert_not_called()
+
+    def test_notify_latency_is_reported_per_scrape_lane(self, sender, mongo_client, caplog):
+        """The lane comes from the offer, a priced item found by the free lane counts as free lane."""
+        mongo_client.claim_deliveries.side_effect = [[make_entry()], []]
+        mongo_client.get_offers.return_value = [make_offer(price=5.0, lane="free")]
+        caplog.set_level(logging.INFO, logger="runners.message_sender")
+
+        assert asyncio.run(sender.deliver_pending()) == 1
+
+        assert "Time to notify (free lane, 1 offers)" in caplog.text
+
+    def test_failed_delivery_is_scheduled_for_retry(self, sender, mongo_client):
+        """Telegram errors hand the entry back to the outbox instead of acking it."""
+        entry = make_entry()
+        mongo_client.claim_deliveries.side_effect = [[entry], []]
+        mongo_client.get_offers.return_value = [make_offer()]
+        mongo_client.fail_delivery.return_value = False
+        sender.bot.send_message.side_effect = TelegramError("boom")
+
+        assert asyncio.run(sender.deliver_pending()) == 0
+
+        mongo_client.fail_delivery.assert_called_once_with(entry, "boom")
+        mongo_client.mark_offers_as_sent_bulk.assert_not_called()
+
+    def test_interrupted_delivery_releases_unprocessed_leases(self, sender, mongo_client):
+        """Leases that were not processed are released when the sender stops."""
+        first, second = make_entry("offer_1"), make_entry("offer_2")
+        mongo_client.claim_deliveries.return_value = [first, second]
+        mongo_client.get_offers.return_value = [make_offer("offer_1"), make_offer("offer_2")]
+        sender.bot.send_message.side_effect = [None, KeyboardInterrupt()]
+
+        with pytest.raises(KeyboardInterrupt):
+            asyncio.run(sender.deliver_pending())
+
+        mongo_client.release_deliveries.assert_called_once_with([second], retry_after=None)
+        mongo_client.mark_offers_as_sent_bulk.assert_called_once_with([(1, "pref_1", "offer_1")])
+
+    def test_rate_limit_hands_back_the_batch_uncounted(self, sender, mongo_client):
+        """A RetryAfter stops the run and releases the rest of the batch until the limit lifts."""
+        first, second, third = make_entry("offer_1"), make_entry("offer_2"), make_entry("offer_3")
+        mongo_client.claim_deliveries.return_value = [first, second, third]
+        mongo_client.get_offers.return_value = [make_offer(f"offer_{i}") for i in (1, 2, 3)]
+        sender.bot.send_message.side_effect = [None, RetryAfter(30)]
+
+        assert asyncio.run(sender.deliver_pending()) == 1
+
+        mongo_client.claim_deliveries.assert_called_once()
+        mongo_client.fail_delivery.assert_not_called()
+        mongo_client.release_deliveries.assert_called_once_with([second, third], retry_after=30)
+
+    def test_released_entries_wait_for_retry_after(self):
+        """Released entries give back their attempt, and after a rate limit wait for it to lift."""
+        manager = MongoClientManager.__new__(MongoClientManager)
+        manager.outbox_collection = MagicMock()
+
+        manager.release_deliveries([make_entry()], retry_after=30)
+
+        update = manager.outbox_collection.update_many.call_args.args[1]
+        assert update["$inc"] == {"attempts": -1}
+        assert update["$set"]["available_at"] > datetime.now(timezone.utc) + timedelta(seconds=25)
+
+    def test_cancelled_delivery_releases_leases_off_the_event_loop(self, sender, mongo_client):
+        """Stopping the sender (SIGTERM cancels its task) still hands back the unprocessed leases."""
+        first, second = make_entry("offer_1"), make_entry("offer_2")
+        mongo_client.claim_deliveries.return_value = [first, second]
+        mongo_client.get_offers.return_value = [make_offer("offer_1"), make_offer("offer_2")]
+        loop_threads = []
+
+        async def slow_send(**kwargs):
+            await asyncio.sleep(1)
+
+        sender.bot.send_message.side_effect = slow_send
+
+        async def run():
+            loop_threads.append(threading.get_ident())
+            task = asyncio.create_task(sender.deliver_pending())
+            await asyncio.sleep(0.1)  # still sending the first offer
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        mongo_client.release_deliveries.side_effect = lambda entries, **kwargs: loop_threads.append(threading.get_ident())
+        asyncio.run(run())
+
+        mongo_client.release_deliveries.assert_called_once_with([first, second], retry_after=None)
+        mongo_client.mark_offers_as_sent_bulk.assert_not_called()
+        assert loop_threads[1] != loop_threads[0]
+
+class TestDeliveryScheduling:
+
+    def test_fresh_free_offers_outrank_older_ones(self):
+        """Priority favours fresh offers, free items and short time windows."""
+        now = datetime.now(timezone.utc)
+        fresh = delivery_priority(now, 20.0, 604800)
+        assert fresh > delivery_priority(now - timedelta(hours=2), 20.0, 604800)
+        assert delivery_priority(now - timedelta(minutes=30), 0.0, 604800) > fresh
+        assert delivery_priority(now - timedelta(minutes=10), 20.0, 86400) > fresh
+
+    def test_claim_caps_deliveries_per_user(self):
+        """One user's backlog cannot take the whole claim batch."""
+        manager = MongoClientManager.__new__(MongoClientManager)
+        manager.outbox_collection = MagicMock()
+        candidates = [{"_id": f"1:offer_{i}", "user_id": 1} for i in range(5)] + [{"_id": "2:offer_9", "user_id": 2}]
+        manager.outbox_collection.find.return_value.sort.return_value.limit.return_value = candidates
+
+        manager.claim_deliveries("worker", limit=3, per_user_cap=2)
+
+        claimed = manager.outbox_collection.update_many.call_args.args[0]["_id"]["$in"]
+        assert claimed == ["1:offer_0", "1:offer_1", "2:offer_9"]
+        # The claimed entries are read back through the status index
+        assert manager.outbox_collection.find.call_args.args[0]["status"] == OUTBOX_STATUS_LEASED
+
+    def test_deliveries_are_queued_with_priorities(self, sender, mongo_client):
+        """Every queued delivery carries the priority of its offer."""
+        user_prefs = UserPreferences(user_id=1, preferences=[
+            Preference(_id="pref_1", location=Location(city_id="l5315"), category=Category(category_id="c80"))
+        ])
+        mongo_client.iter_user_preferences.return_value = [user_prefs]
+        mongo_client.get_inactive_user_stats.return_value = (0, 0)
+        mongo_client.get_matching_offers.return_value = [
+            make_match("offer_old", age=timedelta(days=1)), make_match("offer_new")
+        ]
+        mongo_client.enqueue_deliveries.return_value = 2
+
+        sender.enqueue_pending_deliveries()
+
+        _, _, priorities = mongo_client.enqueue_deliveries.call_args.args
+        assert priorities[(1, "pref_1", "offer_new")] > priorities[(1, "pref_1", "offer_old")]
+
+class TestCrossPreferenceDedupe:
+
+    def test_offer_matching_two_preferences_is_sent_once(self, sender, mongo_client):
+        """One message per user, acknowledged for every preference that matched."""
+        mongo_client.claim_deliveries.side_effect = [[make_entry(preference_ids=("pref_1", "pref_2"))], []]
+        mongo_client.get_offers.return_value = [make_offer()]
+
+        assert asyncio.run(sender.deliver_pending()) == 1
+
+        assert sender.bot.send_message.call_count == 1
+        assert "Label pref\\_1; Label pref\\_2" in sender.bot.send_message.call_args.kwargs["text"]
+        mongo_client.mark_offers_as_sent_bulk.assert_called_once_with(
+            [(1, "pref_1", "offer_1"), (1, "pref_2", "offer_1")]
+        )
+
+    def test_offers_sent_through_other_preferences_are_excluded(self, sender, mongo_client):
+        """Matching skips offers the user already got through another preference."""
+        user_prefs = UserPreferences(
+            user_id=1,
+            preferences=[
+                Preference(_id="pref_1", location=Location(state_id="l4938"),
+                           category=Category(category_id="c80"), sent_offers=["offer_1"]),
+                Preference(_id="pref_2", location=Location(city_id="l5315"),
+                           category=Category(subcategory_id="c86"))
+            ]
+        )
+        mongo_client.iter_user_preferences.return_value = [user_prefs]
+        mongo_client.get_inactive_user_stats.return_value = (0, 0)
+        mongo_client.get_matching_offers.return_value = [make_match("offer_2")]
+        mongo_client.enqueue_deliveries.return_value = 1
+
+        sender.enqueue_pending_deliveries()
+
+        for call in mongo_client.get_matching_offers.call_args_list:
+            assert call.args[0]["_id"] == {"$nin": ["offer_1"]}
+        deliveries, labels, _ = mongo_client.enqueue_deliveries.call_args.args
+        assert deliveries == [(1, "pref_1", "offer_2"), (1, "pref_2", "offer_2")]
+        assert set(labels) == {"pref_1", "pref_2"}
+
+class TestSharedMatching:
+
+    def test_identical_preferences_share_one_query(self, sender, mongo_client):
+        """Users with the same preference are matched with a single query."""
+        def same_preference(pref_id, sent_offers):
+            return Preference(_id=pref_id, location=Location(city_id="l5315"),
+                              category=Category(category_id="c80"), sent_offers=sent_offers)
+
+        mongo_client.iter_user_preferences.return_value = [
+            UserPreferences(user_id=1, preferences=[same_preference("pref_1", ["offer_1"])]),
+            UserPreferences(user_id=2, preferences=[same_preference("pref_2", ["offer_1", "offer_2"])]),
+        ]
+        mongo_client.get_inactive_user_stats.return_value = (0, 0)
+        mongo_client.get_matching_offers.return_value = [make_match("offer_2"), make_match("offer_3")]
+        mongo_client.enqueue_deliveries.return_value = 1
+
+        sender.enqueue_pending_deliveries()
+
+        mongo_client.get_matching_offers.assert_called_once()
+        assert mongo_client.get_matching_offers.call_args.args[0]["_id"] == {"$nin": ["offer_1"]}
+        queued = [call.args[0] for call in mongo_client.enqueue_deliveries.call_args_list]
+        assert queued == [[(1, "pref_1", "offer_2"), (1, "pref_1", "offer_3")], [(2, "pref_2", "offer_3")]]
+
+    def test_user_preferences_are_streamed_from_a_batched_cursor(self):
+        """Users are parsed lazily as the cursor yields them."""
+        manager = MongoClientManager.__new__(MongoClientManager)
+        manager.user_preferences_collection = MagicMock()
+        manager.user_preferences_collection.find.return_value = iter([{"user_id": 1}, {"user_id": 2}])
+
+        stream = manager.iter_user_preferences(batch_size=10)
+        assert next(stream).user_id == 1
+
+        manager.user_preferences_collection.find.assert_called_once_with({"inactive_since": None}, batch_size=10)
+        assert [user_prefs.user_id for user_prefs in stream] == [2]
+
+class TestAggregatedMatching:
+
+    def test_aggregated_matches_are_queued_with_labels(self, sender, mongo_client):
+        """The aggregation strategy queues every streamed match without per-preference queries."""
+        preference = Preference(_id="pref_1", location=Location(city="Mainz", city_id="l5315"),
+                                category=Category(category="Möbel", category_id="c80"))
+        mongo_client.iter_pending_matches.return_value = iter([
+            (1, preference, [make_match("offer_1"), make_match("offer_2")]),
+            (2, preference.model_copy(update={"id": "pref_2"}), [make_match("offer_1")]),
+        ])
+        mongo_client.enqueue_deliveries.return_value = 3
+
+        assert sender.enqueue_pending_deliveries(strategy="aggregate") == 3
+
+        mongo_client.get_matching_offers.assert_not_called()
+        deliveries, labels, _ = mongo_client.enqueue_deliveries.call_args.args
+        assert deliveries == [(1, "pref_1", "offer_1"), (1, "pref_1", "offer_2"), (2, "pref_2", "offer_1")]
+        assert set(labels) == {"pref_1", "pref_2"}
+
+class TestDaemonMatching:
+
+    def test_new_preferences_catch_up_with_shared_queries(self, sender, mongo_client):
+        """Preferences added since the last refresh are matched grouped, known ones are not queried again."""
+        def preference(pref_id, city_id):
+            return Preference(_id=pref_id, location=Location(city_id=city_id), category=Category(category_id="c80"))
+
+        mongo_client.get_users_to_probe.return_value = []
+        mongo_client.get_inactive_user_stats.return_value = (0, 0)
+        mongo_client.get_all_user_preferences.return_value = [
+            UserPreferences(user_id=1, preferences=[preference("pref_1", "l5315"), preference("pref_2", "l6411")]),
+            UserPreferences(user_id=2, preferences=[preference("pref_3", "l6411")]),
+        ]
+        mongo_client.get_matching_offers.return_value = [make_match("offer_1")]
+        mongo_client.enqueue_deliveries.return_value = 1
+        known_preference_ids = {"pref_1"}
+
+        snapshot = asyncio.run(sender._refresh_preferences(known_preference_ids))
+
+        mongo_client.get_matching_offers.assert_called_once()
+        assert mongo_client.get_matching_offers.call_args.args[0]["location.city_id"] == "l6411"
+        queued = [call.args[0] for call in mongo_client.enqueue_deliveries.call_args_list]
+        assert queued == [[(1, "pref_2", "offer_1")], [(2, "pref_3", "offer_1")]]
+        assert known_preference_ids == {"pref_1", "pref_2", "pref_3"} == set(snapshot.labels)
+
+    def test_new_offers_are_matched_against_preference_snapshot(self, sender):
+        """Only matching, not yet sent offers are queued for delivery."""
+        user_prefs = UserPreferences(
+            user_id=1,
+            preferences=[
+                Preference(
+                    _id="pref_1",
+                    location=Location(city_id="l5315", state_id="l4938"),
+                    category=Category(category_id="c80", subcategory_id="c86"),
+                    sent_offers=["offer_2"]
+                ),
+                Preference(
+                    _id="pref_2",
+                    location=Location(city_id="l6411"),
+                    category=Category(category_id="c80")
+                )
+            ]
+        )
+        offers = [make_offer("offer_1").model_dump(by_alias=True), make_offer("offer_2").model_dump(by_alias=True)]
+
+        deliveries = sender._match_new_offers(offers, PreferenceSnapshot([user_prefs], {}))
+
+        assert list(deliveries) == [(1, "pref_1", "offer_1")]
+
+    def test_preferences_are_compiled_once_per_snapshot(self, sender):
+        """New offer batches reuse the compiled preferences of the snapshot."""
+        user_prefs = UserPreferences(
+            user_id=1,
+            preferences=[Preference(_id="pref_1", location=Location(city_id="l5315"), category=Category())]
+        )
+
+        with patch("runners.matching.BatchMatcher", wraps=BatchMatcher) as matcher:
+            snapshot = PreferenceSnapshot([user_prefs], {"pref_1": "Label"})
+            first = sender._match_new_offers([make_offer("offer_1").model_dump(by_alias=True)], snapshot)
+            second = sender._match_new_offers([make_offer("offer_2").model_dump(by_alias=True)], snapshot)
+
+        matcher.assert_called_once()
+        assert list(first) == [(1, "pref_1", "offer_1")]
+        assert list(second) == [(1, "pref_1", "offer_2")]
+
+    def test_queue_source_batches_published_offers(self):
+        """Offers published from another thread are returned as one batch."""
+        async def run():
+            source = QueueOfferSource(poll_interval=0.01)
+            source.publish([{"_id": "offer_1"}])
+            source.publish([{"_id": "offer_2"}])
+            await asyncio.sleep(0)
+            assert [offer["_id"] for offer in await source.next_batch()] == ["offer_1", "offer_2"]
+            assert await source.next_batch() == []
+
+        asyncio.run(run())
+
+class InMemoryOffers:
+    """Just enough of an offers collection for the polling source."""
+
+    def __init__(self):
+        self.docs = []
+
+    def insert_many(self, docs, ordered=True):
+        self.docs.extend(dict(doc) for doc in docs)
+        return MagicMock(inserted_ids=[doc["_id"] for doc in docs])
+
+    def find(self, query):
+        (field, condition), = ((key, value) for key, value in query.items() if key != "_id")
+        seen = set(query["_id"]["$nin"])
+        docs = [doc for doc in self.docs if doc[field] >= condition["$gte"] and doc["_id"] not in seen]
+        cursor = MagicMock()
+        cursor.sort.return_value.limit.side_effect = lambda n: sorted(docs, key=lambda doc: doc[field])[:n]
+        return cursor
+
+class TestOfferPolling:
+
+    def test_offers_of_a_slower_lane_are_not_skipped(self):
+        """A regular-lane offer scraped earlier but inserted after a free-lane offer is still polled."""
+        manager = MongoClientManager.__new__(MongoClientManager)
+        manager.offers_collection = InMemoryOffers()
+        source = WatermarkPollingOfferSource(manager, watermark=datetime.now(timezone.utc) - timedelta(seconds=1))
+
+        now = datetime.now(timezone.utc)
+        regular = {"_id": "regular", "created_at": now - timedelta(minutes=5)}
+        free = {"_id": "free", "created_at": now}
+
+        manager.create_offers([free])
+        assert [offer["_id"] for offer in source._read_batch()] == ["free"]
+        manager.create_offers([regular])
+        assert [offer["_id"] for offer in source._read_batch()] == ["regular"]
+        assert source._read_batch() == []
+
+class TestPhotoFileIdCache:
+
+    def test_second_recipient_gets_cached_file_id(self, sender, mongo_client):
+        """Only the first send uploads the photo from its URL."""
+        offer = make_offer(photos=["https://img.kleinanzeigen.de/1.jpg"])
+        sender.bot.send_photo.return_value = MagicMock(photo=[MagicMock(file_id="small"), MagicMock(file_id="large")])
+
+        asyncio.run(sender._send_offer_to_user(1, offer))
+        asyncio.run(sender._send_offer_to_user(2, offer))
+
+        photos = [call.kwargs["photo"] for call in sender.bot.send_photo.call_args_list]
+        assert photos == ["https://img.kleinanzeigen.de/1.jpg", "large"]
+        mongo_client.set_offer_photo_file_id.assert_called_once_with(offer.id, "large")
+
+class TestRenderCache:
+
+    def test_offer_is_rendered_once_for_all_recipients(self, sender):
+        """Recipients of the same offer share one rendered payload."""
+        offer = make_offer()
+
+        with patch.object(sender, "_render_offer", wraps=sender._render_offer) as render:
+            for user_id in (1, 2, 3):
+                asyncio.run(sender._send_offer_to_user(user_id, offer))
+
+        render.assert_called_once_with(offer)
+        texts = {call.kwargs["text"] for call in sender.bot.send_message.call_args_list}
+        assert len(texts) == 1
+
+    def test_markdown_in_scraped_text_is_escaped(self, sender):
+        """Markdown control characters in titles cannot break the message."""
+        offer = make_offer(title="Tisch *neu* [OVP]", description="Maße: 120_80")
+
+        rendered = sender._render_offer(offer)
+
+        assert rendered.text.startswith("**Tisch \\*neu\\* \\[OVP]**")
+        assert "120\\_80" in rendered.text
+        assert rendered.caption == "Tisch *neu* [OVP]"
+
+class TestDeadChatRegistry:
+
+    def test_blocked_chat_is_marked_inactive(self, sender, mongo_client):
+        """A blocked chat is deactivated and its remaining deliveries are skipped."""
+        first, second = make_entry("offer_1"), make_entry("offer_2")
+        mongo_client.claim_deliveries.side_effect = [[first, second], []]
+        mongo_client.get_offers.return_value = [make_offer("offer_1"), make_offer("offer_2")]
+        mongo_client.mark_user_inactive.return_value = 2
+        sender.bot.send_message.side_effect = Forbidden("Forbidden: bot was blocked by the user")
+
+        assert asyncio.run(sender.deliver_pending()) == 0
+
+        mongo_client.mark_user_inactive.assert_called_once_with(1)
+        assert sender.bot.send_message.call_count == 1
+        assert sender.api_calls_saved == 1
+        # The skipped lease is never left behind
+        mongo_client.fail_delivery.assert_called_once_with(second, OUTBOX_INACTIVE_CHAT_ERROR, max_attempts=0)
+        mongo_client.release_deliveries.assert_not_called()
+
+    def test_user_reactivated_by_start_gets_deliveries_again(self, sender, mongo_client):
+        """A running daemon delivers to a user who sent /start after being marked inactive."""
+        mongo_client.get_offers.return_value = [make_offer("offer_1"), make_offer("offer_2")]
+        mongo_client.claim_deliveries.side_effect = [[make_entry("offer_1")], []]
+        mongo_client.mark_user_inactive.return_value = 1
+        sender.bot.send_message.side_effect = Forbidden("Forbidden: bot was blocked by the user")
+        assert asyncio.run(sender.deliver_pending()) == 0
+        mongo_client.mark_user_inactive.assert_called_once_with(1)
+
+        # /start reactivates the user in Mongo only, the next run must not remember the old state
+        mongo_client.claim_deliveries.side_effect = [[make_entry("offer_2")], []]
+        sender.bot.send_message.side_effect = None
+        assert asyncio.run(sender.deliver_pending()) == 1
+        mongo_client.mark_offers_as_sent_bulk.assert_called_once_with([(1, "pref_1", "offer_2")])
+
+    def test_dead_chat_errors_are_classified(self):
+        """Only blocked or missing chats count as dead."""
+        assert is_dead_chat_error(Forbidden("Forbidden: user is deactivated"))
+        assert is_dead_chat_error(BadRequest("Chat not found"))
+        assert not is_dead_chat_error(BadRequest("Can't parse entities"))
+
+    def test_reachable_chats_are_reactivated_by_probe(self, sender, mongo_client):
+        """Probing reactivates chats that accept messages again."""
+        mongo_client.get_users_to_probe.return_value = [1, 2]
+        sender.bot.send_chat_action = AsyncMock(side_effect=[None, Forbidden("blocked")])
+
+        assert asyncio.run(sender.probe_inactive_users()) == 1
+
+        mongo_client.reactivate_user.assert_called_once_with(1)
+        mongo_client.set_user_probed.assert_called_once_with(2)
+
+class TestBatchMatcher:
+
+    def test_batch_matches_agree_with_loop(self):
+        """The vectorised matcher finds exactly the pairs the per-pair check finds."""
+        now = datetime(2025, 7, 20, tzinfo=timezone.utc)
+        offers = [
+            make_offer("offer_1"),
+            make_offer("offer_2", price=80.0),
+            make_offer("offer_3", location={"city_id": "l6411", "state_id": "l4938"}),
+            make_offer("offer_4", category={"category_id": "c80", "subcategory_id": "c91"}),
+            make_offer("offer_5", created_at=now - timedelta(days=3)),
+            # Naive datetimes as loaded from Mongo are treated as UTC
+            make_offer("offer_6", created_at=(now - timedelta(hours=1)).replace(tzinfo=None)),
+        ]
+        preferences = [
+            Preference(location=Location(city_id="l5315"), category=Category(category_id="c80")),
+            Preference(location=Location(state_id="l4938"), category=Category(subcategory_id="c86"), time_window=86400),
+            Preference(location=Location(), category=Category(), price=Price(price_from=10, price_to=100)),
+            Preference(location=Location(city_id="l0000"), category=Category()),
+        ]
+
+        pref_indices, offer_indices = BatchMatcher(preferences).match(offers, now=now)
+
+        expected = [
+            (p, o) for p, preference in enumerate(preferences) for o, offer in enumerate(offers)
+            if matches_preference(offer, preference, now)
+        ]
+        assert list(zip(pref_indices.tolist(), offer_indices.tolist())) == expected
+        assert (2, 1) in expected and not any(p == 3 for p, _ in expected)
+
+class TestOfferFilterCompiler:
+
+    def test_preference_compiles_to_full_filter(self):
+        """Location, category, price and time window are all pushed down to Mongo."""
+        now = datetime(2025, 7, 20, tzinfo=timezone.utc)
+        preference = Preference(
+            location=Location(city_id="l5315", state_id="l4938"),
+            category=Category(category_id="c80"),
+            price=Price(price_from=10, price_to=50),
+            time_window=86400,
+        )
+
+        assert compile_offer_filter(preference, now=now, exclude_ids=["offer_1"]) == {
+            "location.city_id": "l5315",
+            "location.state_id": "l4938",
+            "category.category_id": "c80",
+            "price": {"$gte": 10.0, "$lte": 50.0},
+            "created_at": {"$gte": now - timedelta(days=1)},
+            "_id": {"$nin": ["offer_1"]},
+        }
+
+    def test_price_semantics_match_the_python_check(self):
+        """Free-only and open-ended ranges filter the same way in Mongo and in Python."""
+        free = Preference(location=Location(), category=Category())
+        from_ten = Preference(location=Location(), category=Category(), price=Price(price_from=10))
+
+        assert compile_offer_filter(free)["price"] == 0.0
+        assert compile_offer_filter(from_ten)["price"] == {"$gte": 10.0}
+        now = datetime.now(timezone.utc)
+        assert matches_preference(make_offer(price=0.0), free, now)
+        assert not matches_preference(make_offer(price=5.0), free, now)
+        assert matches_preference(make_offer(price=500.0), from_ten, now)
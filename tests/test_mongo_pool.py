@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+from core import mongo_pool
+from core.mongo_client import MongoClientManager
+from core.mongo_pool import MongoPoolStats
+
+class TestMongoPool:
+
+    def test_managers_share_one_client(self):
+        """Every manager in a process reuses the same pooled client."""
+        with patch.object(mongo_pool, "_client", None), patch("core.mongo_pool.MongoClient") as client_cls:
+            first = MongoClientManager()
+            second = MongoClientManager()
+
+        client_cls.assert_called_once()
+        assert first.client is second.client
+        assert client_cls.call_args.kwargs["event_listeners"] == [mongo_pool.pool_stats]
+
+    def test_pool_stats_track_commands_and_checkouts(self):
+        """Listener events are aggregated into pool statistics."""
+        stats = MongoPoolStats()
+        stats.started(SimpleNamespace())
+        stats.succeeded(SimpleNamespace(duration_micros=2500))
+        stats.connection_created(SimpleNamespace())
+        stats.connection_checked_out(SimpleNamespace())
+        stats.connection_checked_out(SimpleNamespace())
+        stats.connection_checked_in(SimpleNamespace())
+
+        snapshot = stats.snapshot()
+        assert snapshot["commands_succeeded"] == 1
+        assert snapshot["command_time_ms"] == 2.5
+        assert snapshot["connections_open"] == 1
+        assert snapshot["checked_out"] == 1
+        assert snapshot["peak_checked_out"] == 2
@@ -0,0 +1,126 @@
+import pytest
+
+from llm.resolvers import CategoryResolver, CityResolver, ZipCodeResolver, normalize_name
+
+CITIES = {
+    "Hessen": {"id": "l4279", "cities": {"Frankfurt am Main": "l4292", "Neustadt": "l14655", "Wiesbaden": "l4897"}},
+    "Bayern": {"id": "l5510", "cities": {"München": "l6411", "Neustadt": "l10397"}},
+    "Brandenburg": {"id": "l7711", "cities": {"Frankfurt (Oder)": "l7950"}},
+    "Sachsen-Anhalt": {"id": "l2165", "cities": {"Halle": "l2409"}},
+    "Nordrhein-Westfalen": {"id": "l928", "cities": {"Halle (Westfalen)": "l1593"}},
+}
+ZIPCODES = {
+    "60311": {"state": "Hessen", "city": "Frankfurt am Main"},
+    "60313": {"state": "Hessen", "city": "Frankfurt am Main"},
+    "60599": {"state": "Hessen", "city": "Wiesbaden"},
+    "80331": {"state": "Bayern", "city": "München"},
+    "06108": {"state": "Sachsen-Anhalt", "city": "Halle (Saale)"},
+    "15230": {"state": "Brandenburg", "city": "Frankfurt (Oder) Altberesinchen"},
+    "15999": {"state": "Sachsen-Anhalt", "city": "Halle"},
+    "33790": {"state": "Nordrhein-Westfalen", "city": "Unbekanntdorf"},
+}
+CATEGORIES = {
+    "Elektronik": {"id": "c161", "subcategories": {"Konsolen": "c279", "Handy & Telefon": "c173"}},
+    "Dienstleistungen": {"id": "c297", "subcategories": {
+        "Altenpflege": "c288", "Elektronik": "c226", "Auto, Rad & Boot": "c289", "Haus & Garten": "c291"
+    }},
+    "Auto, Rad & Boot": {"id": "c210", "subcategories": {"Autos": "c216", "Fahrräder & Zubehör": "c217"}},
+    "Haus & Garten": {"id": "c80", "subcategories": {"Wohnzimmer": "c88"}},
+    "Familie, Kind & Baby": {"id": "c17", "subcategories": {"Altenpflege": "c236"}},
+}
+
+@pytest.fixture
+def cities():
+    return CityResolver(CITIES)
+
+@pytest.fixture
+def categories():
+    return CategoryResolver(CATEGORIES)
+
+class TestNormalizeName:
+
+    @pytest.mark.parametrize("a, b", [
+        ("Frankfurt am Main", "Frankfurt (Main)"),
+        ("München", "MUENCHEN"),
+        ("Gießen", "giessen"),
+        ("Halle an der Saale", "Halle (Saale)"),
+    ])
+    def test_spelling_variants_share_a_key(self, a, b):
+        assert normalize_name(a) == normalize_name(b)
+
+class TestCityResolver:
+
+    @pytest.mark.parametrize("name, city_id", [
+        ("frankfurt (main)", "l4292"),
+        ("Muenchen", "l6411"),
+        ("Frankfurt", "l4292"),
+        ("Frankfurt an der Oder", "l7950"),
+        ("Halle", "l2409"),
+        ("Wiesbdaen", "l4897"),
+    ])
+    def test_resolves_variants(self, cities, name, city_id):
+        assert cities.resolve(name)["city_id"] == city_id
+
+    def test_duplicate_names_prefer_the_given_state(self, cities):
+        assert cities.resolve("Neustadt")["city_id"] == "l14655"
+        assert cities.resolve("Neustadt", state="Bayern")["city_id"] == "l10397"
+
+    def test_unique_refuses_names_of_several_states(self, cities):
+        assert cities.resolve("Neustadt", unique=True) is None
+        assert cities.resolve("Neustadt", state="Bayern", unique=True)["city_id"] == "l10397"
+        assert cities.lookup("Wiesbaden", unique=True)["city_id"] == "l4897"
+
+    def test_states_and_unknown_names(self, cities):
+        assert cities.resolve("Bayern") == {"state": "Bayern", "state_id": "l5510"}
+        assert cities.resolve("Atlantis") is None
+        assert cities.lookup("Wiesbdaen") is None
+
+class TestZipCodeResolver:
+
+    @pytest.fixture
+    def zipcodes(self, cities):
+        return ZipCodeResolver(ZIPCODES, cities)
+
+    @pytest.mark.parametrize("code, city_id", [
+        ("60311", "l4292"),
+        ("06108", "l2409"),
+        ("15230", "l7950"),
+        ("6031", "l4292"),
+        ("60312", "l4292"),
+    ])
+    def test_codes_and_prefixes_map_to_cities(self, zipcodes, code, city_id):
+        assert zipcodes.resolve(code)["city_id"] == city_id
+
+    def test_mixed_prefixes_fall_back_to_the_common_state(self, zipcodes):
+        assert zipcodes.resolve("60") == {"state": "Hessen", "state_id": "l4279"}
+        assert zipcodes.resolve("15") is None
+
+    def test_coarse_and_unknown_codes(self, zipcodes):
+        assert zipcodes.resolve("33790") == {"state": "Nordrhein-Westfalen", "state_id": "l928"}
+        assert zipcodes.resolve("6") is None
+        assert zipcodes.resolve("99999") is None
+        assert zipcodes.resolve("Mainz") is None
+
+class TestCategoryResolver:
+
+    def test_main_category_wins_over_subcategory_of_same_name(self, categories):
+        assert categories.lookup("elektronik") == {"category": "Elektronik", "category_id": "c161"}
+
+    def test_name_parts_and_misspellings(self, categories):
+        assert categories.lookup("Handy")["subcategory_id"] == "c173"
+        assert categories.resolve("Konsolenn")["subcategory_id"] == "c279"
+
+    def test_keywords_and_main_categories_win_over_name_parts(self, categories):
+        """Parts of the Dienstleistungen subcategories "Auto, Rad & Boot" and "Haus & Garten" do not capture everyday words."""
+        assert categories.lookup("Auto") == {
+            "category": "Auto, Rad & Boot", "category_id": "c210", "subcategory": "Autos", "subcategory_id": "c216"
+        }
+        assert categories.lookup("Haus") == {"category": "Haus & Garten", "category_id": "c80"}
+        assert categories.lookup("Boot") == {"category": "Auto, Rad & Boot", "category_id": "c210"}
+
+    def test_details_keep_ids_consistent(self, categories):
+        assert categories.details("Familie, Kind & Baby", "Altenpflege")["subcategory_id"] == "c236"
+        assert categories.details(None, "Altenpflege")["category_id"] == "c297"
+        assert categories.details("Elektronik", "Altenpflege") == {
+            "category": "Dienstleistungen", "category_id": "c297", "subcategory": "Altenpflege", "subcategory_id": "c288"
+        }
@@ -0,0 +1,141 @@
+import pytest
+
+from core.constants import TIME_ONE_DAY, TIME_ONE_WEEK, TIME_TWO_DAYS, TIME_THREE_DAYS, DEFAULT_TIME_WINDOW
+from llm.resolvers import CategoryResolver, CityResolver, ZipCodeResolver
+from llm.rule_parser import RuleBasedParser, parse_price
+from utils.helpers import parse_time_window, parse_time_window_text
+
+CATEGORIES = {
+    "Haus & Garten": {"id": "c80", "subcategories": {"Wohnzimmer": "c88", "Büro": "c93", "Küche & Esszimmer": "c86"}},
+    "Elektronik": {"id": "c161", "subcategories": {"Konsolen": "c279", "Handy & Telefon": "c173"}},
+    "Auto, Rad & Boot": {"id": "c210", "subcategories": {"Autos": "c216"}},
+    "Dienstleistungen": {"id": "c297", "subcategories": {"Auto, Rad & Boot": "c289", "Haus & Garten": "c291"}},
+}
+CITIES = {
+    "Rheinland-Pfalz": {"id": "l4938", "cities": {"Mainz": "l5315"}},
+    "Hessen": {"id": "l4279", "cities": {"Frankfurt am Main": "l4292", "Neustadt": "l14655"}},
+    "Bayern": {"id": "l5510", "cities": {"München": "l6411", "Neustadt": "l10397"}},
+    "Nordrhein-Westfalen": {"id": "l928", "cities": {"Köln": "l945"}},
+}
+MAINZ = {"city": "Mainz", "city_id": "l5315", "state": "Rheinland-Pfalz", "state_id": "l4938"}
+WOHNZIMMER = {"category": "Haus & Garten", "category_id": "c80", "subcategory": "Wohnzimmer", "subcategory_id": "c88"}
+
+@pytest.fixture
+def parser():
+    cities = CityResolver(CITIES)
+    zipcodes = ZipCodeResolver({"55130": {"state": "Rheinland-Pfalz", "city": "Mainz"}}, cities)
+    return RuleBasedParser(cities, CategoryResolver(CATEGORIES), zipcodes)
+
+class TestPriceRules:
+
+    @pytest.mark.parametrize("text, expected", [
+        ("max 50 EUR", (0, 50)),
+        ("unter 30€", (0, 30)),
+        ("10-100 EUR", (10, 100)),
+        ("10 bis 100 Euro", (10, 100)),
+        ("ab 20 Euro", (20, 0)),
+        ("verschenken", (0, 0)),
+        ("50", (0, 50)),
+        ("1.500", (0, 1500)),
+        ("bis 1.000 euro", (0, 1000)),
+        ("1.500,50 €", (0, 1500)),
+        ("2,5", (0, 2)),
+    ])
+    def test_parses_common_price_answers(self, text, expected):
+        price = parse_price(text)
+        assert (price["price_from"], price["price_to"]) == expected
+
+    def test_unknown_price_is_left_to_the_llm(self):
+        assert parse_price("so billig wie möglich") is None
+
+    def test_conflicting_prices_are_left_to_the_llm(self):
+        assert parse_price("kostenlos bis 10") is None
+        assert parse_price("ab 20 max 10") is None
+
+    def test_ranges_that_may_be_model_numbers_are_left_to_the_llm(self):
+        """Only as the answer to the price question, or with a currency, is "a-b" a price."""
+        assert parse_price("10-100") == {"price_from": 10, "price_to": 100}
+        assert parse_price("iphone 11-13") is None
+        assert parse_price("iphone 11 bis 13 euro") is None
+
+class TestTimeWindowRules:
+
+    @pytest.mark.parametrize("text, expected", [
+        ("3 days", TIME_THREE_DAYS),
+        ("letzte 2 Tage", TIME_TWO_DAYS),
+        ("eine Woche", TIME_ONE_WEEK),
+        ("letzte Woche", TIME_ONE_WEEK),
+        ("48 Stunden", TIME_TWO_DAYS),
+        ("heute", TIME_ONE_DAY),
+        ("nur heute", TIME_ONE_DAY),
+    ])
+    def test_parses_time_windows(self, text, expected):
+        assert parse_time_window(text) == expected
+
+    def test_unknown_time_window(self):
+        """The strict parser reports unknown input, the lenient one keeps its default."""
+        assert parse_time_window("bald") is None
+        assert parse_time_window_text("bald") == DEFAULT_TIME_WINDOW
+
+class TestRuleBasedParser:
+
+    def test_field_edits(self, parser):
+        assert parser.parse("Mainz", "location") == {"location": MAINZ}
+        assert parser.parse("Mainzz", "location") == {"location": MAINZ}
+        assert parser.parse("Sofa", "category") == {"category": WOHNZIMMER}
+        assert parser.parse("3 days", "time_window") == {"time_window": TIME_THREE_DAYS}
+        assert parser.parse("Atlantis", "location") is None
+
+    def test_whole_preference(self, parser):
+        """Free text is answered when every word is understood."""
+        assert parser.parse("Sofa in Mainz bis 50 Euro") == {
+            "price": {"price_from": 0, "price_to": 50},
+            "category": WOHNZIMMER,
+            "location": MAINZ,
+        }
+        assert parser.parse("Xbox Controller Frankfurt am Main")["location"]["city_id"] == "l4292"
+
+    def test_whole_preference_with_grouped_amounts_and_today(self, parser):
+        assert parser.parse("Sofa bis 1.500 Euro in Mainz") == {
+            "price": {"price_from": 0, "price_to": 1500},
+            "category": WOHNZIMMER,
+            "location": MAINZ,
+        }
+        assert parser.parse("Sofa in Mainz für 100-200 Euro")["price"] == {"price_from": 100, "price_to": 200}
+        assert parser.parse("Sofa in Mainz heute") == {
+            "time_window": TIME_ONE_DAY,
+            "category": WOHNZIMMER,
+            "location": MAINZ,
+        }
+
+    def test_everyday_words_are_not_read_as_services(self, parser):
+        assert parser.parse("Auto", "category") == {"category": {
+            "category": "Auto, Rad & Boot", "category_id": "c210", "subcategory": "Autos", "subcategory_id": "c216"
+        }}
+        assert parser.parse("Haus", "category") == {"category": {"category": "Haus & Garten", "category_id": "c80"}}
+        assert parser.parse("Auto unter 5000 in Köln") == {
+            "price": {"price_from": 0, "price_to": 5000},
+            "category": {
+                "category": "Auto, Rad & Boot", "category_id": "c210", "subcategory": "Autos", "subcategory_id": "c216"
+            },
+            "location": {"city": "Köln", "city_id": "l945", "state": "Nordrhein-Westfalen", "state_id": "l928"},
+        }
+
+    def test_postal_codes(self, parser):
+        assert parser.parse("55130", "location") == {"location": MAINZ}
+        assert parser.parse("Sofa 55130 bis 100") == {
+            "price": {"price_from": 0, "price_to": 100},
+            "category": WOHNZIMMER,
+            "location": MAINZ,
+        }
+
+    def test_unknown_words_fall_back_to_llm(self, parser):
+        assert parser.parse("Vintage Sofa in Mainz") is None
+
+    def test_ambiguous_inputs_fall_back_to_llm(self, parser):
+        """A city of several states, or two price conditions, are for the LLM to sort out."""
+        assert parser.parse("Neustadt", "location") is None
+        assert parser.parse("Sofa in Neustadt") is None
+        assert parser.parse("Sofa kostenlos bis 10 in Mainz") is None
+        assert parser.parse("iPhone 11-13 in Mainz") is None
+        assert parser.parse("Konsolen 11 bis 500 Euro in Mainz") is None
@@ -3,7 +3,7 @@ from unittest.mock import patch, MagicMock
 from datetime import datetime, timezone
 from core.mongo_client import MongoClientManager
 from models.preferences import UserPreferences, Preference, Location, Category, Price
-from runners.offers_scraper import OffersScraper
+from runners.offers_scraper import OffersScraper, LANE_FREE
 
 @pytest.fixture
 def mongo_client():
@@ -204,7 +204,7 @@ class TestScraperRunner:
         )
         
         # Mock database methods
-        scraper.mongo_client.get_all_user_preferences.return_value = [user_prefs]
+        scraper.mongo_client.iter_user_preferences.return_value = [user_prefs]
         scraper.mongo_client.get_existing_offer_ids.return_value = set()
         scraper.mongo_client.create_offers.return_value = ["offer_1", "offer_2"]
         
@@ -218,6 +218,37 @@ class TestScraperRunner:
         scraper.scrape_and_save_offers()
         
         # Verify calls
-        scraper.mongo_client.get_all_user_preferences.assert_called_once()
+        scraper.mongo_client.iter_user_preferences.assert_called_once()
         mock_find_offers.assert_called_once()
         scraper.mongo_client.create_offers.assert_called_once()
+    
+    @patch('runners.offers_scraper.find_offers')
+    def test_free_lane_scrapes_first_page_of_free_preferences(self, mock_find_offers, scraper):
+        """The free lane skips priced preferences and hands new offers over right away."""
+        user_prefs = UserPreferences(
+            user_id=1,
+            preferences=[
+                Preference(
+                    location=Location(city_id="5324", state_id="10"),
+                    category=Category(category_id="86"),
+                    price=Price(price_from=0, price_to=0)
+                ),
+                Preference(
+                    location=Location(city_id="5324", state_id="10"),
+                    category=Category(category_id="88"),
+                    price=Price(price_from=10, price_to=50)
+                )
+            ]
+        )
+        scraper.mongo_client.iter_user_preferences.return_value = [user_prefs]
+        scraper.mongo_client.get_existing_offer_ids.return_value = set()
+        scraper.mongo_client.create_offers.return_value = ["offer_1"]
+        mock_find_offers.return_value = [{"_id": "offer_1", "title": "Free table", "price": 0.0}]
+        scraper.on_new_offers = MagicMock()
+        
+        assert scraper.scrape_and_save_offers(lane=LANE_FREE) == 1
+        
+        mock_find_offers.assert_called_once_with("86", "5324", set(), 0, max_pages=1)
+        scraper.on_new_offers.assert_called_once_with(
+            [{"_id": "offer_1", "title": "Free table", "price": 0.0, "lane": LANE_FREE}]
+        )
@@ -0,0 +1,80 @@
+import asyncio
+from unittest.mock import MagicMock
+
+from telegram import Update
+
+from bot.extractions import UserExtractions
+from bot.update_processor import UserOrderedUpdateProcessor
+
+def make_update(user_id: int) -> Update:
+    update = MagicMock(spec=Update)
+    update.effective_user.id = user_id
+    return update
+
+class TestUserOrderedUpdateProcessor:
+
+    def test_same_user_updates_run_in_order(self):
+        """A user's later update never starts before the earlier one finished."""
+        events = []
+
+        async def handle(name: str, delay: float):
+            events.append(f"start {name}")
+            await asyncio.sleep(delay)
+            events.append(f"end {name}")
+
+        async def run():
+            processor = UserOrderedUpdateProcessor(8, stats_interval=0)
+            await asyncio.gather(
+                processor.process_update(make_update(1), handle("first", 0.05)),
+                processor.process_update(make_update(1), handle("second", 0)),
+                processor.process_update(make_update(1), handle("third", 0)),
+            )
+            return processor
+
+        processor = asyncio.run(run())
+        assert events == ["start first", "end first", "start second", "end second", "start third", "end third"]
+        assert processor.processed == 3
+        assert processor.peak_queued == 2
+
+    def test_other_users_are_not_held_up(self):
+        """A slow update of one user does not delay another user, and queued updates free their slot."""
+        finished = []
+
+        async def handle(user_id: int, delay: float):
+            await asyncio.sleep(delay)
+            finished.append(user_id)
+
+        async def run():
+            processor = UserOrderedUpdateProcessor(2, stats_interval=0)
+            await asyncio.gather(
+                processor.process_update(make_update(1), handle(1, 0.2)),
+                processor.process_update(make_update(1), handle(1, 0)),
+                processor.process_update(make_update(2), handle(2, 0)),
+                processor.process_update(make_update(3), handle(3, 0)),
+            )
+
+        asyncio.run(run())
+        assert finished[:2] == [2, 3]
+        assert finished[2:] == [1, 1]
+
+    def test_new_update_cancels_running_extraction(self):
+        """A second message of the user cancels the extraction the first one is waiting for."""
+        extractions = UserExtractions()
+        results = []
+
+        async def extraction(text: str, delay: float) -> str:
+            await asyncio.sleep(delay)
+            return text
+
+        async def handle(text: str, delay: float):
+            results.append(await extractions.run(1, extraction(text, delay)))
+
+        async def run():
+            processor = UserOrderedUpdateProcessor(8, stats_interval=0, on_queued=extractions.cancel)
+            first = asyncio.create_task(processor.process_update(make_update(1), handle("stale", 5)))
+            await asyncio.sleep(0.01)
+            second = asyncio.create_task(processor.process_update(make_update(1), handle("fresh", 0)))
+            await asyncio.wait_for(asyncio.gather(first, second), timeout=1)
+
+        asyncio.run(run())
+        assert results == [None, "fresh"]
@@ -1,5 +1,6 @@
 """Utility functions for the Telegram bot."""
 
+import re
 from datetime import datetime, timezone
 from core.constants import (
     TIME_ONE_DAY, TIME_TWO_DAYS, TIME_THREE_DAYS, TIME_ONE_WEEK, 
@@ -10,33 +11,57 @@ def get_current_timestamp() -> datetime:
     """Get current UTC timestamp."""
     return datetime.now(timezone.utc)
 
+def as_utc(dt: datetime) -> datetime:
+    """Treat naive datetimes (as returned by pymongo) as UTC."""
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
 def format_datetime(dt: datetime) -> str:
     """Format datetime for display."""
     return dt.strftime("%Y-%m-%d %H:%M:%S UTC")
 
+# Spelled-out amounts accepted in time windows
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "ein": 1, "eine": 1, "einen": 1, "einem": 1,
+    "two": 2, "zwei": 2, "three": 3, "drei": 3, "four": 4, "vier": 4,
+    "five": 5, "fünf": 5, "six": 6, "sechs": 6, "seven": 7, "sieben": 7,
+}
+
+TIME_UNITS = {
+    "hour": 3600, "hours": 3600, "stunde": 3600, "stunden": 3600,
+    "day": TIME_ONE_DAY, "days": TIME_ONE_DAY, "tag": TIME_ONE_DAY, "tage": TIME_ONE_DAY, "tagen": TIME_ONE_DAY,
+    "week": TIME_ONE_WEEK, "weeks": TIME_ONE_WEEK, "woche": TIME_ONE_WEEK, "wochen": TIME_ONE_WEEK,
+    "month": TIME_ONE_MONTH, "months": TIME_ONE_MONTH, "monat": TIME_ONE_MONTH, "monate": TIME_ONE_MONTH,
+    "monaten": TIME_ONE_MONTH,
+}
+
+TIME_WINDOW_PATTERN = re.compile(
+    rf"\b(?:(\d+|{'|'.join(NUMBER_WORDS)})?\s*({'|'.join(sorted(TIME_UNITS, key=len, reverse=True))})"
+    r"|today|heute)\b"
+)
+
+def find_time_window(text: str) -> re.Match | None:
+    """Locate a time window such as "3 days", "eine Woche", "heute" or "letzte 48 Stunden" in text."""
+    return TIME_WINDOW_PATTERN.search(text.lower())
+
+def parse_time_window(text: str) -> int | None:
+    """Parse natural language time window to seconds, None if the text names none."""
+    match = find_time_window(text)
+    if not match:
+        return None
+    amount, unit = match.groups()
+    if unit is None:
+        # "heute", "today"
+        return TIME_ONE_DAY
+    if amount is None:
+        # "letzte Woche", "last month"
+        count = 1
+    elif amount.isdigit():
+        count = int(amount)
+    else:
+        count = NUMBER_WORDS[amount]
+    return count * TIME_UNITS[unit] if count > 0 else None
+
 def parse_time_window_text(text: str) -> int:
     """Parse natural language time window to seconds."""
-    text = text.lower().strip()
-    
-    # Common time patterns
-    time_mappings = {
-        "1 day": TIME_ONE_DAY,
-        "one day": TIME_ONE_DAY,
-        "2 days": TIME_TWO_DAYS,
-        "two days": TIME_TWO_DAYS,
-        "3 days": TIME_THREE_DAYS,
-        "three days": TIME_THREE_DAYS,
-        "1 week": TIME_ONE_WEEK,
-        "one week": TIME_ONE_WEEK,
-        "2 weeks": TIME_TWO_WEEKS,
-        "two weeks": TIME_TWO_WEEKS,
-        "1 month": TIME_ONE_MONTH,
-        "one month": TIME_ONE_MONTH,
-    }
-    
-    for pattern, seconds in time_mappings.items():
-        if pattern in text:
-            return seconds
-    
     # Default to one week
-    return DEFAULT_TIME_WINDOW
+    return parse_time_window(text) or DEFAULT_TIME_WINDOW